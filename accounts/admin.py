@@ -12,12 +12,16 @@ from .models import User
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.translation import gettext_lazy as _
 from pimxchat.models import ChatSession, ChatMessage
-from pimxchat.admin import ChatSessionAdmin, ChatMessageAdmin
+from pimxchat.admin import ChatSessionAdmin, ChatMessageAdmin, CollectingDeletesMixin
+from pimxchat.signals import collecting_deletes
+from pimxchat.pagination import BoundedCountPaginator
 from django.contrib.auth.forms import UserCreationForm
 from .forms import CustomUserCreationForm, CustomUserChangeForm
 from django.contrib.auth.models import Group, Permission
 from django.urls import path
-from .models import User, UserRating
+from .models import User, UserRating, OutboundEmail, LoginHistory
+from .satisfaction import get_distribution, refresh_rollup
+from django.utils import timezone
 from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render
 from django.contrib.auth import get_user_model
@@ -43,6 +47,13 @@ class CustomAdminSite(admin.AdminSite):
 # Create custom admin site instance
 custom_admin_site = CustomAdminSite(name='admin')
 
+def clear_chat_history(sessions):
+    """Delete chat sessions with their messages; returns the number of messages removed"""
+    # Deleting the sessions cascades to the messages without recomputing each session's stats per message
+    with collecting_deletes():
+        _, deleted = sessions.delete()
+    return deleted.get(ChatMessage._meta.label, 0)
+
 # Custom admin view for detailed user information
 @staff_member_required
 def user_detail_view(request, user_id):
@@ -50,8 +61,7 @@ def user_detail_view(request, user_id):
     
     # Handle clear chat action
     if request.method == 'POST' and request.POST.get('action') == 'clear_user_chat':
-        from pimxchat.models import ChatMessage
-        deleted_count, _ = ChatMessage.objects.filter(user=user).delete()
+        deleted_count = clear_chat_history(ChatSession.objects.filter(user=user))
         if deleted_count == 1:
             messages.success(request, f'پیام چت کاربر پاک شد.')
         else:
@@ -72,24 +82,10 @@ def user_detail_view(request, user_id):
 
 @staff_member_required
 def satisfaction_stats_view(request):
-    from django.db.models import Count
-    # Count unique users per rating (one per user per score)
-    stats = UserRating.objects.filter(user__isnull=False).values('rating', 'user').distinct()
-    rating_counts = {i: 0 for i in range(1, 6)}
-    user_lists = {i: [] for i in range(1, 6)}
-    user_emails = {}
-    # Build a map of user id to email
-    from accounts.models import User
-    for user in User.objects.all():
-        user_emails[user.id] = user.email
-    for stat in stats:
-        rating = stat['rating']
-        user_id = stat['user']
-        if user_id:
-            rating_counts[rating] += 1
-            if user_emails.get(user_id) and user_emails[user_id] not in user_lists[rating]:
-                user_lists[rating].append(user_emails[user_id])
-    total = len(set([stat['user'] for stat in stats if stat['user']]))
+    # Latest rating per user, summed from the daily rollup (see accounts/satisfaction.py);
+    # while another refresh is running the page shows the rollup as it is
+    refresh_rollup(wait=False)
+    rating_counts, total = get_distribution()
     percentages = {i: (rating_counts[i] / total * 100 if total else 0) for i in range(1, 6)}
     range_1_5 = [1, 2, 3, 4, 5]
     context = {
@@ -97,7 +93,6 @@ def satisfaction_stats_view(request):
         'percentages': percentages,
         'total': total,
         'range_1_5': range_1_5,
-        'user_lists': user_lists,
     }
     return render(request, 'admin/accounts/satisfaction_stats.html', context)
 
@@ -168,7 +163,7 @@ def user_ratings_view(request):
     return render(request, 'admin/accounts/user_ratings.html', context)
 
 
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(CollectingDeletesMixin, BaseUserAdmin):
     add_form = CustomUserCreationForm
     form = CustomUserChangeForm
     model = User
@@ -178,6 +173,8 @@ class UserAdmin(BaseUserAdmin):
     readonly_fields = ('login_count', 'last_login_time', 'last_login_ip', 'last_login_location', 'last_login_device', 
                       'profile_picture_captured', 'profile_picture_capture_time', 'date_joined')
     ordering = ('-date_joined',)
+    paginator = BoundedCountPaginator
+    show_full_result_count = False
     
     # Persian translations
     class Meta:
@@ -200,9 +197,6 @@ class UserAdmin(BaseUserAdmin):
         ('تصویر پروفایل', {
             'fields': ('profile_picture_captured', 'profile_picture_capture_time')
         }),
-        ('تایید ایمیل', {
-            'fields': ('verification_code', 'code_sent_at')
-        }),
         ('دسترسی‌ها', {
             'fields': ('groups', 'user_permissions')
         }),
@@ -288,10 +282,7 @@ class UserAdmin(BaseUserAdmin):
     view_user_details.short_description = "مشاهده جزئیات کاربر انتخاب شده"
     
     def clear_user_chat(self, request, queryset):
-        total_deleted = 0
-        for user in queryset:
-            deleted_count, _ = ChatMessage.objects.filter(user=user).delete()
-            total_deleted += deleted_count
+        total_deleted = clear_chat_history(ChatSession.objects.filter(user__in=queryset))
         
         if total_deleted == 1:
             self.message_user(request, f'پیام چت {total_deleted} کاربر پاک شد.')
@@ -299,8 +290,45 @@ class UserAdmin(BaseUserAdmin):
             self.message_user(request, f'پیام‌های چت {total_deleted} کاربر پاک شد.')
     clear_user_chat.short_description = "پاک کردن پیام‌های چت کاربران انتخاب شده"
 
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject', 'last_error')
+    readonly_fields = ('created_at', 'sent_at', 'locked_at', 'last_error')
+    actions = ['retry_emails']
+    paginator = BoundedCountPaginator
+    show_full_result_count = False
+    
+    def recipients(self, obj):
+        return ', '.join(obj.to)
+    recipients.short_description = "گیرندگان"
+    
+    def retry_emails(self, request, queryset):
+        updated = queryset.exclude(status=OutboundEmail.SENT).update(
+            status=OutboundEmail.PENDING, attempts=0, next_attempt_at=timezone.now(), locked_at=None
+        )
+        self.message_user(request, f'{updated} ایمیل دوباره در صف ارسال قرار گرفت.')
+    retry_emails.short_description = "ارسال مجدد ایمیل‌های انتخاب شده"
+
+class LoginHistoryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'logged_in_at', 'ip_address', 'location')
+    search_fields = ('user__email', 'ip_address')
+    list_select_related = ('user',)
+    date_hierarchy = 'logged_in_at'
+    paginator = BoundedCountPaginator
+    show_full_result_count = False
+    
+    # Append-only: rows are written by the login event consumer
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # Register the User model with the custom admin site
 custom_admin_site.register(User, UserAdmin)
+custom_admin_site.register(OutboundEmail, OutboundEmailAdmin)
+custom_admin_site.register(LoginHistory, LoginHistoryAdmin)
 
 # Register models with the custom admin site
 custom_admin_site.register(ChatSession, ChatSessionAdmin)
@@ -5,3 +5,6 @@ class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
     verbose_name = 'User Accounts'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
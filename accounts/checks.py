@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+from . import codes
+
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_code_cache(app_configs, **kwargs):
+    """Verification codes in a per-process cache only verify on the worker that issued them"""
+    alias = codes.get_config()['CACHE']
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend in PER_PROCESS_CACHES:
+        return [Warning(
+            f"Verification codes use the per-process cache '{alias}' ({backend}).",
+            hint="With more than one worker, codes, attempt limits and cooldowns are not shared; "
+                 "point VERIFICATION_CODES['CACHE'] at Redis or a DatabaseCache.",
+            id='accounts.W001',
+        )]
+    return []
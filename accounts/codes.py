@@ -0,0 +1,146 @@
+"""
+Verification codes for registration, 2FA login, password reset and email
+change, kept in the Django cache instead of on the User row.
+
+A code is stored as a salted HMAC under ``vcode:<purpose>:<subject>`` and
+expires after TTL seconds (the same two minutes ``utils.is_code_expired``
+has always used). Every check increments the code's attempt counter, a
+CodeAttempt row updated with ``F('attempts') + 1``: cache ``incr`` is a
+get and a set on the database cache, and concurrent guesses would read
+the same count. After MAX_ATTEMPTS wrong guesses the code is dropped and
+a new one has to be requested. A new code cannot be issued for the same
+purpose and subject within RESEND_COOLDOWN seconds.
+
+The store is the ``codes`` cache alias: Redis when REDIS_URL is set,
+otherwise a database table, so all workers share it either way. A
+per-process cache (LocMemCache) is reported by the ``accounts.W001``
+system check.
+"""
+import hmac
+import math
+import secrets
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from .models import CodeAttempt
+
+DEFAULT_CONFIG = {
+    'CACHE': 'default',
+    'LENGTH': 6,
+    'TTL': 2 * 60,
+    'MAX_ATTEMPTS': 5,
+    'RESEND_COOLDOWN': 2 * 60,
+}
+
+REGISTRATION = 'registration'
+LOGIN = 'login'
+PASSWORD_RESET = 'password_reset'
+EMAIL_CHANGE = 'email_change'
+
+VALID = 'valid'
+INVALID = 'invalid'
+EXPIRED = 'expired'
+LOCKED = 'locked'
+
+
+class CodeCooldown(Exception):
+    """A code was issued too recently; ``remaining`` is the wait in seconds"""
+
+    def __init__(self, remaining):
+        super().__init__(f'Please wait {remaining} seconds before requesting a new code')
+        self.remaining = remaining
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'VERIFICATION_CODES', {}))
+
+
+def get_cache(config):
+    return caches[config['CACHE']]
+
+
+def make_key(purpose, subject):
+    return f'vcode:{purpose}:{str(subject).lower()}'
+
+
+def digest(purpose, subject, code):
+    return salted_hmac(make_key(purpose, subject), str(code)).hexdigest()
+
+
+def issue_code(purpose, subject):
+    """Create and store a new code, returning it; raises CodeCooldown while the previous one is too fresh"""
+    config = get_config()
+    cache = get_cache(config)
+    key = make_key(purpose, subject)
+    now = time.time()
+
+    # add() is atomic, so two concurrent resends cannot both pass the cooldown
+    if config['RESEND_COOLDOWN'] and not cache.add(f'{key}:cooldown', now + config['RESEND_COOLDOWN'], config['RESEND_COOLDOWN']):
+        until = cache.get(f'{key}:cooldown') or now
+        raise CodeCooldown(max(1, math.ceil(until - now)))
+
+    code = f"{secrets.randbelow(10 ** config['LENGTH']):0{config['LENGTH']}d}"
+    cache.set(key, {'digest': digest(purpose, subject, code), 'expires_at': now + config['TTL']}, config['TTL'])
+    CodeAttempt.objects.update_or_create(key=key, defaults={
+        'attempts': 0, 'expires_at': timezone.now() + timedelta(seconds=config['TTL']),
+    })
+    return code
+
+
+def drop(cache, key):
+    cache.delete(key)
+    CodeAttempt.objects.filter(key=key).delete()
+
+
+def count_attempt(key):
+    """Increment the code's attempt counter; returns the new count, or None once it expired"""
+    with transaction.atomic():
+        # The UPDATE keeps the row locked until commit, so each guess gets its own count
+        counters = CodeAttempt.objects.filter(key=key, expires_at__gt=timezone.now())
+        if not counters.update(attempts=F('attempts') + 1):
+            return None
+        return counters.values_list('attempts', flat=True).first()
+
+
+def verify_code(purpose, subject, code):
+    """Check a submitted code: VALID (and consumed), INVALID, EXPIRED or LOCKED"""
+    config = get_config()
+    cache = get_cache(config)
+    key = make_key(purpose, subject)
+
+    entry = cache.get(key)
+    if entry is None:
+        return EXPIRED
+    attempts = count_attempt(key)
+    if attempts is None:
+        return EXPIRED
+    if attempts > config['MAX_ATTEMPTS']:
+        drop(cache, key)
+        return LOCKED
+
+    if not hmac.compare_digest(entry['digest'], digest(purpose, subject, (code or '').strip())):
+        if attempts >= config['MAX_ATTEMPTS']:
+            drop(cache, key)
+            return LOCKED
+        return INVALID
+    drop(cache, key)
+    return VALID
+
+
+def remaining_seconds(purpose, subject):
+    """Seconds until the current code expires, 0 if there is none"""
+    entry = get_cache(get_config()).get(make_key(purpose, subject))
+    if entry is None:
+        return 0
+    return max(0, int(entry['expires_at'] - time.time()))
+
+
+def discard_code(purpose, subject):
+    drop(get_cache(get_config()), make_key(purpose, subject))
@@ -0,0 +1,178 @@
+"""
+IP geolocation from a local MaxMind database (GeoLite2/GeoIP2 City .mmdb).
+
+The database is opened with MODE_MMAP, so every worker on a host shares
+one copy through the OS page cache, and lookups never leave the process.
+Recent results are kept in a small LRU. A daemon thread reopens the file
+when it changes on disk (after ``manage.py update_geoip`` or
+geoipupdate), and, when GEOIP['LICENSE_KEY'] is set, downloads a fresh
+copy itself once the file is older than MAX_AGE_DAYS.
+"""
+import ipaddress
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+
+import geoip2.database
+import geoip2.errors
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from config import timing
+from config.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN = 'Unknown'
+
+DEFAULT_CONFIG = {
+    'PATH': '',
+    'CACHE_SIZE': 10000,
+    'REFRESH_INTERVAL': 60 * 60,
+    'LICENSE_KEY': '',
+    'EDITION': 'GeoLite2-City',
+    'MAX_AGE_DAYS': 7,
+}
+
+DOWNLOAD_URL = 'https://download.maxmind.com/app/geoip_download'
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'GEOIP', {}))
+
+
+def format_location(response):
+    """'City, Region, Country', skipping parts the database does not know"""
+    parts = [response.city.name, response.subdivisions.most_specific.name, response.country.name]
+    location = ', '.join(part for part in parts if part)
+    return location or UNKNOWN
+
+
+class GeoIPService:
+    def __init__(self, path, cache_size=10000):
+        self.path = str(path)
+        self.cache = LRUCache(cache_size, ttl=24 * 60 * 60)
+        self.reader = None
+        self.mtime = None
+        self.lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """(Re)open the database if the file changed; returns True when a new file was loaded"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self.mtime:
+            return False
+        try:
+            reader = geoip2.database.Reader(self.path, mode=geoip2.database.MODE_MMAP)
+        except Exception:
+            logger.exception("Could not open GeoIP database %s", self.path)
+            return False
+        with self.lock:
+            old_reader, self.reader, self.mtime = self.reader, reader, mtime
+            self.cache.clear()
+        if old_reader is not None:
+            old_reader.close()
+        return True
+
+    def lookup(self, ip):
+        """Location string for an IP address, or 'Unknown'"""
+        try:
+            address = ipaddress.ip_address((ip or '').split(',')[0].strip())
+        except ValueError:
+            return UNKNOWN
+        if not address.is_global:
+            return UNKNOWN
+
+        key = str(address)
+        location = self.cache.get(key)
+        if location is not None:
+            return location
+
+        reader = self.reader
+        if reader is None:
+            return UNKNOWN
+        try:
+            location = format_location(reader.city(key))
+        except (geoip2.errors.AddressNotFoundError, ValueError):
+            location = UNKNOWN
+        self.cache.set(key, location)
+        return location
+
+
+def download_database(config=None):
+    """Fetch the configured MaxMind edition and atomically replace GEOIP['PATH']"""
+    config = config or get_config()
+    if not config['LICENSE_KEY']:
+        raise ValueError('GEOIP LICENSE_KEY is not set')
+
+    target = str(config['PATH'])
+    directory = os.path.dirname(target) or '.'
+    os.makedirs(directory, exist_ok=True)
+    response = requests.get(DOWNLOAD_URL, params={
+        'edition_id': config['EDITION'],
+        'license_key': config['LICENSE_KEY'],
+        'suffix': 'tar.gz',
+    }, stream=True, timeout=60)
+    response.raise_for_status()
+
+    with tempfile.TemporaryDirectory(dir=directory) as workdir:
+        archive_path = os.path.join(workdir, 'database.tar.gz')
+        with open(archive_path, 'wb') as archive_file:
+            shutil.copyfileobj(response.raw, archive_file)
+        with tarfile.open(archive_path) as archive:
+            member = next(m for m in archive.getmembers() if m.name.endswith('.mmdb'))
+            member.name = os.path.basename(member.name)
+            archive.extract(member, workdir)
+        # Same directory, so the rename is atomic; open readers keep their old mapping
+        os.replace(os.path.join(workdir, member.name), target)
+    return target
+
+
+def database_is_stale(config):
+    try:
+        age = time.time() - os.path.getmtime(config['PATH'])
+    except OSError:
+        return True
+    return age > config['MAX_AGE_DAYS'] * 24 * 60 * 60
+
+
+def refresh_loop(service, config):
+    while True:
+        time.sleep(config['REFRESH_INTERVAL'])
+        try:
+            # Only one worker downloads; the others pick the new file up by mtime
+            if config['LICENSE_KEY'] and database_is_stale(config) and cache.add('geoip:download', 1, timeout=15 * 60):
+                download_database(config)
+            service.reload()
+        except Exception:
+            logger.exception("GeoIP refresh failed")
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_geoip_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                config = get_config()
+                service = GeoIPService(config['PATH'], config['CACHE_SIZE'])
+                if config['REFRESH_INTERVAL']:
+                    threading.Thread(target=refresh_loop, args=(service, config), daemon=True, name='geoip-refresh').start()
+                _service = service
+    return _service
+
+
+def lookup_location(ip):
+    with timing.measure('geo'):
+        return get_geoip_service().lookup(ip)
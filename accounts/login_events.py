@@ -0,0 +1,176 @@
+"""
+Deferred login bookkeeping.
+
+A login only writes the Django session, ``last_login`` and one compact
+LoginEvent row (from the ``user_logged_in`` receiver in
+accounts/signals.py, which replaces Django's own ``update_last_login``).
+``last_login`` stays synchronous because ``default_token_generator``
+hashes it: a password reset or email change token issued right after a
+login must not be invalidated when a later batch writes it. Everything
+else runs later, in batches, in ``process_batch``:
+
+* geolocation (accounts/geo.py),
+* ``last_login_*``/``login_count`` on the user, one UPDATE per user per
+  batch,
+* one append-only LoginHistory row per login,
+* the login notification email (which itself goes to the outbox).
+
+It is driven by ``python manage.py process_login_events`` or, when
+LOGIN_EVENTS['USE_CELERY'] is set, by the Celery task
+``accounts.tasks.process_login_events`` queued after each login.
+"""
+import ipaddress
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import update_last_login
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .geo import lookup_location
+from .mail import build_email
+from .models import LoginEvent, LoginHistory, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'BATCH_SIZE': 200,
+    # A claimed event older than this belongs to a crashed worker and is claimed again
+    'LOCK_TIMEOUT': 5 * 60,
+    'USE_CELERY': False,
+}
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'LOGIN_EVENTS', {}))
+
+
+def clean_ip(value):
+    """The first address of REMOTE_ADDR/X-Forwarded-For, or None if it is not an IP"""
+    try:
+        return str(ipaddress.ip_address((value or '').split(',')[0].strip()))
+    except ValueError:
+        return None
+
+
+def record_login(request, user):
+    """Write last_login and queue the rest of the bookkeeping for a login"""
+    update_last_login(None, user)
+    meta = request.META if request is not None else {}
+    LoginEvent.objects.create(
+        user=user,
+        ip_address=clean_ip(meta.get('REMOTE_ADDR') or meta.get('HTTP_X_FORWARDED_FOR')),
+        user_agent=meta.get('HTTP_USER_AGENT', 'Unknown')[:500],
+    )
+    if get_config()['USE_CELERY']:
+        transaction.on_commit(trigger_celery)
+
+
+def trigger_celery():
+    from .tasks import process_login_events
+    try:
+        process_login_events.delay()
+    except Exception:
+        # Broker down: the event waits for the next run or the DB worker
+        logger.exception("Could not queue login events task")
+
+
+def claim_batch(batch_size, config):
+    now = timezone.now()
+    due = Q(locked_at__isnull=True) | Q(locked_at__lt=now - timedelta(seconds=config['LOCK_TIMEOUT']))
+    with transaction.atomic():
+        ids = list(
+            LoginEvent.objects.select_for_update(skip_locked=True)
+            .filter(due).order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        LoginEvent.objects.filter(id__in=ids).update(locked_at=now)
+    return list(LoginEvent.objects.filter(id__in=ids).select_related('user').order_by('id'))
+
+
+def build_notification(user, event, location, login_count, connection):
+    local_time = timezone.localtime(event.created_at)
+    context = {
+        'user': user,
+        'login_time': local_time.strftime('%H:%M:%S %d-%m-%Y'),
+        'login_date': local_time.strftime('%d-%m-%Y'),
+        'ip': event.ip_address or 'Unknown',
+        'location': location,
+        'user_agent': event.user_agent,
+        'login_count': login_count,
+    }
+    return build_email('accounts/email_login_notification', 'ورود جدید به حساب شما - PIMXCHAT', [user.email], context, connection=connection)
+
+
+def process_batch(batch_size=None):
+    """Handle one batch of login events; returns how many were processed"""
+    config = get_config()
+    events = claim_batch(batch_size or config['BATCH_SIZE'], config)
+    if not events:
+        return 0
+
+    locations = {event.pk: lookup_location(event.ip_address) for event in events}
+    by_user = defaultdict(list)
+    for event in events:
+        by_user[event.user_id].append((event, locations[event.pk]))
+
+    notifications = []
+    with transaction.atomic():
+        LoginHistory.objects.bulk_create([
+            LoginHistory(
+                user_id=event.user_id,
+                ip_address=event.ip_address,
+                location=locations[event.pk],
+                device=event.user_agent,
+                logged_in_at=event.created_at,
+            )
+            for event in events
+        ])
+        for user_id, logins in by_user.items():
+            last_event, last_location = logins[-1]
+            User.objects.filter(pk=user_id).update(
+                last_login_time=last_event.created_at,
+                last_login_ip=last_event.ip_address,
+                last_login_location=last_location,
+                last_login_device=last_event.user_agent,
+                login_count=F('login_count') + len(logins),
+            )
+            user = last_event.user
+            if user.login_notifications_enabled and user.email:
+                login_count = User.objects.filter(pk=user_id).values_list('login_count', flat=True).get()
+                first_count = login_count - len(logins) + 1
+                notifications.extend(
+                    (user, event, location, first_count + offset)
+                    for offset, (event, location) in enumerate(logins)
+                )
+        LoginEvent.objects.filter(id__in=[event.pk for event in events]).delete()
+
+    if notifications:
+        # One connection for the whole batch; with the outbox backend these are inserts
+        connection = get_connection()
+        connection.send_messages([build_notification(*args, connection=connection) for args in notifications])
+    return len(events)
+
+
+def drain(batch_size=None):
+    total = 0
+    while True:
+        processed = process_batch(batch_size)
+        total += processed
+        if not processed:
+            return total
+
+
+def run_worker(poll_interval=1.0, batch_size=None):
+    """Poll for login events forever (the DB-backed alternative to Celery)"""
+    while True:
+        processed = process_batch(batch_size)
+        if processed:
+            logger.info("Login events: processed %d", processed)
+        else:
+            time.sleep(poll_interval)
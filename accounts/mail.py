@@ -0,0 +1,66 @@
+"""
+Rendering for the transactional emails in templates/accounts/.
+
+Each email is a pair of templates, ``<name>.html`` and ``<name>.txt``.
+Both are compiled once per process and reused, and the plain-text part
+comes from the .txt template instead of running ``strip_tags`` over the
+rendered HTML. Values that are the same for every message (logo URL,
+footer) are built once per site and merged into each context.
+
+Run ``python manage.py benchmark_email_render`` to compare the per-email
+cost with the old render_to_string + strip_tags path.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import get_template
+
+FOOTER_LINES = (
+    'اگر این درخواست توسط شما انجام نشده است، این ایمیل را نادیده بگیرید.',
+    '© ۲۰۲۴ PIMXCHAT. تمامی حقوق محفوظ است.',
+)
+
+
+@lru_cache(maxsize=None)
+def _compiled_templates(name):
+    return get_template(f'{name}.html'), get_template(f'{name}.txt')
+
+
+def get_templates(name):
+    """The compiled (html, text) templates for an email"""
+    if settings.DEBUG:
+        # Pick up template edits without a restart while developing
+        return get_template(f'{name}.html'), get_template(f'{name}.txt')
+    return _compiled_templates(name)
+
+
+@lru_cache(maxsize=32)
+def get_static_context(base_url=''):
+    return {
+        'site_name': 'PIMXCHAT',
+        'logo_url': f"{base_url}{settings.STATIC_URL}img/logo.png",
+        'footer_lines': FOOTER_LINES,
+    }
+
+
+def get_base_url(request):
+    return f"{request.scheme}://{request.get_host()}" if request is not None else ''
+
+
+def render_email(name, context, request=None):
+    """Render an email to (html, text)"""
+    context = dict(get_static_context(get_base_url(request)), **context)
+    html_template, text_template = get_templates(name)
+    return html_template.render(context), text_template.render(context)
+
+
+def build_email(name, subject, to, context, request=None, connection=None):
+    html_content, text_content = render_email(name, context, request)
+    email = EmailMultiAlternatives(subject=subject, body=text_content, to=to, connection=connection)
+    email.attach_alternative(html_content, "text/html")
+    return email
+
+
+def send_email(name, subject, to, context, request=None):
+    return build_email(name, subject, to, context, request).send()
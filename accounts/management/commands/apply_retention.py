@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.retention import POLICIES, apply_policy, get_policies
+
+
+class Command(BaseCommand):
+    help = 'Deletes data past its retention period (RETENTION in settings) in small batches'
+    policy_names = None
+
+    def add_arguments(self, parser):
+        if self.policy_names is None:
+            parser.add_argument('policies', nargs='*', help=f"Policies to run (default: all enabled): {', '.join(p.name for p in POLICIES)}")
+        parser.add_argument('--days', type=int, default=None, help='Override the retention age of the selected policies')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--sleep', type=float, default=None, help='Seconds to pause between batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted')
+
+    def handle(self, *args, **options):
+        names = self.policy_names or options['policies']
+        unknown = set(names) - {policy.name for policy in POLICIES}
+        if unknown:
+            raise CommandError(f"Unknown retention policies: {', '.join(sorted(unknown))}")
+
+        policies = get_policies(names)
+        if options['days'] is not None:
+            for policy in policies:
+                policy.days = options['days']
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+
+        def progress(policy, total, last_key):
+            self.stdout.write(f'{policy.name}: {total} so far (up to {last_key})')
+
+        for policy in policies:
+            total = apply_policy(
+                policy,
+                batch_size=options['batch_size'],
+                sleep=options['sleep'],
+                dry_run=options['dry_run'],
+                progress=progress,
+            )
+            self.stdout.write(self.style.SUCCESS(f'{verb} {total} {policy.description.lower()} older than {policy.days} days.'))
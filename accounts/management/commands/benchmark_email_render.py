@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+
+from accounts.mail import render_email
+
+SAMPLE_CONTEXT = {
+    'user': {'username': 'benchmark', 'email': 'benchmark@example.com'},
+    'code': '123456',
+    'verify_url': 'https://example.com/accounts/verify/',
+    'login_time': '12:00:00 01-01-2025',
+    'login_date': '01-01-2025',
+    'ip': '5.160.0.1',
+    'location': 'Tehran, Tehran, Iran',
+    'user_agent': 'Mozilla/5.0',
+    'login_count': 42,
+}
+
+
+class Command(BaseCommand):
+    help = 'Measures per-email render cost: render_to_string + strip_tags vs accounts.mail'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=1000)
+        parser.add_argument('--template', default='accounts/email_login_notification')
+
+    def time_per_email(self, render, iterations):
+        render()  # warm up loaders and caches
+        start = time.perf_counter()
+        for _ in range(iterations):
+            render()
+        return (time.perf_counter() - start) / iterations * 1e6
+
+    def handle(self, *args, **options):
+        name = options['template']
+        iterations = options['iterations']
+
+        def legacy():
+            html_content = render_to_string(f'{name}.html', SAMPLE_CONTEXT)
+            return html_content, strip_tags(html_content)
+
+        def compiled():
+            return render_email(name, SAMPLE_CONTEXT)
+
+        legacy_us = self.time_per_email(legacy, iterations)
+        compiled_us = self.time_per_email(compiled, iterations)
+        self.stdout.write(f'{name} ({iterations} renders)')
+        self.stdout.write(f'  render_to_string + strip_tags: {legacy_us:8.1f} µs/email')
+        self.stdout.write(f'  accounts.mail.render_email:    {compiled_us:8.1f} µs/email')
+        self.stdout.write(self.style.SUCCESS(f'  speedup: {legacy_us / compiled_us:.2f}x'))
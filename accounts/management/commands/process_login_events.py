@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from accounts.login_events import drain, run_worker
+
+
+class Command(BaseCommand):
+    help = 'Processes queued login events: geolocation, login fields, history and notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process everything queued, then exit')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = drain(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Processed {processed} login events.'))
+            return
+        self.stdout.write(self.style.SUCCESS('Login event worker started'))
+        try:
+            run_worker(options['poll_interval'], options['batch_size'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from accounts.stats import recount
+
+
+class Command(BaseCommand):
+    help = 'Recounts the site counters behind /api/site-stats/ from the source tables'
+
+    def handle(self, *args, **options):
+        for name, value in recount().items():
+            self.stdout.write(f'{name}: {value}')
+        self.stdout.write(self.style.SUCCESS('Site counters recounted.'))
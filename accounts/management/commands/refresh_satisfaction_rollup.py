@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts.satisfaction import refresh_rollup
+
+
+class Command(BaseCommand):
+    help = 'Updates the daily satisfaction rollup (run from cron; the admin page also refreshes it)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every day, e.g. after deleting ratings or users')
+
+    def handle(self, *args, **options):
+        days = refresh_rollup(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Recomputed {days} days.'))
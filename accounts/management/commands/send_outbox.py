@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from accounts.outbox import drain, run_worker
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued emails from the outbox (DB-backed worker, alternative to Celery)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Send everything that is due, then exit')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when the outbox is empty')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            sent, failed = drain(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Sent {sent} emails, {failed} failed.'))
+            return
+        self.stdout.write(self.style.SUCCESS('Outbox worker started'))
+        try:
+            run_worker(options['poll_interval'], options['batch_size'])
+        except KeyboardInterrupt:
+            pass
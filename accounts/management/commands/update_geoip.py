@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.geo import download_database, get_config
+
+
+class Command(BaseCommand):
+    help = 'Downloads the MaxMind GeoIP database to GEOIP["PATH"] (needs GEOIP["LICENSE_KEY"])'
+
+    def handle(self, *args, **options):
+        try:
+            path = download_database(get_config())
+        except Exception as e:
+            raise CommandError(f'GeoIP download failed: {e}')
+        self.stdout.write(self.style.SUCCESS(f'GeoIP database saved to {path}'))
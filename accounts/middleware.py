@@ -1,18 +1,59 @@
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.core.exceptions import ValidationError, PermissionDenied
-from django.http import Http404
+from django.http import Http404, JsonResponse
 import logging
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from config import timing
+
+from . import ratelimit
+
 logger = logging.getLogger(__name__)
 
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise with an async path, so it does not turn the ASGI chain sync (6.x is sync-only)"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Looks the path up on disk
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
 class ErrorHandlingMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        response = self.get_response(request)
-        return response
+        # Under ASGI this returns get_response's coroutine for the caller to await;
+        # process_exception is run in a thread by Django either way
+        return self.get_response(request)
 
     def process_exception(self, request, exception):
         """Handle exceptions and provide user-friendly error messages"""
@@ -67,4 +108,137 @@ class ErrorHandlingMiddleware:
                     'صفحه را رفرش کنید',
                     'با پشتیبانی تماس بگیرید'
                 ]
-            }, status=500) 
\ No newline at end of file
+            }, status=500)
+
+
+class RateLimitMiddleware:
+    """Reject requests over the RATE_LIMITS rules with 429 and Retry-After (see accounts/ratelimit.py)"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.check(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        if self.matching_rules(request):
+            # The counters are cache calls, and per-user rules may load request.user
+            response = await sync_to_async(self.check)(request)
+            if response is not None:
+                return response
+        return await self.get_response(request)
+
+    def matching_rules(self, request):
+        if not ratelimit.get_config()['ENABLED']:
+            return []
+        return [rule for rule in ratelimit.get_rules() if rule.matches(request)]
+
+    def check(self, request):
+        """A 429 response if the request is over one of its rules, else None"""
+        for rule in self.matching_rules(request):
+            retry_after = ratelimit.hit(rule, ratelimit.get_ident(rule, request))
+            if retry_after:
+                return self.reject(rule, retry_after)
+        return None
+
+    def reject(self, rule, retry_after):
+        response = JsonResponse({
+            'success': False,
+            'error': 'تعداد درخواست‌ها بیش از حد مجاز است. لطفاً کمی بعد دوباره تلاش کنید.',
+            'retry_after': retry_after,
+        }, status=429)
+        response['Retry-After'] = str(retry_after)
+        return response
+
+
+class ServerTimingMiddleware:
+    """Server-Timing header, a timing log line and sampled profiles per request (see config/timing.py)"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = timing.get_config()
+        if self.config['ENABLED']:
+            timing.install()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.config['ENABLED']:
+            return self.get_response(request)
+        timings, token = timing.start()
+        profile = timing.start_profile(self.config)
+        try:
+            response = self.get_response(request)
+        finally:
+            if profile:
+                timing.stop_profile(profile, request, timings)
+            timing.finish(token)
+        return self.done(request, response, timings)
+
+    async def __acall__(self, request):
+        if not self.config['ENABLED']:
+            return await self.get_response(request)
+        timings, token = timing.start()
+        profile = timing.start_profile(self.config)
+        try:
+            response = await self.get_response(request)
+        finally:
+            if profile:
+                timing.stop_profile(profile, request, timings)
+            timing.finish(token)
+        return self.done(request, response, timings)
+
+    def done(self, request, response, timings):
+        if self.config['HEADER']:
+            response['Server-Timing'] = timings.header()
+        if not self.config['LOG']:
+            return response
+        if response.streaming:
+            # Log once the body has been sent, counting the queries made while streaming
+            response.streaming_content = self.timed_stream(request, response, timings)
+        else:
+            timing.log(request, response, timings)
+        return response
+
+    def timed_stream(self, request, response, timings):
+        content = response.streaming_content
+        if response.is_async:
+            return self.timed_async_stream(request, response, timings, content)
+
+        def stream():
+            iterator = iter(content)
+            try:
+                while True:
+                    with timing.activate(timings):
+                        chunk = next(iterator, None)
+                    if chunk is None:
+                        return
+                    yield chunk
+            finally:
+                timing.log(request, response, timings)
+        return stream()
+
+    async def timed_async_stream(self, request, response, timings, content):
+        iterator = content.__aiter__()
+        try:
+            while True:
+                with timing.activate(timings):
+                    try:
+                        chunk = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                yield chunk
+        finally:
+            timing.log(request, response, timings)
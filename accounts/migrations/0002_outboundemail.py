@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:03
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255, verbose_name='موضوع')),
+                ('body', models.TextField(verbose_name='متن')),
+                ('html_body', models.TextField(blank=True, verbose_name='متن HTML')),
+                ('from_email', models.CharField(max_length=255, verbose_name='فرستنده')),
+                ('to', models.JSONField(default=list, verbose_name='گیرندگان')),
+                ('cc', models.JSONField(blank=True, default=list)),
+                ('bcc', models.JSONField(blank=True, default=list)),
+                ('reply_to', models.JSONField(blank=True, default=list)),
+                ('headers', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('pending', 'در صف'), ('sending', 'در حال ارسال'), ('sent', 'ارسال شده'), ('dead', 'ناموفق')], default='pending', max_length=10, verbose_name='وضعیت')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='تعداد تلاش')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='تلاش بعدی')),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, verbose_name='آخرین خطا')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان ارسال')),
+            ],
+            options={
+                'verbose_name': 'ایمیل در صف',
+                'verbose_name_plural': 'صف ایمیل\u200cها',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx')],
+            },
+        ),
+    ]
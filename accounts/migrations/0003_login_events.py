@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_outboundemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoginEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('user_agent', models.CharField(blank=True, max_length=500)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LoginHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True, verbose_name='آدرس IP')),
+                ('location', models.CharField(blank=True, max_length=255, verbose_name='موقعیت')),
+                ('device', models.CharField(blank=True, max_length=500, verbose_name='دستگاه')),
+                ('logged_in_at', models.DateTimeField(verbose_name='زمان ورود')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='login_history', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'سابقه ورود',
+                'verbose_name_plural': 'سوابق ورود',
+                'ordering': ['-logged_in_at'],
+                'indexes': [models.Index(fields=['user', '-logged_in_at'], name='loginhistory_user_time_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_login_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='روز')),
+                ('rating', models.PositiveSmallIntegerField(verbose_name='امتیاز')),
+                ('ratings', models.PositiveIntegerField(default=0, verbose_name='تعداد امتیازها')),
+                ('latest_users', models.PositiveIntegerField(default=0, verbose_name='کاربران با آخرین امتیاز')),
+                ('last_rating_id', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'خلاصه روزانه امتیازها',
+                'verbose_name_plural': 'خلاصه\u200cهای روزانه امتیازها',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ratingdailyrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'rating'), name='ratingrollup_day_rating_uniq'),
+        ),
+    ]
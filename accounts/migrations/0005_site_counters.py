@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:18
+
+from django.db import migrations, models
+
+
+def backfill_site_counters(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    UserRating = apps.get_model('accounts', 'UserRating')
+    ChatMessage = apps.get_model('pimxchat', 'ChatMessage')
+    SiteCounter = apps.get_model('accounts', 'SiteCounter')
+    values = {f'ratings_{rating}': 0 for rating in range(1, 6)}
+    values.update(users=User.objects.count(), chat_messages=ChatMessage.objects.count(), ratings=0, rating_sum=0)
+    for row in UserRating.objects.values('rating').annotate(count=models.Count('id')):
+        values[f"ratings_{row['rating']}"] = row['count']
+        values['ratings'] += row['count']
+        values['rating_sum'] += row['count'] * row['rating']
+    SiteCounter.objects.bulk_create([SiteCounter(name=name, value=value) for name, value in values.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_rating_daily_rollup'),
+        ('pimxchat', '0004_chat_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiteCounter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'شمارنده سایت',
+                'verbose_name_plural': 'شمارنده\u200cهای سایت',
+            },
+        ),
+        migrations.RunPython(backfill_site_counters, migrations.RunPython.noop),
+    ]
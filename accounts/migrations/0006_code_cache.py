@@ -0,0 +1,19 @@
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_tables(apps, schema_editor):
+    # Creates the table of every DatabaseCache in CACHES (the verification code cache
+    # when Redis is not configured); existing tables are left alone
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_site_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_tables, migrations.RunPython.noop),
+    ]
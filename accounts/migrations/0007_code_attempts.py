@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_code_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeAttempt',
+            fields=[
+                ('key', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'تلاش کد تایید',
+                'verbose_name_plural': 'تلاش\u200cهای کد تایید',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:36
+
+from django.db import migrations, models
+
+
+def create_state(apps, schema_editor):
+    # The refresh locks this row, so it has to exist before two workers race to create it;
+    # no watermark yet, so the first refresh rebuilds every day
+    apps.get_model('accounts', 'RatingRollupState').objects.create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_code_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingRollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('watermark', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='ratingdailyrollup',
+            name='last_rating_id',
+        ),
+        migrations.RunPython(create_state, migrations.RunPython.noop),
+    ]
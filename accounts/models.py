@@ -154,3 +154,128 @@ class UserRating(models.Model):
 
     def __str__(self):
         return f"{self.user} - {self.rating}"
+
+class OutboundEmail(models.Model):
+    """Queued email, delivered by the outbox worker (see accounts/outbox.py)"""
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUS_CHOICES = [
+        (PENDING, _('در صف')),
+        (SENDING, _('در حال ارسال')),
+        (SENT, _('ارسال شده')),
+        (DEAD, _('ناموفق')),
+    ]
+
+    subject = models.CharField(_('موضوع'), max_length=255)
+    body = models.TextField(_('متن'))
+    html_body = models.TextField(_('متن HTML'), blank=True)
+    from_email = models.CharField(_('فرستنده'), max_length=255)
+    to = models.JSONField(_('گیرندگان'), default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    reply_to = models.JSONField(default=list, blank=True)
+    headers = models.JSONField(default=dict, blank=True)
+    status = models.CharField(_('وضعیت'), max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(_('تعداد تلاش'), default=0)
+    next_attempt_at = models.DateTimeField(_('تلاش بعدی'), default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(_('آخرین خطا'), blank=True)
+    created_at = models.DateTimeField(_('تاریخ ایجاد'), auto_now_add=True)
+    sent_at = models.DateTimeField(_('زمان ارسال'), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('ایمیل در صف')
+        verbose_name_plural = _('صف ایمیل‌ها')
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{', '.join(self.to)} - {self.subject} ({self.status})"
+
+class LoginEvent(models.Model):
+    """A login waiting for bookkeeping by the consumer in accounts/login_events.py"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    user_agent = models.CharField(max_length=500, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id} @ {self.created_at}"
+
+class LoginHistory(models.Model):
+    """Append-only record of every login"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='login_history', verbose_name=_('کاربر'))
+    ip_address = models.GenericIPAddressField(_('آدرس IP'), null=True, blank=True)
+    location = models.CharField(_('موقعیت'), max_length=255, blank=True)
+    device = models.CharField(_('دستگاه'), max_length=500, blank=True)
+    logged_in_at = models.DateTimeField(_('زمان ورود'))
+
+    class Meta:
+        ordering = ['-logged_in_at']
+        verbose_name = _('سابقه ورود')
+        verbose_name_plural = _('سوابق ورود')
+        indexes = [
+            models.Index(fields=['user', '-logged_in_at'], name='loginhistory_user_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.logged_in_at:%Y-%m-%d %H:%M}"
+
+class RatingDailyRollup(models.Model):
+    """Per-day, per-score rating counts maintained by accounts/satisfaction.py"""
+    day = models.DateField(_('روز'))
+    rating = models.PositiveSmallIntegerField(_('امتیاز'))
+    # Ratings submitted that day with this score
+    ratings = models.PositiveIntegerField(_('تعداد امتیازها'), default=0)
+    # Users whose latest rating was submitted that day with this score
+    latest_users = models.PositiveIntegerField(_('کاربران با آخرین امتیاز'), default=0)
+
+    class Meta:
+        verbose_name = _('خلاصه روزانه امتیازها')
+        verbose_name_plural = _('خلاصه‌های روزانه امتیازها')
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'rating'], name='ratingrollup_day_rating_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.rating}"
+
+class RatingRollupState(models.Model):
+    """Single row: lock and watermark of the RatingDailyRollup refresh (see accounts/satisfaction.py)"""
+    # When the last refresh started; the next one re-reads ratings from a little before it
+    watermark = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"rollup watermark {self.watermark}"
+
+
+class SiteCounter(models.Model):
+    """Named running total kept current by accounts/signals.py (see accounts/stats.py)"""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _('شمارنده سایت')
+        verbose_name_plural = _('شمارنده‌های سایت')
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+class CodeAttempt(models.Model):
+    """Guess counter of one verification code, kept next to the code in accounts/codes.py"""
+    # The code's cache key, vcode:<purpose>:<subject>
+    key = models.CharField(max_length=255, primary_key=True)
+    attempts = models.PositiveIntegerField(default=0)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = _('تلاش کد تایید')
+        verbose_name_plural = _('تلاش‌های کد تایید')
+
+    def __str__(self):
+        return f"{self.key} ({self.attempts})"
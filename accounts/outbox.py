@@ -0,0 +1,205 @@
+"""
+Outbound email queue.
+
+With ``EMAIL_BACKEND = 'accounts.outbox.OutboxEmailBackend'`` every
+``EmailMultiAlternatives.send()`` in the views only inserts an
+OutboundEmail row, so requests no longer wait on SMTP. The rows are
+delivered in batches over one persistent connection to
+``OUTBOX['DELIVERY_BACKEND']`` by either:
+
+* the DB-polling worker: ``python manage.py send_outbox``, or
+* the Celery task ``accounts.tasks.deliver_outbox``, triggered after each
+  enqueue when ``OUTBOX['USE_CELERY']`` is set.
+
+Failed sends are retried with exponential backoff; after MAX_ATTEMPTS a
+row is marked ``dead`` and kept for inspection/retry from the admin.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from config import timing
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'DELIVERY_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    'BASE_DELAY': 30,
+    'MAX_DELAY': 60 * 60,
+    # A 'sending' row older than this belongs to a crashed worker and is claimed again
+    'LOCK_TIMEOUT': 5 * 60,
+    'USE_CELERY': False,
+}
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'OUTBOX', {}))
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """Email backend that queues messages instead of sending them"""
+
+    def send_messages(self, email_messages):
+        queued = 0
+        for message in email_messages:
+            if message.attachments:
+                # The outbox stores text and HTML only; send anything else directly
+                with timing.measure('smtp'):
+                    get_connection(get_config()['DELIVERY_BACKEND'], fail_silently=self.fail_silently).send_messages([message])
+            else:
+                enqueue(message)
+            queued += 1
+        return queued
+
+
+def enqueue(message):
+    html_body = ''
+    for content, mimetype in getattr(message, 'alternatives', []):
+        if mimetype == 'text/html':
+            html_body = content
+    email = OutboundEmail.objects.create(
+        subject=message.subject,
+        body=message.body,
+        html_body=html_body,
+        from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(message.to),
+        cc=list(message.cc),
+        bcc=list(message.bcc),
+        reply_to=list(message.reply_to),
+        headers=dict(message.extra_headers),
+    )
+    if get_config()['USE_CELERY']:
+        transaction.on_commit(trigger_celery)
+    return email
+
+
+def trigger_celery():
+    from .tasks import deliver_outbox
+    try:
+        deliver_outbox.delay()
+    except Exception:
+        # Broker down: the row stays pending for the next run or the DB worker
+        logger.exception("Could not queue outbox delivery task")
+
+
+def build_message(email, connection):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+        cc=email.cc,
+        bcc=email.bcc,
+        reply_to=email.reply_to,
+        headers=email.headers,
+        connection=connection,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, "text/html")
+    return message
+
+
+def retry_delay(attempts, config):
+    return min(config['MAX_DELAY'], config['BASE_DELAY'] * (2 ** (attempts - 1)))
+
+
+def claim_batch(batch_size, config):
+    """Mark up to batch_size due rows as 'sending' and return them"""
+    now = timezone.now()
+    due = Q(status=OutboundEmail.PENDING, next_attempt_at__lte=now) | Q(
+        status=OutboundEmail.SENDING, locked_at__lt=now - timedelta(seconds=config['LOCK_TIMEOUT'])
+    )
+    with transaction.atomic():
+        # skip_locked lets several PostgreSQL workers drain the table side by side
+        ids = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(due).order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=ids).update(status=OutboundEmail.SENDING, locked_at=now)
+    return list(OutboundEmail.objects.filter(id__in=ids).order_by('id'))
+
+
+def record_failure(email, error, config):
+    email.attempts += 1
+    email.last_error = str(error)[:2000]
+    email.locked_at = None
+    if email.attempts >= config['MAX_ATTEMPTS']:
+        email.status = OutboundEmail.DEAD
+        logger.warning("Outbox email %s moved to dead letters after %d attempts: %s", email.pk, email.attempts, error)
+    else:
+        email.status = OutboundEmail.PENDING
+        email.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(email.attempts, config))
+    email.save(update_fields=['attempts', 'last_error', 'locked_at', 'status', 'next_attempt_at'])
+
+
+def deliver_batch(batch_size=None):
+    """Send one batch of due emails over a single connection; returns (sent, failed)"""
+    config = get_config()
+    batch = claim_batch(batch_size or config['BATCH_SIZE'], config)
+    if not batch:
+        return 0, 0
+
+    sent = failed = 0
+    connection = get_connection(config['DELIVERY_BACKEND'])
+    try:
+        connection.open()
+    except Exception as e:
+        for email in batch:
+            record_failure(email, e, config)
+        return 0, len(batch)
+
+    try:
+        for email in batch:
+            try:
+                with timing.measure('smtp'):
+                    connection.send_messages([build_message(email, connection)])
+            except Exception as e:
+                record_failure(email, e, config)
+                failed += 1
+                # The server may have dropped us; reconnect for the rest of the batch
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    pass
+                continue
+            OutboundEmail.objects.filter(pk=email.pk).update(
+                status=OutboundEmail.SENT, sent_at=timezone.now(), locked_at=None, attempts=email.attempts + 1
+            )
+            sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def drain(batch_size=None):
+    """Deliver batches until nothing is due; returns (sent, failed)"""
+    total_sent = total_failed = 0
+    while True:
+        sent, failed = deliver_batch(batch_size)
+        total_sent += sent
+        total_failed += failed
+        if sent + failed == 0:
+            return total_sent, total_failed
+
+
+def run_worker(poll_interval=1.0, batch_size=None):
+    """Poll the outbox forever (the DB-backed alternative to Celery)"""
+    while True:
+        sent, failed = deliver_batch(batch_size)
+        if sent or failed:
+            logger.info("Outbox: sent %d, failed %d", sent, failed)
+        else:
+            time.sleep(poll_interval)
@@ -0,0 +1,203 @@
+"""
+Sliding-window rate limits for the expensive endpoints.
+
+Each rule in ``RATE_LIMITS['RULES']`` matches a path regex and methods and
+allows ``rate`` requests (``'20/m'``, ``'5/10m'``, ``'100/h'``) per user
+or per client IP. The window is approximated from two fixed-window
+counters, weighting the previous window by how much of it still overlaps
+the sliding one, so each check is one atomic ``incr`` and one ``get``.
+
+Counters live in the cache named by ``RATE_LIMITS['CACHE']`` (Redis when
+REDIS_URL is set) so the limit is global across workers. Without it, or
+while Redis is unreachable, an in-process counter is used instead, which
+still caps each worker.
+"""
+import logging
+import math
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from config import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    'CACHE': None,
+    'RULES': [],
+}
+
+UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+RATE_PATTERN = re.compile(r'^(\d+)/(\d*)([smhd])$')
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'RATE_LIMITS', {}))
+
+
+def parse_rate(rate):
+    """'20/m' -> (20, 60), '5/10m' -> (5, 600)"""
+    match = RATE_PATTERN.match(rate.strip())
+    if not match:
+        raise ValueError(f'Invalid rate: {rate!r}')
+    limit, multiplier, unit = match.groups()
+    return int(limit), int(multiplier or 1) * UNITS[unit]
+
+
+class Rule:
+    def __init__(self, name, rate, path=None, methods=None, key='ip'):
+        self.name = name
+        self.limit, self.window = parse_rate(rate)
+        self.path = re.compile(path) if path else None
+        self.methods = {method.upper() for method in methods} if methods else None
+        self.key = key
+
+    def matches(self, request):
+        if self.methods and request.method not in self.methods:
+            return False
+        return bool(self.path and self.path.search(request.path_info))
+
+
+_rules = (None, ())
+
+
+def get_rules():
+    """Rule objects for RATE_LIMITS['RULES'], rebuilt when the setting is replaced"""
+    global _rules
+    source = get_config()['RULES']
+    if _rules[0] is not source:
+        _rules = (source, tuple(Rule(**rule) for rule in source))
+    return _rules[1]
+
+
+def get_rule(name):
+    for rule in get_rules():
+        if rule.name == name:
+            return rule
+    return None
+
+
+class LocalCounters:
+    """Per-process fallback with the same incr/get contract as the cache"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def incr(self, key, ttl):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._data) > 10000:
+                self._data = {k: v for k, v in self._data.items() if v[1] > now}
+            count, expires_at = self._data.get(key, (0, 0))
+            if expires_at <= now:
+                count = 0
+                expires_at = now + ttl
+            self._data[key] = (count + 1, expires_at)
+            return count + 1
+
+    def get(self, key):
+        with self._lock:
+            count, expires_at = self._data.get(key, (0, 0))
+            return count if expires_at > time.monotonic() else 0
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_counters = LocalCounters()
+
+
+class CacheCounters:
+    def __init__(self, cache):
+        self.cache = cache
+
+    def incr(self, key, ttl):
+        if self.cache.add(key, 1, ttl):
+            return 1
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            self.cache.add(key, 1, ttl)
+            return 1
+
+    def get(self, key):
+        return self.cache.get(key) or 0
+
+
+# During a cache outage every check fails; warn once per interval, not per request
+FALLBACK_WARNING_INTERVAL = 60
+_fallback_warned_at = None
+
+
+def warn_fallback(error):
+    global _fallback_warned_at
+    now = time.monotonic()
+    if _fallback_warned_at is None or now - _fallback_warned_at >= FALLBACK_WARNING_INTERVAL:
+        _fallback_warned_at = now
+        logger.warning("Rate limit cache unavailable, using in-process counters: %s", error)
+
+
+def get_counters(config):
+    return CacheCounters(caches[config['CACHE']]) if config['CACHE'] else local_counters
+
+
+def hit(rule, ident, now=None, counters=None):
+    """Count one request against a rule; returns seconds to wait, or 0 if it is allowed"""
+    now = time.time() if now is None else now
+    window_index, offset = divmod(now, rule.window)
+    window_index = int(window_index)
+    key = f'ratelimit:{rule.name}:{ident}'
+
+    counters = counters or get_counters(get_config())
+    try:
+        current = counters.incr(f'{key}:{window_index}', rule.window * 2)
+        previous = counters.get(f'{key}:{window_index - 1}')
+    except Exception as e:
+        if counters is local_counters:
+            raise
+        warn_fallback(e)
+        return hit(rule, ident, now, local_counters)
+
+    estimate = previous * (1 - offset / rule.window) + current
+    if estimate <= rule.limit:
+        return 0
+    metrics.incr('ratelimit_rejected')
+    metrics.incr(f'ratelimit_rejected_{rule.name}')
+    if current > rule.limit or previous == 0:
+        # Over the limit within this window alone: wait for the next one
+        return max(1, math.ceil(rule.window - offset))
+    # Wait until enough of the previous window has slid out
+    needed = (estimate - rule.limit) / previous * rule.window
+    return max(1, math.ceil(min(needed, rule.window - offset)))
+
+
+def check(names, user=None, ip=None):
+    """Apply the named rules outside a request (WebSocket operations); returns seconds to wait or 0"""
+    if not get_config()['ENABLED']:
+        return 0
+    for name in names:
+        rule = get_rule(name)
+        if rule is None:
+            continue
+        retry_after = hit(rule, get_ident(rule, user=user, ip=ip))
+        if retry_after:
+            return retry_after
+    return 0
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR') or request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')[0].strip() or 'unknown'
+
+
+def get_ident(rule, request=None, user=None, ip=None):
+    user = user if user is not None else getattr(request, 'user', None)
+    if rule.key == 'user' and user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f'ip:{ip or client_ip(request)}'
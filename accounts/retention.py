@@ -0,0 +1,217 @@
+"""
+Retention policies for data that is only kept for a while.
+
+Each policy selects the expired rows (or files) relative to a cutoff and
+deletes them in batches of BATCH_SIZE, walking the primary key upwards
+and sleeping SLEEP seconds between batches, so no single statement holds
+locks for long or loads a whole table for the delete signals. A run that
+is interrupted can simply be started again: everything already deleted
+is gone and the rest is still past the cutoff.
+
+Policies and their ages in days come from ``RETENTION['POLICIES']``; an
+age of None disables a policy. Run them with
+``python manage.py apply_retention`` (``--dry-run`` only counts).
+"""
+import copy
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from pimxchat.signals import collecting_deletes
+
+from .models import UserRating
+from .satisfaction import refresh_rollup
+
+DEFAULT_CONFIG = {
+    'BATCH_SIZE': 1000,
+    'SLEEP': 0.1,
+    'POLICIES': {},
+}
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'RETENTION', {}))
+
+
+class RetentionPolicy:
+    """Something to delete once it is older than ``days``"""
+
+    def __init__(self, name, days, description=''):
+        self.name = name
+        self.days = days
+        self.description = description
+
+    def cutoff(self, now=None):
+        return (now or timezone.now()) - timedelta(days=self.days)
+
+    def batches(self, cutoff, batch_size):
+        """Yield lists of expired keys, at most batch_size each"""
+        raise NotImplementedError
+
+    def delete(self, keys, batch_size):
+        """Delete one batch; returns the number of items removed"""
+        raise NotImplementedError
+
+    def finished(self, deleted):
+        """Called once after a run that deleted something"""
+
+
+class ModelRetentionPolicy(RetentionPolicy):
+    def __init__(self, name, days, model, date_field, filters=None, children=(), description=''):
+        super().__init__(name, days, description)
+        self.model = model
+        self.date_field = date_field
+        self.filters = filters or {}
+        # (model, foreign key) pairs deleted in batches before their parent rows,
+        # so a cascade never deletes an unbounded number of rows at once
+        self.children = children
+
+    def get_model(self, model=None):
+        model = model or self.model
+        if isinstance(model, str):
+            from django.apps import apps
+            return apps.get_model(model)
+        return model
+
+    def queryset(self, cutoff):
+        return self.get_model().objects.filter(**{f'{self.date_field}__lt': cutoff}, **self.filters)
+
+    def batches(self, cutoff, batch_size):
+        expired = self.queryset(cutoff).order_by('pk').values_list('pk', flat=True)
+        last = None
+        while True:
+            page = expired if last is None else expired.filter(pk__gt=last)
+            keys = list(page[:batch_size])
+            if not keys:
+                return
+            yield keys
+            last = keys[-1]
+
+    def delete(self, keys, batch_size):
+        for child, field in self.children:
+            self.delete_children(self.get_model(child), field, keys, batch_size)
+        model = self.get_model()
+        with transaction.atomic(), collecting_deletes():
+            _, deleted = model.objects.filter(pk__in=keys).delete()
+        # Cascaded rows are not counted
+        return deleted.get(model._meta.label, 0)
+
+    def delete_children(self, model, field, keys, batch_size):
+        rows = model.objects.filter(**{f'{field}__in': keys}).order_by('pk').values_list('pk', flat=True)
+        while True:
+            child_keys = list(rows[:batch_size])
+            if not child_keys:
+                return
+            with transaction.atomic(), collecting_deletes():
+                model.objects.filter(pk__in=child_keys).delete()
+
+
+class RatingRetentionPolicy(ModelRetentionPolicy):
+    def finished(self, deleted):
+        # The daily rollup does not track deletes incrementally
+        refresh_rollup(full=True)
+
+
+class StorageFileRetentionPolicy(RetentionPolicy):
+    """Files in a storage directory whose names start with prefix"""
+
+    def __init__(self, name, days, directory, prefix, storage=None, description=''):
+        super().__init__(name, days, description)
+        self.directory = directory
+        self.prefix = prefix
+        self.storage = storage
+
+    def get_storage(self):
+        return self.storage or default_storage
+
+    def batches(self, cutoff, batch_size):
+        storage = self.get_storage()
+        try:
+            _, files = storage.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        batch = []
+        for filename in sorted(files):
+            if not filename.startswith(self.prefix):
+                continue
+            path = f'{self.directory}/{filename}'
+            if storage.get_modified_time(path) >= cutoff:
+                continue
+            batch.append(path)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def delete(self, keys, batch_size):
+        storage = self.get_storage()
+        for path in keys:
+            storage.delete(path)
+        return len(keys)
+
+
+POLICIES = [
+    RatingRetentionPolicy(
+        'ratings', 90, UserRating, 'submitted_at',
+        description='Satisfaction ratings',
+    ),
+    ModelRetentionPolicy(
+        'chat_sessions', None, 'pimxchat.ChatSession', 'updated_at', children=[('pimxchat.ChatMessage', 'session')],
+        description='Chat sessions (with their messages) untouched since the cutoff',
+    ),
+    ModelRetentionPolicy(
+        'orphan_messages', 30, 'pimxchat.ChatMessage', 'timestamp', filters={'session__isnull': True},
+        description='Chat messages that belong to no session',
+    ),
+    ModelRetentionPolicy(
+        'code_attempts', 1, 'accounts.CodeAttempt', 'expires_at',
+        description='Attempt counters of verification codes that were never used',
+    ),
+    StorageFileRetentionPolicy(
+        'registration_files', 1, 'profile_pics', 'tmp_',
+        description='Profile pictures uploaded during registrations that were never verified',
+    ),
+]
+
+
+def get_policies(names=None):
+    """The enabled policies with their configured ages, optionally only the named ones"""
+    overrides = get_config()['POLICIES']
+    policies = []
+    for policy in POLICIES:
+        if names and policy.name not in names:
+            continue
+        days = overrides.get(policy.name, policy.days)
+        if days is None:
+            continue
+        policy = copy.copy(policy)
+        policy.days = days
+        policies.append(policy)
+    return policies
+
+
+def apply_policy(policy, batch_size=None, sleep=None, dry_run=False, now=None, progress=None):
+    """Delete (or with dry_run, count) everything the policy has expired; returns the count"""
+    config = get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    sleep = config['SLEEP'] if sleep is None else sleep
+    cutoff = policy.cutoff(now)
+
+    total = 0
+    for keys in policy.batches(cutoff, batch_size):
+        if dry_run:
+            total += len(keys)
+        else:
+            total += policy.delete(keys, batch_size)
+        if progress:
+            progress(policy, total, keys[-1])
+        if not dry_run and sleep:
+            time.sleep(sleep)
+    if total and not dry_run:
+        policy.finished(total)
+    return total
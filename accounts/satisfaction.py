@@ -0,0 +1,115 @@
+"""
+Satisfaction statistics from UserRating.
+
+Each user counts once, with their latest rating (a ROW_NUMBER() window per
+user). The admin page does not scan UserRating: it sums
+RatingDailyRollup, at most five rows per day, which ``refresh_rollup``
+keeps current incrementally. Only the days touched by ratings submitted
+since the last refresh are recomputed, plus the earlier days of the users
+who rated again, since their previous latest rating moves out. The
+watermark is the time the last refresh started, minus WATERMARK_OVERLAP:
+a rating's submitted_at is set before its transaction commits, so a slow
+commit can land after a refresh that started later. Recomputing a day is
+idempotent, so re-reading the overlap is harmless.
+
+Deleting ratings or users is not tracked incrementally; run
+``python manage.py refresh_satisfaction_rollup --full`` after bulk deletes.
+
+Two refreshes at once would rebuild the same days and collide on the
+(day, rating) rows. Every refresh therefore runs in a transaction holding
+the RatingRollupState row (``select_for_update``), a lock shared by all
+workers. The admin page skips its refresh while another one holds it.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum, Window
+from django.db.models.functions import RowNumber, TruncDate
+from django.utils import timezone
+
+from .models import RatingDailyRollup, RatingRollupState, UserRating
+
+RATINGS = range(1, 6)
+
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+def latest_rating_ids(queryset):
+    """Subquery of the latest rating id per user in queryset"""
+    return (
+        queryset.filter(user__isnull=False)
+        .annotate(position=Window(
+            RowNumber(),
+            partition_by=[F('user_id')],
+            order_by=[F('submitted_at').desc(), F('id').desc()],
+        ))
+        .filter(position=1)
+        .values('id')
+    )
+
+
+def rating_days(queryset):
+    return set(queryset.annotate(day=TruncDate('submitted_at')).values_list('day', flat=True).distinct())
+
+
+def rebuild_days(days):
+    """Recompute the rollup rows of the given days"""
+    scope = UserRating.objects.all()
+    in_days = scope.annotate(day=TruncDate('submitted_at')).filter(day__in=days)
+    # Only users with a rating on one of these days can have their latest rating there
+    candidates = scope.filter(user_id__in=in_days.filter(user__isnull=False).values('user_id'))
+
+    rows = {}
+    for row in in_days.values('day', 'rating').annotate(count=Count('id')):
+        rows[(row['day'], row['rating'])] = RatingDailyRollup(
+            day=row['day'], rating=row['rating'], ratings=row['count']
+        )
+    latest = (
+        UserRating.objects.filter(id__in=latest_rating_ids(candidates))
+        .annotate(day=TruncDate('submitted_at')).filter(day__in=days)
+        .values('day', 'rating').annotate(count=Count('id'))
+    )
+    for row in latest:
+        rows[(row['day'], row['rating'])].latest_users = row['count']
+
+    with transaction.atomic():
+        RatingDailyRollup.objects.filter(day__in=days).delete()
+        RatingDailyRollup.objects.bulk_create(rows.values())
+    return len(rows)
+
+
+def lock_state(wait):
+    """The RatingRollupState row, locked until the transaction ends; None if busy and not wait"""
+    RatingRollupState.objects.get_or_create(pk=1)
+    return RatingRollupState.objects.select_for_update(skip_locked=not wait).filter(pk=1).first()
+
+
+def refresh_rollup(full=False, wait=True):
+    """
+    Bring RatingDailyRollup up to date; returns the number of days
+    recomputed, or None when wait is False and another refresh is running.
+    """
+    with transaction.atomic():
+        state = lock_state(wait)
+        if state is None:
+            return None
+        started = timezone.now()
+        if full or state.watermark is None:
+            days = rating_days(UserRating.objects.all())
+            RatingDailyRollup.objects.exclude(day__in=days).delete()
+        else:
+            new = UserRating.objects.filter(submitted_at__gte=state.watermark - WATERMARK_OVERLAP)
+            returning = UserRating.objects.filter(user_id__in=new.filter(user__isnull=False).values('user_id'))
+            days = rating_days(new) | rating_days(returning)
+        rebuild_days(days)
+        state.watermark = started
+        state.save(update_fields=['watermark'])
+    return len(days)
+
+
+def get_distribution():
+    """({rating: users whose latest rating it is}, total users), read from the rollup"""
+    counts = {rating: 0 for rating in RATINGS}
+    for row in RatingDailyRollup.objects.values('rating').annotate(users=Sum('latest_users')):
+        counts[row['rating']] = row['users']
+    return counts, sum(counts.values())
@@ -0,0 +1,39 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import stats
+from .login_events import record_login
+from .models import UserRating
+
+# record_login() writes last_login itself and defers the other login fields
+user_logged_in.disconnect(update_last_login, dispatch_uid='update_last_login')
+
+
+@receiver(user_logged_in, dispatch_uid='record_login')
+def queue_login_event(sender, request, user, **kwargs):
+    record_login(request, user)
+
+
+@receiver(post_save, sender=get_user_model(), dispatch_uid='count_user_created')
+def user_created(sender, instance, created, **kwargs):
+    if created:
+        stats.bump(**{stats.USERS: 1})
+
+
+@receiver(post_delete, sender=get_user_model(), dispatch_uid='count_user_deleted')
+def user_deleted(sender, instance, **kwargs):
+    stats.bump(**{stats.USERS: -1})
+
+
+@receiver(post_save, sender=UserRating, dispatch_uid='count_rating_created')
+def rating_created(sender, instance, created, **kwargs):
+    if created:
+        stats.bump(**stats.rating_deltas(instance.rating))
+
+
+@receiver(post_delete, sender=UserRating, dispatch_uid='count_rating_deleted')
+def rating_deleted(sender, instance, **kwargs):
+    stats.bump(**stats.rating_deltas(instance.rating, sign=-1))
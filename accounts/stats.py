@@ -0,0 +1,158 @@
+"""
+Site-wide counters for the public stats endpoints.
+
+SiteCounter holds running totals (users, chat messages, ratings, a rating
+histogram and the rating sum), so ``site_stats`` and
+``satisfaction_percentage_view`` read a handful of primary-key rows
+instead of counting whole tables. The totals are bumped by the receivers
+in accounts/signals.py, and by ``save_exchange`` for its bulk_create,
+after the surrounding transaction commits so the hot rows are only
+locked briefly.
+
+Reads go through the cache for SITE_STATS['TTL'] seconds. When an entry
+goes stale, one worker recomputes it (guarded by ``cache.add``) while the
+others keep serving the stale value, so expiry never sends a burst of
+requests to the database at once.
+
+``python manage.py recount_site_stats`` recounts everything from the
+tables, e.g. after a crash between a commit and its counter update.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import SiteCounter, UserRating
+
+DEFAULT_CONFIG = {
+    'TTL': 30,
+    # Stale entries are kept this many times longer, to serve during a refresh
+    'STALE_FACTOR': 10,
+    'LOCK_TIMEOUT': 10,
+}
+
+USERS = 'users'
+CHAT_MESSAGES = 'chat_messages'
+RATINGS = 'ratings'
+RATING_SUM = 'rating_sum'
+
+
+def rating_counter(rating):
+    return f'ratings_{rating}'
+
+
+COUNTERS = [USERS, CHAT_MESSAGES, RATINGS, RATING_SUM] + [rating_counter(i) for i in range(1, 6)]
+
+CACHE_KEY = 'site_stats:counters'
+LOCK_KEY = 'site_stats:refresh'
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'SITE_STATS', {}))
+
+
+def apply_deltas(deltas):
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        updated = SiteCounter.objects.filter(name=name).update(value=F('value') + delta)
+        if not updated:
+            # First use without the migration backfill: start from a real count
+            recount()
+            return
+
+
+_local = threading.local()
+
+
+def bump(**deltas):
+    """Add deltas to counters once the current transaction commits"""
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        for name, delta in deltas.items():
+            pending[name] = pending.get(name, 0) + delta
+        return
+    transaction.on_commit(lambda: apply_deltas(deltas))
+
+
+@contextmanager
+def batched():
+    """Collect the bumps made inside the block into one update per counter (for bulk deletes)"""
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+    _local.pending = {}
+    try:
+        yield
+        pending = _local.pending
+    finally:
+        _local.pending = None
+    if pending:
+        transaction.on_commit(lambda: apply_deltas(pending))
+
+
+def rating_deltas(rating, sign=1):
+    return {RATINGS: sign, RATING_SUM: sign * rating, rating_counter(rating): sign}
+
+
+def count_all():
+    """Count every counter from the source tables"""
+    from pimxchat.models import ChatMessage
+
+    values = {name: 0 for name in COUNTERS}
+    values[USERS] = get_user_model().objects.count()
+    values[CHAT_MESSAGES] = ChatMessage.objects.count()
+    for row in UserRating.objects.values('rating').annotate(count=Count('id'), total=Sum('rating')):
+        values[rating_counter(row['rating'])] = row['count']
+        values[RATINGS] += row['count']
+        values[RATING_SUM] += row['total']
+    return values
+
+
+def recount():
+    values = count_all()
+    with transaction.atomic():
+        for name, value in values.items():
+            SiteCounter.objects.update_or_create(name=name, defaults={'value': value})
+    cache.delete(CACHE_KEY)
+    return values
+
+
+def read_counters():
+    values = dict(SiteCounter.objects.filter(name__in=COUNTERS).values_list('name', 'value'))
+    return {name: values.get(name, 0) for name in COUNTERS}
+
+
+def get_counters():
+    """Counter values from the cache, refreshed by a single worker when stale"""
+    config = get_config()
+    entry = cache.get(CACHE_KEY)
+    now = time.time()
+    if entry is not None and (entry['fresh_until'] > now or not cache.add(LOCK_KEY, 1, config['LOCK_TIMEOUT'])):
+        return entry['values']
+
+    try:
+        values = read_counters()
+        cache.set(CACHE_KEY, {'values': values, 'fresh_until': now + config['TTL']}, config['TTL'] * config['STALE_FACTOR'])
+    finally:
+        cache.delete(LOCK_KEY)
+    return values
+
+
+def satisfaction_percentage(values):
+    """Share of ratings that are 4 or 5"""
+    if not values[RATINGS]:
+        return 0
+    return int((values[rating_counter(4)] + values[rating_counter(5)]) / values[RATINGS] * 100)
+
+
+def average_satisfaction(values):
+    """Average rating as a percentage of the maximum score"""
+    if not values[RATINGS]:
+        return 0
+    return round(values[RATING_SUM] / values[RATINGS] / 5 * 100, 2)
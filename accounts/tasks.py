@@ -0,0 +1,17 @@
+from celery import shared_task
+
+from . import login_events
+from .outbox import drain
+
+
+@shared_task(ignore_result=True)
+def deliver_outbox():
+    """Drain the email outbox; queued after each enqueue when OUTBOX['USE_CELERY'] is set"""
+    sent, failed = drain()
+    return sent, failed
+
+
+@shared_task(ignore_result=True)
+def process_login_events():
+    """Drain the login event queue; queued after each login when LOGIN_EVENTS['USE_CELERY'] is set"""
+    return login_events.drain()
@@ -2,14 +2,27 @@ from django.test import TestCase, Client
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
 from django.utils import timezone
 from datetime import timedelta
+import re
 import tempfile
 import os
+from types import SimpleNamespace
+from unittest import mock
 from PIL import Image
 from .utils import is_code_expired, get_remaining_time, format_remaining_time
+from .models import CodeAttempt, OutboundEmail, LoginEvent, LoginHistory, RatingDailyRollup, RatingRollupState, UserRating
+from .outbox import drain
+from .geo import GeoIPService
+from .login_events import process_batch
+from .mail import get_templates, render_email
+from . import codes, ratelimit, retention, stats
+from .satisfaction import get_distribution, refresh_rollup
 from django.template import Template, Context
 from django.test import override_settings
+from django.db.models import Sum
 import jdatetime
 
 User = get_user_model()
@@ -693,6 +706,7 @@ class JalaliDateFilterTest(TestCase):
 
 class LoginCodeVerificationTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.user = User.objects.create_user(
             username='testuser',
@@ -726,9 +740,8 @@ class LoginCodeVerificationTests(TestCase):
         self.assertContains(response, 'تایید ورود')
         self.assertContains(response, 'test@example.com')
         
-        # Get the verification code from the user
-        self.user.refresh_from_db()
-        verification_code = self.user.verification_code
+        # Get the verification code from the email
+        verification_code = re.search(r'\d{6}', mail.outbox[-1].body).group()
         
         # Submit the correct verification code
         response = self.client.post(reverse('accounts:login_code_verify'), {
@@ -749,9 +762,8 @@ class LoginCodeVerificationTests(TestCase):
         """Test login code verification with invalid code"""
         # Setup user for verification
         self.user.last_verification_code_time = None
-        self.user.verification_code = '123456'
-        self.user.code_sent_at = timezone.now()
         self.user.save()
+        codes.issue_code(codes.LOGIN, self.user.pk)
         
         # Set session
         session = self.client.session
@@ -769,10 +781,8 @@ class LoginCodeVerificationTests(TestCase):
 
     def test_login_code_verification_expired_code(self):
         """Test login code verification with expired code"""
-        # Setup user with expired code
+        # Setup user with expired code (nothing left in the store)
         self.user.last_verification_code_time = None
-        self.user.verification_code = '123456'
-        self.user.code_sent_at = timezone.now() - timedelta(minutes=3)
         self.user.save()
         
         # Set session
@@ -839,3 +849,681 @@ class LoginCodeVerificationTests(TestCase):
         # Should redirect to home page (no verification needed)
         self.assertEqual(response.status_code, 302)
         self.assertRedirects(response, '/')
+
+
+class FlakyEmailBackend(LocmemEmailBackend):
+    """locmem backend that fails while `failures` is positive"""
+    failures = 0
+
+    def send_messages(self, messages):
+        if FlakyEmailBackend.failures > 0:
+            FlakyEmailBackend.failures -= 1
+            raise ConnectionError('SMTP unavailable')
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND='accounts.outbox.OutboxEmailBackend',
+    OUTBOX={'DELIVERY_BACKEND': 'accounts.tests.FlakyEmailBackend', 'MAX_ATTEMPTS': 2, 'BASE_DELAY': 60, 'USE_CELERY': False}
+)
+class OutboxTests(TestCase):
+    def setUp(self):
+        FlakyEmailBackend.failures = 0
+
+    def queue_email(self, to='queued@example.com'):
+        email = mail.EmailMultiAlternatives(subject='کد تایید شما', body='کد: 123456', to=[to])
+        email.attach_alternative('<p>کد: 123456</p>', 'text/html')
+        email.send()
+
+    def test_send_only_queues(self):
+        self.queue_email()
+        self.assertEqual(len(mail.outbox), 0)
+        queued = OutboundEmail.objects.get()
+        self.assertEqual(queued.status, OutboundEmail.PENDING)
+        self.assertEqual(queued.html_body, '<p>کد: 123456</p>')
+
+    def test_worker_delivers_batch(self):
+        for index in range(3):
+            self.queue_email(f'user{index}@example.com')
+        self.assertEqual(drain(), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT).exists())
+
+    def test_retry_then_dead_letter(self):
+        self.queue_email()
+        FlakyEmailBackend.failures = 1
+        self.assertEqual(drain(), (0, 1))
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+        OutboundEmail.objects.update(next_attempt_at=timezone.now())
+        FlakyEmailBackend.failures = 5
+        drain()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.DEAD)
+        self.assertIn('SMTP unavailable', email.last_error)
+        self.assertEqual(drain(), (0, 0))
+
+
+class GeoIPTests(TestCase):
+    def make_response(self, city, region, country):
+        return SimpleNamespace(
+            city=SimpleNamespace(name=city),
+            subdivisions=SimpleNamespace(most_specific=SimpleNamespace(name=region)),
+            country=SimpleNamespace(name=country)
+        )
+
+    def test_lookup_is_cached_and_skips_private_addresses(self):
+        service = GeoIPService('/nonexistent/GeoLite2-City.mmdb')
+        service.reader = mock.Mock()
+        service.reader.city.return_value = self.make_response('Tehran', 'Tehran', 'Iran')
+
+        self.assertEqual(service.lookup('5.160.0.1'), 'Tehran, Tehran, Iran')
+        self.assertEqual(service.lookup('5.160.0.1'), 'Tehran, Tehran, Iran')
+        self.assertEqual(service.reader.city.call_count, 1)
+
+        self.assertEqual(service.lookup('127.0.0.1'), 'Unknown')
+        self.assertEqual(service.lookup('not-an-ip'), 'Unknown')
+        self.assertEqual(service.reader.city.call_count, 1)
+
+    def test_missing_database_is_unknown(self):
+        self.assertEqual(GeoIPService('/nonexistent/GeoLite2-City.mmdb').lookup('5.160.0.1'), 'Unknown')
+
+    @mock.patch('requests.get')
+    def test_login_makes_no_outbound_request(self, mocked_get):
+        User.objects.create_user(username='geouser', email='geo@example.com', password='TestPass123!', is_verified=True)
+        response = self.client.post(reverse('accounts:login'), {
+            'email': 'geo@example.com',
+            'password': 'TestPass123!'
+        }, REMOTE_ADDR='5.160.0.1')
+        self.assertEqual(response.status_code, 302)
+        mocked_get.assert_not_called()
+
+
+class LoginEventTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='eventuser', email='event@example.com', password='TestPass123!', is_verified=True)
+
+    def login(self):
+        return self.client.post(reverse('accounts:login'), {
+            'email': 'event@example.com',
+            'password': 'TestPass123!'
+        }, REMOTE_ADDR='5.160.0.1', HTTP_USER_AGENT='TestBrowser/1.0')
+
+    def test_login_only_queues_an_event(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 302)
+
+        event = LoginEvent.objects.get(user=self.user)
+        self.assertEqual(event.ip_address, '5.160.0.1')
+        self.assertEqual(event.user_agent, 'TestBrowser/1.0')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.login_count, 0)
+        self.assertIsNotNone(self.user.last_login)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_tokens_survive_the_batch(self):
+        from django.contrib.auth.tokens import default_token_generator
+
+        self.login()
+        self.user.refresh_from_db()
+        token = default_token_generator.make_token(self.user)
+        process_batch()
+        self.user.refresh_from_db()
+        self.assertTrue(default_token_generator.check_token(self.user, token))
+
+    @mock.patch('accounts.login_events.lookup_location', return_value='Tehran, Tehran, Iran')
+    def test_batch_updates_user_history_and_notifies(self, mocked_lookup):
+        self.login()
+        self.client.logout()
+        self.login()
+
+        self.assertEqual(process_batch(), 2)
+        self.assertFalse(LoginEvent.objects.exists())
+        self.assertEqual(LoginHistory.objects.filter(user=self.user, location='Tehran, Tehran, Iran').count(), 2)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.login_count, 2)
+        self.assertEqual(self.user.last_login_ip, '5.160.0.1')
+        self.assertEqual(self.user.last_login_location, 'Tehran, Tehran, Iran')
+        self.assertIsNotNone(self.user.last_login)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].to, ['event@example.com'])
+        self.assertEqual(process_batch(), 0)
+
+    def test_no_notification_when_disabled(self):
+        self.user.login_notifications_enabled = False
+        self.user.save(update_fields=['login_notifications_enabled'])
+        self.login()
+
+        self.assertEqual(process_batch(), 1)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(LoginHistory.objects.filter(user=self.user).count(), 1)
+
+
+class MailRenderingTests(TestCase):
+    def test_text_part_comes_from_text_template(self):
+        html_content, text_content = render_email('accounts/email_verification', {
+            'user': {'username': 'mailuser'},
+            'code': '123456',
+            'verify_url': 'https://example.com/verify/?a=1&b=2',
+        })
+        self.assertIn('123456', html_content)
+        self.assertIn('<html', html_content)
+        self.assertIn('123456', text_content)
+        self.assertNotIn('<', text_content)
+        # Text templates are not HTML-escaped
+        self.assertIn('?a=1&b=2', text_content)
+        self.assertIn('تمامی حقوق محفوظ است', text_content)
+
+    @override_settings(DEBUG=False)
+    def test_templates_are_compiled_once(self):
+        self.assertIs(get_templates('accounts/email_change')[0], get_templates('accounts/email_change')[0])
+
+    def test_registration_email_has_text_alternative(self):
+        self.client.post(reverse('accounts:register'), {
+            'email': 'mailreg@example.com',
+            'username': 'mailreg',
+            'age': 25,
+            'password1': 'TestPass123!',
+            'password2': 'TestPass123!'
+        })
+        self.assertEqual(len(mail.outbox), 1)
+        message = mail.outbox[0]
+        self.assertNotIn('<', message.body)
+        self.assertEqual(message.alternatives[0][1], 'text/html')
+
+
+class CodeCacheCheckTests(TestCase):
+    def test_codes_need_a_shared_cache(self):
+        from django.core.cache import caches
+        from .checks import check_code_cache
+
+        self.assertEqual(check_code_cache(None), [])
+        self.assertEqual(codes.get_cache(codes.get_config()), caches['codes'])
+        with override_settings(VERIFICATION_CODES={'CACHE': 'default'}, CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        }):
+            self.assertEqual([warning.id for warning in check_code_cache(None)], ['accounts.W001'])
+
+
+@override_settings(VERIFICATION_CODES={'TTL': 120, 'MAX_ATTEMPTS': 3, 'RESEND_COOLDOWN': 60})
+class VerificationCodeStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_code_is_single_use(self):
+        code = codes.issue_code(codes.LOGIN, 1)
+        self.assertEqual(len(code), 6)
+        self.assertEqual(codes.verify_code(codes.LOGIN, 1, code), codes.VALID)
+        self.assertEqual(codes.verify_code(codes.LOGIN, 1, code), codes.EXPIRED)
+
+    def test_purposes_do_not_share_codes(self):
+        code = codes.issue_code(codes.LOGIN, 1)
+        self.assertEqual(codes.verify_code(codes.PASSWORD_RESET, 1, code), codes.EXPIRED)
+        self.assertEqual(codes.verify_code(codes.LOGIN, 2, code), codes.EXPIRED)
+
+    def test_wrong_guesses_lock_the_code(self):
+        code = codes.issue_code(codes.LOGIN, 1)
+        wrong = '000000' if code != '000000' else '111111'
+        self.assertEqual(codes.verify_code(codes.LOGIN, 1, wrong), codes.INVALID)
+        self.assertEqual(codes.verify_code(codes.LOGIN, 1, wrong), codes.INVALID)
+        self.assertEqual(codes.verify_code(codes.LOGIN, 1, wrong), codes.LOCKED)
+        self.assertEqual(codes.verify_code(codes.LOGIN, 1, code), codes.EXPIRED)
+
+    def test_attempts_are_counted_in_the_database(self):
+        code = codes.issue_code(codes.LOGIN, 1)
+        counter = CodeAttempt.objects.get(key=codes.make_key(codes.LOGIN, 1))
+        # The counter lives exactly as long as the code
+        self.assertAlmostEqual((counter.expires_at - timezone.now()).total_seconds(), 120, delta=5)
+        wrong = '000000' if code != '000000' else '111111'
+        codes.verify_code(codes.LOGIN, 1, wrong)
+        counter.refresh_from_db()
+        self.assertEqual(counter.attempts, 1)
+        CodeAttempt.objects.filter(pk=counter.pk).update(expires_at=timezone.now())
+        self.assertEqual(codes.verify_code(codes.LOGIN, 1, code), codes.EXPIRED)
+
+    def test_resend_cooldown(self):
+        codes.issue_code(codes.REGISTRATION, 'a@example.com')
+        with self.assertRaises(codes.CodeCooldown) as raised:
+            codes.issue_code(codes.REGISTRATION, 'A@example.com')
+        self.assertGreater(raised.exception.remaining, 0)
+        self.assertLessEqual(raised.exception.remaining, 60)
+
+    def test_expiry(self):
+        code = codes.issue_code(codes.LOGIN, 1)
+        self.assertGreater(codes.remaining_seconds(codes.LOGIN, 1), 100)
+        with mock.patch('accounts.codes.time.time', return_value=codes.time.time() + 121):
+            self.assertEqual(codes.remaining_seconds(codes.LOGIN, 1), 0)
+        codes.discard_code(codes.LOGIN, 1)
+        self.assertEqual(codes.verify_code(codes.LOGIN, 1, code), codes.EXPIRED)
+
+    def test_two_factor_login_does_not_write_codes_to_user(self):
+        user = User.objects.create_user(username='codeuser', email='code@example.com', password='TestPass123!', is_verified=True, two_factor_enabled=True)
+        response = self.client.post(reverse('accounts:login'), {
+            'email': 'code@example.com',
+            'password': 'TestPass123!'
+        })
+        self.assertRedirects(response, reverse('accounts:login_code_verify'), fetch_redirect_response=False)
+        user.refresh_from_db()
+        self.assertFalse(user.verification_code)
+        self.assertIsNone(user.code_sent_at)
+
+        code = re.search(r'\d{6}', mail.outbox[-1].body).group()
+        response = self.client.post(reverse('accounts:login_code_verify'), {'code': code})
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertEqual(self.client.session.get('_auth_user_id'), str(user.pk))
+
+
+@override_settings(RATE_LIMITS={
+    'ENABLED': True,
+    'CACHE': None,
+    'RULES': [
+        {'name': 'test_resend', 'path': r'^/accounts/ajax/resend-verification-code/$', 'methods': ['POST'], 'rate': '2/m', 'key': 'ip'},
+    ],
+})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        ratelimit.local_counters.clear()
+
+    def test_parse_rate(self):
+        self.assertEqual(ratelimit.parse_rate('20/m'), (20, 60))
+        self.assertEqual(ratelimit.parse_rate('5/10m'), (5, 600))
+        with self.assertRaises(ValueError):
+            ratelimit.parse_rate('often')
+
+    def test_sliding_window_counts_previous_window(self):
+        rule = ratelimit.Rule('window', '10/m')
+        counters = ratelimit.LocalCounters()
+        for _ in range(10):
+            self.assertEqual(ratelimit.hit(rule, 'ip:1', now=59, counters=counters), 0)
+        # Halfway into the next window half of the previous 10 still count
+        for _ in range(5):
+            self.assertEqual(ratelimit.hit(rule, 'ip:1', now=90, counters=counters), 0)
+        self.assertGreater(ratelimit.hit(rule, 'ip:1', now=90, counters=counters), 0)
+        self.assertEqual(ratelimit.hit(rule, 'ip:2', now=90, counters=counters), 0)
+
+    def test_middleware_returns_429_with_retry_after(self):
+        url = reverse('accounts:ajax_resend_verification_code')
+        for _ in range(2):
+            self.assertEqual(self.client.post(url, {'flow': 'unknown'}).status_code, 400)
+        response = self.client.post(url, {'flow': 'unknown'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(response.json()['retry_after'], int(response['Retry-After']))
+        # Other clients and other methods are not affected
+        self.assertEqual(self.client.post(url, {'flow': 'unknown'}, REMOTE_ADDR='10.0.0.2').status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+    async def test_middleware_under_asgi(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from .middleware import RateLimitMiddleware
+
+        async def view(request):
+            return HttpResponse('ok')
+
+        middleware = RateLimitMiddleware(view)
+        url = reverse('accounts:ajax_resend_verification_code')
+        statuses = [(await middleware(RequestFactory().post(url))).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        # Paths without a rule never leave the event loop
+        with mock.patch('accounts.middleware.sync_to_async') as wrapped:
+            self.assertEqual((await middleware(RequestFactory().get('/'))).status_code, 200)
+        wrapped.assert_not_called()
+
+    def test_cache_outage_falls_back_and_warns_once(self):
+        class Unreachable:
+            def incr(self, key, ttl):
+                raise ConnectionError('cache down')
+
+        rule = ratelimit.Rule('outage', '1/m')
+        with mock.patch.object(ratelimit, '_fallback_warned_at', None), \
+                self.assertLogs('accounts.ratelimit', 'WARNING') as logs:
+            self.assertEqual(ratelimit.hit(rule, 'ip:1', now=0, counters=Unreachable()), 0)
+            self.assertGreater(ratelimit.hit(rule, 'ip:1', now=0, counters=Unreachable()), 0)
+        self.assertEqual(len(logs.records), 1)
+
+    def test_per_user_key(self):
+        rule = ratelimit.Rule('per_user', '1/m', key='user')
+        user = User.objects.create_user(username='limited', email='limited@example.com', password='TestPass123!')
+        self.assertEqual(ratelimit.get_ident(rule, user=user, ip='1.2.3.4'), f'user:{user.pk}')
+        self.assertEqual(ratelimit.get_ident(rule, user=SimpleNamespace(is_authenticated=False), ip='1.2.3.4'), 'ip:1.2.3.4')
+
+
+class SatisfactionRollupTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f'rater{i}', email=f'rater{i}@example.com', password='TestPass123!')
+            for i in range(3)
+        ]
+
+    def rate(self, user, rating, days_ago):
+        rating = UserRating.objects.create(user=user, rating=rating)
+        UserRating.objects.filter(pk=rating.pk).update(submitted_at=timezone.now() - timedelta(days=days_ago))
+        return rating
+
+    def test_latest_rating_per_user(self):
+        self.rate(self.users[0], 1, days_ago=3)
+        self.rate(self.users[0], 5, days_ago=1)
+        self.rate(self.users[1], 4, days_ago=2)
+        self.rate(None, 2, days_ago=1)
+        refresh_rollup()
+
+        counts, total = get_distribution()
+        self.assertEqual(total, 2)
+        self.assertEqual(counts, {1: 0, 2: 0, 3: 0, 4: 1, 5: 1})
+        self.assertEqual(RatingDailyRollup.objects.aggregate(total=Sum('ratings'))['total'], 4)
+
+    def test_incremental_refresh_matches_full_rebuild(self):
+        self.rate(self.users[0], 2, days_ago=5)
+        self.rate(self.users[1], 3, days_ago=4)
+        refresh_rollup()
+        # users[0] rates again: their old day loses them, today gains them
+        self.rate(self.users[0], 5, days_ago=0)
+        self.rate(self.users[2], 5, days_ago=0)
+        self.assertGreater(refresh_rollup(), 0)
+        incremental = get_distribution()
+        self.assertEqual(incremental, ({1: 0, 2: 0, 3: 1, 4: 0, 5: 2}, 3))
+        # Nothing new: only the overlap is re-read, which changes nothing
+        refresh_rollup()
+        self.assertEqual(get_distribution(), incremental)
+
+        refresh_rollup(full=True)
+        self.assertEqual(get_distribution(), incremental)
+
+    def test_late_commits_inside_the_overlap_are_picked_up(self):
+        refresh_rollup()
+        # Submitted before the last refresh started, but committed after it
+        rating = self.rate(self.users[0], 4, days_ago=0)
+        watermark = RatingRollupState.objects.get().watermark
+        UserRating.objects.filter(pk=rating.pk).update(submitted_at=watermark - timedelta(minutes=1))
+        self.assertEqual(refresh_rollup(), 1)
+        self.assertEqual(get_distribution(), ({1: 0, 2: 0, 3: 0, 4: 1, 5: 0}, 1))
+
+    def test_stats_page_reads_rollup(self):
+        admin = User.objects.create_superuser(username='statsadmin', email='statsadmin@example.com', password='TestPass123!')
+        self.client.force_login(admin)
+        for i, user in enumerate(self.users):
+            self.rate(user, i + 3, days_ago=i)
+        response = self.client.get(reverse('admin:satisfaction_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total'], 3)
+        self.assertEqual(response.context['rating_counts'][5], 1)
+
+
+class SiteStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        stats.recount()
+
+    def test_counters_follow_inserts_and_deletes(self):
+        from pimxchat.models import ChatSession, ChatMessage
+        from pimxchat.views import save_exchange
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user(username='counted', email='counted@example.com', password='TestPass123!')
+        with self.captureOnCommitCallbacks(execute=True):
+            UserRating.objects.create(user=user, rating=5)
+            UserRating.objects.create(user=user, rating=4)
+            low = UserRating.objects.create(user=user, rating=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            low.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            save_exchange(ChatSession(user=user), 'سلام', 'درود', is_new=True, is_first=True)
+
+        counters = stats.read_counters()
+        self.assertEqual(counters, stats.count_all())
+        self.assertEqual(counters[stats.CHAT_MESSAGES], ChatMessage.objects.count())
+        self.assertEqual(counters[stats.RATINGS], 2)
+        self.assertEqual(counters[stats.RATING_SUM], 9)
+
+        response = self.client.get(reverse('accounts:site-stats'))
+        self.assertEqual(response.json(), {'user_count': User.objects.count(), 'chat_count': 2, 'satisfaction': 90.0})
+        response = self.client.get(reverse('accounts:satisfaction_percentage'))
+        self.assertEqual(response.json(), {'satisfaction_percentage': 100})
+
+    def test_reads_are_cached(self):
+        stats.get_counters()
+        with self.assertNumQueries(0):
+            stats.get_counters()
+
+    def test_stale_value_served_while_another_worker_refreshes(self):
+        stats.get_counters()
+        entry = cache.get(stats.CACHE_KEY)
+        entry['fresh_until'] = 0
+        entry['values'] = dict(entry['values'], users=-1)
+        cache.set(stats.CACHE_KEY, entry)
+
+        cache.add(stats.LOCK_KEY, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.get_counters()[stats.USERS], -1)
+        cache.delete(stats.LOCK_KEY)
+        self.assertEqual(stats.get_counters()[stats.USERS], User.objects.count())
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='keeper', email='keeper@example.com', password='TestPass123!')
+        self.old = timezone.now() - timedelta(days=100)
+
+    def rate(self, rating, when):
+        rating = UserRating.objects.create(user=self.user, rating=rating)
+        UserRating.objects.filter(pk=rating.pk).update(submitted_at=when)
+        return rating
+
+    def test_deletes_expired_ratings_in_batches(self):
+        expired = [self.rate(5, self.old) for _ in range(5)]
+        recent = self.rate(3, timezone.now())
+        stats.recount()
+        policy = retention.get_policies(['ratings'])[0]
+
+        self.assertEqual(retention.apply_policy(policy, batch_size=2, sleep=0, dry_run=True), 5)
+        self.assertEqual(UserRating.objects.count(), 6)
+
+        progress = []
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            deleted = retention.apply_policy(policy, batch_size=2, sleep=0, progress=lambda p, total, last: progress.append(total))
+        self.assertEqual(deleted, 5)
+        self.assertEqual(progress, [2, 4, 5])
+        # One counter update per batch, not per row
+        self.assertEqual(len(callbacks), 3)
+        self.assertEqual(list(UserRating.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertFalse(UserRating.objects.filter(pk__in=[r.pk for r in expired]).exists())
+        self.assertEqual(stats.read_counters(), stats.count_all())
+
+    def test_chat_sessions_policy_is_opt_in(self):
+        from pimxchat.models import ChatSession, ChatMessage
+
+        self.assertEqual([p.name for p in retention.get_policies(['chat_sessions'])], [])
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        session = ChatSession.objects.create(user=self.user)
+        for index in range(5):
+            ChatMessage.objects.create(session=session, content=f'قدیمی {index}')
+        ChatSession.objects.filter(pk=session.pk).update(updated_at=self.old)
+        stats.recount()
+
+        with override_settings(RETENTION={'POLICIES': {'chat_sessions': 30}}):
+            policy = retention.get_policies(['chat_sessions'])[0]
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(retention.apply_policy(policy, batch_size=2, sleep=0), 1)
+        self.assertFalse(ChatMessage.objects.exists())
+        # The session's messages go in batches of two before the session itself
+        message_deletes = [q for q in queries if q['sql'].startswith('DELETE FROM "pimxchat_chatmessage"')]
+        self.assertEqual(len(message_deletes), 3)
+        self.assertEqual(stats.read_counters()[stats.CHAT_MESSAGES], 0)
+
+    def test_abandoned_registration_files(self):
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import FileSystemStorage
+
+        with tempfile.TemporaryDirectory() as root:
+            storage = FileSystemStorage(location=root)
+            stale = storage.save('profile_pics/tmp_abc_me.png', ContentFile(b'x'))
+            fresh = storage.save('profile_pics/tmp_def_me.png', ContentFile(b'x'))
+            kept = storage.save('profile_pics/avatar.png', ContentFile(b'x'))
+            two_days_ago = (timezone.now() - timedelta(days=2)).timestamp()
+            for name in (stale, kept):
+                os.utime(storage.path(name), (two_days_ago, two_days_ago))
+
+            policy = retention.StorageFileRetentionPolicy('registration_files', 1, 'profile_pics', 'tmp_', storage=storage)
+            self.assertEqual(retention.apply_policy(policy, sleep=0), 1)
+            self.assertFalse(storage.exists(stale))
+            self.assertTrue(storage.exists(fresh))
+            self.assertTrue(storage.exists(kept))
+
+    def test_cleanup_userratings_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        self.rate(4, self.old)
+        out = StringIO()
+        call_command('cleanup_userratings', '--dry-run', stdout=out)
+        self.assertIn('Would delete 1', out.getvalue())
+        self.assertEqual(UserRating.objects.count(), 1)
+        call_command('cleanup_userratings', '--sleep', '0', stdout=out)
+        self.assertFalse(UserRating.objects.exists())
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='staff', email='staff@example.com', password='TestPass123!')
+        self.client.force_login(self.admin)
+        self.users = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            self.users += 1
+            user = User.objects.create_user(username=f'member{self.users}', email=f'member{self.users}@example.com', password='x')
+            LoginHistory.objects.create(user=user, ip_address='5.160.0.1', location='Tehran', logged_in_at=timezone.now())
+            OutboundEmail.objects.create(subject='سلام', body='متن', to=[user.email])
+
+    def assert_constant_queries(self, name, expected):
+        url = reverse(f'admin:{name}_changelist')
+        self.add_rows(2)
+        for _ in range(2):
+            with self.assertNumQueries(expected):
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.add_rows(8)
+
+    def test_user_changelist(self):
+        self.assert_constant_queries('accounts_user', 4)
+
+    def test_login_history_changelist(self):
+        self.assert_constant_queries('accounts_loginhistory', 4)
+
+    def test_outbound_email_changelist(self):
+        self.assert_constant_queries('accounts_outboundemail', 4)
+
+    def test_clear_user_chat_action(self):
+        from pimxchat.models import ChatSession, ChatMessage
+
+        session = ChatSession.objects.create(user=self.admin)
+        ChatMessage.objects.create(session=session, content='سلام')
+        ChatMessage.objects.create(session=session, content='درود', message_type='ai')
+        self.client.post(reverse('admin:accounts_user_changelist'), {
+            'action': 'clear_user_chat',
+            '_selected_action': [self.admin.pk],
+        })
+        self.assertFalse(ChatMessage.objects.exists())
+
+
+class AsyncMiddlewareTests(TestCase):
+    @override_settings(DEBUG=True)
+    def test_async_chain_is_not_adapted_to_sync(self):
+        """A sync-only middleware would run every async view through async_to_sync"""
+        from django.core.handlers.asgi import ASGIHandler
+
+        # With DEBUG, Django logs each handler it has to adapt while loading the chain
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ServerTimingTests(TestCase):
+    def timings(self, response):
+        entries = {}
+        for part in response['Server-Timing'].split(', '):
+            name, *params = part.split(';')
+            entries[name] = dict(param.split('=', 1) for param in params)
+        return entries
+
+    def test_header_and_log_line(self):
+        import json
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries, self.assertLogs('config.timing', 'INFO') as logs:
+            response = self.client.get(reverse('accounts:site-stats'))
+        entries = self.timings(response)
+        self.assertEqual(entries['db']['desc'], f'"{len(queries)}"')
+        self.assertIn('total', entries)
+        self.assertNotIn('template', entries)
+
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((line['path'], line['status']), (reverse('accounts:site-stats'), 200))
+        self.assertEqual(line['db']['count'], len(queries))
+        self.assertGreaterEqual(line['total_ms'], line['db']['ms'])
+
+    async def test_streaming_response_is_logged_when_finished(self):
+        import json
+        from asgiref.sync import sync_to_async
+        from django.test import AsyncClient
+
+        user = await sync_to_async(User.objects.create_user)(username='streamer', email='streamer@example.com', password='TestPass123!')
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(user)
+        with self.assertLogs('config.timing', 'INFO') as logs:
+            response = await client.get(reverse('pimxchat:api_export_history'))
+            self.assertIn('Server-Timing', response)
+            started = len(logs.records)
+            [chunk async for chunk in response.streaming_content]
+            self.assertEqual(len(logs.records), started + 1)
+        line = json.loads(logs.records[-1].getMessage())
+        # The history cursors are read while streaming, after the view returned
+        self.assertGreaterEqual(line['db']['count'], 2)
+
+    def test_template_time(self):
+        response = self.client.get(reverse('accounts:login'))
+        self.assertEqual(self.timings(response)['template']['desc'], '"1"')
+
+    def test_outbound_calls(self):
+        from config import timing
+        from pimxchat.circuit_breaker import CircuitBreaker, RetryPolicy, call
+
+        timings, token = timing.start()
+        try:
+            call(CircuitBreaker('chat_provider'), RetryPolicy(), lambda timeout: 'ok')
+            with timing.measure('smtp'):
+                pass
+        finally:
+            timing.finish(token)
+        self.assertEqual(timings.as_dict()['chat_provider']['count'], 1)
+        self.assertIn('smtp;dur=', timings.header())
+        # Nothing is collected outside a request
+        timing.record('db', 1.0)
+        self.assertNotIn('db', timings.entries)
+
+    def test_sampled_profile(self):
+        import pstats
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(REQUEST_TIMING={'PROFILE_RATE': 1.0, 'PROFILE_DIR': directory}):
+                response = Client().get(reverse('accounts:site-stats'))
+            self.assertEqual(response.status_code, 200)
+            files = os.listdir(directory)
+            self.assertEqual(len(files), 1)
+            self.assertTrue(files[0].endswith('.prof'))
+            self.assertIn('api-site-stats', files[0])
+            pstats.Stats(os.path.join(directory, files[0]))
+
+    def test_disabled(self):
+        with override_settings(REQUEST_TIMING={'ENABLED': False}):
+            response = Client().get(reverse('accounts:site-stats'))
+        self.assertNotIn('Server-Timing', response)
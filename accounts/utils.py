@@ -1,8 +1,6 @@
 from django.utils import timezone
 from datetime import timedelta
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from .mail import send_email
 
 def is_code_expired(code_sent_at, expiration_minutes=2):
     """
@@ -76,19 +74,10 @@ def format_remaining_time(remaining_seconds):
     else:
         return f"{seconds} ثانیه" 
 
-def send_verification_email(email, username, code, verify_url=None, template='accounts/email_verification.html'):
+def send_verification_email(email, username, code, verify_url=None, template='accounts/email_verification'):
     context = {
         'user': {'email': email, 'username': username},
         'code': code,
         'verify_url': verify_url,
-        'logo_url': '',  # Add if needed
     }
-    html_content = render_to_string(template, context)
-    text_content = strip_tags(html_content)
-    email_obj = EmailMultiAlternatives(
-        subject='کد تایید شما',
-        body=text_content,
-        to=[email]
-    )
-    email_obj.attach_alternative(html_content, "text/html")
-    email_obj.send() 
\ No newline at end of file
+    send_email(template, 'کد تایید شما', [email], context)
@@ -6,26 +6,23 @@ from django.core.exceptions import ValidationError
 from django.db import IntegrityError
 from .forms import UserRegisterForm, EmailVerificationForm
 from .models import User
-import random
 from django.contrib.auth import login as auth_login
 from django.http import HttpRequest
-import requests
 from .forms import EmailLoginForm
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth import logout as auth_logout
 from .forms import PasswordResetRequestForm, PasswordResetCodeForm, SetNewPasswordForm
-from .utils import is_code_expired, get_remaining_time, format_remaining_time
+from .utils import format_remaining_time, send_verification_email
+from . import codes
 import json
 from django.urls import reverse
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
 from django.contrib.auth.tokens import default_token_generator
 from .forms import ProfileEditForm, EmailChangeForm, EmailChangeVerificationForm
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from .mail import send_email
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
@@ -35,12 +32,10 @@ from django.db.models import Count, Q
 from django.views.decorators.http import require_http_methods
 import uuid
 from django.core.files.storage import default_storage
-from django.contrib.auth import get_user_model
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from pimxchat.models import ChatMessage
 from accounts.models import UserRating
-from django.db.models import Avg
+from . import stats
 
 def should_prompt_for_feedback(user):
     if not user.is_authenticated:
@@ -50,6 +45,16 @@ def should_prompt_for_feedback(user):
         return True
     return (timezone.now() - last_rating.submitted_at) > timedelta(days=30)
 
+CODE_ERRORS = {
+    codes.INVALID: 'کد تایید نامعتبر است. لطفاً دوباره تلاش کنید.',
+    codes.EXPIRED: 'کد تایید منقضی شده است. لطفاً کد جدید دریافت کنید.',
+    codes.LOCKED: 'تعداد تلاش‌های ناموفق بیش از حد مجاز است. لطفاً کد جدید دریافت کنید.',
+}
+
+def email_change_subject(user, new_email):
+    # The code confirms one specific address, not any address requested later
+    return f'{user.pk}:{new_email}'
+
 # Create your views here.
 
 def register_view(request):
@@ -71,30 +76,23 @@ def register_view(request):
                     tmp_path = default_storage.save(tmp_filename, profile_picture)
                     registration_data['profile_picture_tmp_path'] = tmp_path
                     registration_data['profile_picture_name'] = profile_picture.name
-                # Generate code
-                code = '{:06d}'.format(random.randint(0, 999999))
-                registration_data['verification_code'] = code
-                registration_data['code_sent_at'] = timezone.now().isoformat()
                 # Store in session
                 request.session['registration_data'] = registration_data
                 request.session.modified = True
+                # Generate code; within the cooldown the code already sent to this address stays valid
+                try:
+                    code = codes.issue_code(codes.REGISTRATION, registration_data['email'])
+                except codes.CodeCooldown:
+                    messages.info(request, 'کد تایید قبلاً به ایمیل شما ارسال شده است.')
+                    return redirect('accounts:verify_email', uidb64='session', token='session')
                 # Send verification email
                 verify_url = request.build_absolute_uri(reverse('accounts:verify_email', args=['session', 'session']))
                 context = {
                     'user': registration_data,
                     'code': code,
                     'verify_url': verify_url,
-                    'logo_url': request.build_absolute_uri('/static/img/logo.png'),
                 }
-                html_content = render_to_string('accounts/email_verification.html', context)
-                text_content = strip_tags(html_content)
-                email = EmailMultiAlternatives(
-                    subject='تایید ایمیل شما در PIMXCHAT',
-                    body=text_content,
-                    to=[registration_data['email']]
-                )
-                email.attach_alternative(html_content, "text/html")
-                email.send()
+                send_email('accounts/email_verification', 'تایید ایمیل شما در PIMXCHAT', [registration_data['email']], context, request)
                 messages.success(request, 'ثبت نام با موفقیت انجام شد! کد تایید به ایمیل شما ارسال شد.')
                 return redirect('accounts:verify_email', uidb64='session', token='session')
             except Exception as e:
@@ -118,36 +116,23 @@ def verify_email_view(request, uidb64, token):
         if not registration_data:
             messages.error(request, 'اطلاعات ثبت‌نام یافت نشد. لطفاً دوباره ثبت‌نام کنید.')
             return redirect('accounts:register')
-        # Calculate remaining_seconds for code validity and resend cooldown
-        from .utils import get_remaining_time, format_remaining_time
-        import datetime
-        code_sent_at = registration_data.get('code_sent_at')
-        if code_sent_at:
-            code_sent_at_dt = datetime.datetime.fromisoformat(code_sent_at)
-        else:
-            code_sent_at_dt = None
-        remaining_seconds = get_remaining_time(code_sent_at_dt, expiration_minutes=2)
+        # Calculate remaining_seconds for code validity
+        remaining_seconds = codes.remaining_seconds(codes.REGISTRATION, registration_data['email'])
+        # Send a new code if the previous one expired
+        if remaining_seconds <= 0 and request.method != 'POST':
+            try:
+                code = codes.issue_code(codes.REGISTRATION, registration_data['email'])
+                send_verification_email(registration_data['email'], registration_data['username'], code)
+                remaining_seconds = codes.remaining_seconds(codes.REGISTRATION, registration_data['email'])
+            except codes.CodeCooldown:
+                pass
         remaining_time_formatted = format_remaining_time(remaining_seconds)
-        # --- ADDED: Send email if code missing or expired ---
-        if not code_sent_at_dt or remaining_seconds <= 0:
-            # Generate new code and send email
-            code = '{:06d}'.format(random.randint(0, 999999))
-            registration_data['verification_code'] = code
-            registration_data['code_sent_at'] = datetime.datetime.now().isoformat()
-            request.session['registration_data'] = registration_data
-            request.session.modified = True
-            from .utils import send_verification_email
-            send_verification_email(registration_data['email'], registration_data['username'], code)
-            # Recalculate times
-            code_sent_at_dt = datetime.datetime.fromisoformat(registration_data['code_sent_at'])
-            remaining_seconds = get_remaining_time(code_sent_at_dt, expiration_minutes=2)
-            remaining_time_formatted = format_remaining_time(remaining_seconds)
         if request.method == 'POST':
             form = EmailVerificationForm(request.POST)
             if form.is_valid():
-                code = form.cleaned_data['code']
-                if code != registration_data['verification_code']:
-                    messages.error(request, 'کد تایید نامعتبر است. لطفاً دوباره تلاش کنید.')
+                result = codes.verify_code(codes.REGISTRATION, registration_data['email'], form.cleaned_data['code'])
+                if result != codes.VALID:
+                    messages.error(request, CODE_ERRORS[result])
                     return redirect('accounts:verify_email', uidb64='session', token='session')
                 else:
                     # Create user now
@@ -200,20 +185,19 @@ def verify_email_view(request, uidb64, token):
         if request.method == 'POST':
             form = EmailVerificationForm(request.POST)
             if form.is_valid():
-                code = form.cleaned_data['code']
-                if is_code_expired(user.code_sent_at, expiration_minutes=2):
+                result = codes.verify_code(codes.REGISTRATION, user.email, form.cleaned_data['code'])
+                if result == codes.EXPIRED:
                     messages.error(request, 'کد تایید منقضی شده است. لطفاً دوباره ثبت نام کنید.')
                     user.delete()
                     return redirect('accounts:register')
-                if code == user.verification_code:
+                if result == codes.VALID:
                     user.is_active = True
                     user.is_verified = True
-                    user.verification_code = ''
-                    user.save()
+                    user.save(update_fields=['is_active', 'is_verified'])
                     messages.success(request, 'ایمیل تایید شد! حالا می‌توانید وارد شوید.')
                     return redirect('accounts:login')
                 else:
-                    messages.error(request, 'کد تایید نامعتبر است. لطفاً دوباره تلاش کنید.')
+                    messages.error(request, CODE_ERRORS[result])
                     return redirect('accounts:verify_email', uidb64=uidb64, token=token)
             else:
                 for field, errors in form.errors.items():
@@ -222,7 +206,7 @@ def verify_email_view(request, uidb64, token):
                 return redirect('accounts:verify_email', uidb64=uidb64, token=token)
         else:
             form = EmailVerificationForm()
-        remaining_seconds = get_remaining_time(user.code_sent_at, expiration_minutes=2)
+        remaining_seconds = codes.remaining_seconds(codes.REGISTRATION, user.email)
         remaining_time_formatted = format_remaining_time(remaining_seconds)
         return render(request, 'accounts/verify_email.html', {
             'form': form,
@@ -251,75 +235,25 @@ def login_view(request: HttpRequest):
                     if not user.last_verification_code_time or (now - user.last_verification_code_time) > timedelta(hours=24):
                         require_code = True
                 if require_code:
-                    # Generate and send code
-                    code = '{:06d}'.format(random.randint(0, 999999))
-                    user.verification_code = code
-                    user.code_sent_at = now
-                    user.save(update_fields=['verification_code', 'code_sent_at'])
                     # Store user id in session for verification
                     request.session['pending_verification_user_id'] = user.pk
+                    # Generate and send code; within the cooldown the code already sent stays valid
+                    try:
+                        code = codes.issue_code(codes.LOGIN, user.pk)
+                    except codes.CodeCooldown:
+                        messages.info(request, 'کد تایید قبلاً به ایمیل شما ارسال شده است.')
+                        return redirect('accounts:login_code_verify')
                     # Send code email
                     context = {
                         'user': user,
                         'code': code,
-                        'logo_url': request.build_absolute_uri('/static/img/logo.png'),
                     }
-                    html_content = render_to_string('accounts/email_verification.html', context)
-                    text_content = strip_tags(html_content)
-                    email = EmailMultiAlternatives(
-                        subject='کد تایید ورود - PIMXCHAT',
-                        body=text_content,
-                        to=[user.email]
-                    )
-                    email.attach_alternative(html_content, "text/html")
-                    email.send()
+                    send_email('accounts/email_verification', 'کد تایید ورود - PIMXCHAT', [user.email], context, request)
                     messages.info(request, 'کد تایید به ایمیل شما ارسال شد. لطفاً کد را وارد کنید.')
                     return redirect('accounts:login_code_verify')
                 # If no code required, proceed as before
+                # Location, login fields and the notification are handled by accounts/login_events.py
                 auth_login(request, user)
-                # Gather detailed login information
-                login_time = now
-                ip = request.META.get('REMOTE_ADDR') or request.META.get('HTTP_X_FORWARDED_FOR', 'Unknown')
-                user_agent = request.META.get('HTTP_USER_AGENT', 'Unknown')
-                # Get location from IP using multiple services for better accuracy
-                location = 'Unknown'
-                try:
-                    geo_response = requests.get(f'https://ipapi.co/{ip}/json/', timeout=5)
-                    if geo_response.status_code == 200:
-                        geo_data = geo_response.json()
-                        city = geo_data.get('city', '')
-                        country = geo_data.get('country_name', '')
-                        region = geo_data.get('region', '')
-                        location_parts = [part for part in [city, region, country] if part]
-                        location = ', '.join(location_parts) if location_parts else 'Unknown'
-                    else:
-                        geo_response = requests.get(f'https://ipinfo.io/{ip}/json', timeout=5)
-                        if geo_response.status_code == 200:
-                            geo_data = geo_response.json()
-                            location = geo_data.get('loc', 'Unknown')
-                except Exception as e:
-                    location = 'Unknown (Error: ' + str(e) + ')'
-                user.update_login_info(ip, location, user_agent)
-                # Send detailed email notification only if enabled
-                if user.login_notifications_enabled:
-                    context = {
-                        'user': user,
-                        'login_time': login_time.strftime('%H:%M:%S %d-%m-%Y'),
-                        'login_date': login_time.strftime('%d-%m-%Y'),
-                        'ip': ip,
-                        'location': location,
-                        'user_agent': user_agent,
-                        'login_count': user.login_count,
-                    }
-                    html_content = render_to_string('accounts/email_login_notification.html', context)
-                    text_content = strip_tags(html_content)
-                    email = EmailMultiAlternatives(
-                        subject='ورود جدید به حساب شما - PIMXCHAT',
-                        body=text_content,
-                        to=[user.email]
-                    )
-                    email.attach_alternative(html_content, "text/html")
-                    email.send()
                 messages.success(request, 'ورود موفقیت‌آمیز بود!')
                 return redirect('/')
             except Exception as e:
@@ -354,74 +288,26 @@ def login_code_verify_view(request):
     if request.method == 'POST':
         form = EmailVerificationForm(request.POST)
         if form.is_valid():
-            code = form.cleaned_data['code']
-            if is_code_expired(user.code_sent_at, expiration_minutes=2):
-                messages.error(request, 'کد تایید منقضی شده است. لطفاً دوباره وارد شوید.')
+            result = codes.verify_code(codes.LOGIN, user.pk, form.cleaned_data['code'])
+            if result in (codes.EXPIRED, codes.LOCKED):
+                messages.error(request, 'کد تایید منقضی شده است. لطفاً دوباره وارد شوید.' if result == codes.EXPIRED else CODE_ERRORS[result])
                 # Clear session and redirect to login
                 if 'pending_verification_user_id' in request.session:
                     del request.session['pending_verification_user_id']
                 return redirect('accounts:login')
             
-            if code == user.verification_code:
-                # Clear verification code and login user
-                user.verification_code = ''
+            if result == codes.VALID:
+                # The only users-table write of the flow, once the code is right
                 user.last_verification_code_time = timezone.now()
-                user.save()
+                user.save(update_fields=['last_verification_code_time'])
                 
                 # Clear session
                 if 'pending_verification_user_id' in request.session:
                     del request.session['pending_verification_user_id']
                 
-                # Login user
+                # Login user; the bookkeeping is queued by the user_logged_in receiver
                 auth_login(request, user)
                 
-                # Gather detailed login information
-                login_time = timezone.now()
-                ip = request.META.get('REMOTE_ADDR') or request.META.get('HTTP_X_FORWARDED_FOR', 'Unknown')
-                user_agent = request.META.get('HTTP_USER_AGENT', 'Unknown')
-                
-                # Get location from IP using multiple services for better accuracy
-                location = 'Unknown'
-                try:
-                    geo_response = requests.get(f'https://ipapi.co/{ip}/json/', timeout=5)
-                    if geo_response.status_code == 200:
-                        geo_data = geo_response.json()
-                        city = geo_data.get('city', '')
-                        country = geo_data.get('country_name', '')
-                        region = geo_data.get('region', '')
-                        location_parts = [part for part in [city, region, country] if part]
-                        location = ', '.join(location_parts) if location_parts else 'Unknown'
-                    else:
-                        geo_response = requests.get(f'https://ipinfo.io/{ip}/json', timeout=5)
-                        if geo_response.status_code == 200:
-                            geo_data = geo_response.json()
-                            location = geo_data.get('loc', 'Unknown')
-                except Exception as e:
-                    location = 'Unknown (Error: ' + str(e) + ')'
-                
-                user.update_login_info(ip, location, user_agent)
-                
-                # Send detailed email notification only if enabled
-                if user.login_notifications_enabled:
-                    context = {
-                        'user': user,
-                        'login_time': login_time.strftime('%H:%M:%S %d-%m-%Y'),
-                        'login_date': login_time.strftime('%d-%m-%Y'),
-                        'ip': ip,
-                        'location': location,
-                        'user_agent': user_agent,
-                        'login_count': user.login_count,
-                    }
-                    html_content = render_to_string('accounts/email_login_notification.html', context)
-                    text_content = strip_tags(html_content)
-                    email = EmailMultiAlternatives(
-                        subject='ورود جدید به حساب شما - PIMXCHAT',
-                        body=text_content,
-                        to=[user.email]
-                    )
-                    email.attach_alternative(html_content, "text/html")
-                    email.send()
-                
                 messages.success(request, 'ورود موفقیت‌آمیز بود!')
                 return redirect('/')
             else:
@@ -433,7 +319,7 @@ def login_code_verify_view(request):
     else:
         form = EmailVerificationForm()
     
-    remaining_seconds = get_remaining_time(user.code_sent_at, expiration_minutes=2)
+    remaining_seconds = codes.remaining_seconds(codes.LOGIN, user.pk)
     remaining_time_formatted = format_remaining_time(remaining_seconds)
     
     return render(request, 'accounts/login_code_verify.html', {
@@ -455,17 +341,8 @@ def change_password_view(request):
                 if user.login_notifications_enabled:
                     context = {
                         'user': user,
-                        'logo_url': request.build_absolute_uri('/static/img/logo.png'),
                     }
-                    html_content = render_to_string('accounts/email_password_changed.html', context)
-                    text_content = strip_tags(html_content)
-                    email = EmailMultiAlternatives(
-                        subject='رمز عبور شما تغییر یافت - PIMXCHAT',
-                        body=text_content,
-                        to=[user.email]
-                    )
-                    email.attach_alternative(html_content, "text/html")
-                    email.send()
+                    send_email('accounts/email_password_changed', 'رمز عبور شما تغییر یافت - PIMXCHAT', [user.email], context, request)
                 messages.success(request, 'رمز عبور شما با موفقیت تغییر یافت!')
                 return redirect('/')
             except Exception as e:
@@ -491,10 +368,11 @@ def password_reset_request_view(request):
             try:
                 user = User.objects.get(email=email)
                 if user.two_factor_enabled:
-                    code = '{:06d}'.format(random.randint(0, 999999))
-                    user.verification_code = code
-                    user.code_sent_at = timezone.now()
-                    user.save()
+                    try:
+                        code = codes.issue_code(codes.PASSWORD_RESET, user.pk)
+                    except codes.CodeCooldown as e:
+                        messages.info(request, f'کد بازیابی قبلاً ارسال شده است. برای کد جدید {e.remaining} ثانیه صبر کنید.')
+                        return redirect('accounts:login')
                     uidb64 = urlsafe_base64_encode(force_bytes(user.pk))
                     token = default_token_generator.make_token(user)
                     try:
@@ -505,17 +383,8 @@ def password_reset_request_view(request):
                             'user': user,
                             'code': code,
                             'reset_url': reset_url,
-                            'logo_url': request.build_absolute_uri('/static/img/logo.png'),
                         }
-                        html_content = render_to_string('accounts/email_password_reset.html', context)
-                        text_content = strip_tags(html_content)
-                        email_obj = EmailMultiAlternatives(
-                            subject='درخواست بازیابی رمز عبور - PIMXCHAT',
-                            body=text_content,
-                            to=[user.email]
-                        )
-                        email_obj.attach_alternative(html_content, "text/html")
-                        email_obj.send()
+                        send_email('accounts/email_password_reset', 'درخواست بازیابی رمز عبور - PIMXCHAT', [user.email], context, request)
                         messages.success(request, 'کد بازیابی رمز عبور به ایمیل شما ارسال شد.')
                     except Exception as e:
                         messages.error(request, 'خطا در ارسال ایمیل بازیابی رمز عبور.')
@@ -542,11 +411,11 @@ def password_reset_code_view(request, uidb64, token):
         if request.method == 'POST':
             form = PasswordResetCodeForm(request.POST)
             if form.is_valid():
-                code = form.cleaned_data['code']
-                if is_code_expired(user.code_sent_at, expiration_minutes=2):
-                    messages.error(request, 'کد بازنشانی منقضی شده است. لطفاً دوباره تلاش کنید.')
+                result = codes.verify_code(codes.PASSWORD_RESET, user.pk, form.cleaned_data['code'])
+                if result in (codes.EXPIRED, codes.LOCKED):
+                    messages.error(request, 'کد بازنشانی منقضی شده است. لطفاً دوباره تلاش کنید.' if result == codes.EXPIRED else CODE_ERRORS[result])
                     return redirect('accounts:password_reset_request')
-                if code == user.verification_code:
+                if result == codes.VALID:
                     # Pass uidb64 and token to confirm view
                     return redirect('accounts:password_reset_confirm', uidb64=uidb64, token=token)
                 else:
@@ -559,7 +428,7 @@ def password_reset_code_view(request, uidb64, token):
                 return redirect('accounts:password_reset_code', uidb64=uidb64, token=token)
         else:
             form = PasswordResetCodeForm()
-        remaining_seconds = get_remaining_time(user.code_sent_at, expiration_minutes=2)
+        remaining_seconds = codes.remaining_seconds(codes.PASSWORD_RESET, user.pk)
         remaining_time_formatted = format_remaining_time(remaining_seconds)
         return render(request, 'accounts/password_reset_code.html', {
             'form': form,
@@ -583,23 +452,13 @@ def password_reset_confirm_view(request, uidb64, token):
             if form.is_valid():
                 try:
                     user.set_password(form.cleaned_data['new_password1'])
-                    user.verification_code = ''
                     user.save()
                     # Send password changed email only if notifications are enabled
                     if user.login_notifications_enabled:
                         context = {
                             'user': user,
-                            'logo_url': request.build_absolute_uri('/static/img/logo.png'),
                         }
-                        html_content = render_to_string('accounts/email_password_changed.html', context)
-                        text_content = strip_tags(html_content)
-                        email = EmailMultiAlternatives(
-                            subject='رمز عبور شما تغییر یافت - PIMXCHAT',
-                            body=text_content,
-                            to=[user.email]
-                        )
-                        email.attach_alternative(html_content, "text/html")
-                        email.send()
+                        send_email('accounts/email_password_changed', 'رمز عبور شما تغییر یافت - PIMXCHAT', [user.email], context, request)
                     messages.success(request, 'رمز عبور با موفقیت بازنشانی شد! حالا می‌توانید وارد شوید.')
                     return redirect('accounts:login')
                 except Exception as e:
@@ -623,17 +482,8 @@ def logout_view(request):
         try:
             context = {
                 'user': request.user,
-                'logo_url': request.build_absolute_uri('/static/img/logo.png'),
             }
-            html_content = render_to_string('accounts/email_logout_notification.html', context)
-            text_content = strip_tags(html_content)
-            email = EmailMultiAlternatives(
-                subject='خروج از حساب کاربری - PIMXCHAT',
-                body=text_content,
-                to=[request.user.email]
-            )
-            email.attach_alternative(html_content, "text/html")
-            email.send()
+            send_email('accounts/email_logout_notification', 'خروج از حساب کاربری - PIMXCHAT', [request.user.email], context, request)
         except Exception as e:
             print('LOGOUT EMAIL ERROR:', e)
     auth_logout(request)
@@ -702,10 +552,11 @@ def change_email_view(request):
                 new_email = form.cleaned_data['new_email']
                 
                 # Generate verification code
-                code = '{:06d}'.format(random.randint(0, 999999))
-                request.user.verification_code = code
-                request.user.code_sent_at = timezone.now()
-                request.user.save()
+                try:
+                    code = codes.issue_code(codes.EMAIL_CHANGE, email_change_subject(request.user, new_email))
+                except codes.CodeCooldown as e:
+                    messages.error(request, f'لطفاً {e.remaining} ثانیه دیگر دوباره تلاش کنید.')
+                    return render(request, 'accounts/change_email.html', {'form': form})
                 
                 # Generate token and uidb64 for email change verification
                 uidb64 = urlsafe_base64_encode(force_bytes(request.user.pk))
@@ -721,17 +572,8 @@ def change_email_view(request):
                         'code': code,
                         'verify_url': verify_url,
                         'new_email': new_email,
-                        'logo_url': request.build_absolute_uri('/static/img/logo.png'),
                     }
-                    html_content = render_to_string('accounts/email_change.html', context)
-                    text_content = strip_tags(html_content)
-                    email_obj = EmailMultiAlternatives(
-                        subject='تایید تغییر ایمیل - PIMXCHAT',
-                        body=text_content,
-                        to=[new_email]
-                    )
-                    email_obj.attach_alternative(html_content, "text/html")
-                    email_obj.send()
+                    send_email('accounts/email_change', 'تایید تغییر ایمیل - PIMXCHAT', [new_email], context, request)
                     
                     # Store new email in session for verification
                     request.session['pending_email_change'] = new_email
@@ -775,38 +617,28 @@ def verify_email_change_view(request, uidb64, token):
         if request.method == 'POST':
             form = EmailChangeVerificationForm(request.POST)
             if form.is_valid():
-                code = form.cleaned_data['code']
-                if is_code_expired(user.code_sent_at, expiration_minutes=2):
-                    messages.error(request, 'کد تایید منقضی شده است. لطفاً دوباره تلاش کنید.')
+                result = codes.verify_code(codes.EMAIL_CHANGE, email_change_subject(user, pending_email), form.cleaned_data['code'])
+                if result in (codes.EXPIRED, codes.LOCKED):
+                    messages.error(request, 'کد تایید منقضی شده است. لطفاً دوباره تلاش کنید.' if result == codes.EXPIRED else CODE_ERRORS[result])
                     # Clear session data
                     if 'pending_email_change' in request.session:
                         del request.session['pending_email_change']
                     return redirect('accounts:change_email')
                 
-                if code == user.verification_code:
+                if result == codes.VALID:
                     try:
                         # Save old email before changing
                         old_email = user.email
                         # Update user's email
                         user.email = pending_email
-                        user.verification_code = ''
-                        user.save()
+                        user.save(update_fields=['email'])
                         # Send notification to old email only if notifications are enabled
                         if old_email and old_email != pending_email and user.login_notifications_enabled:
                             context = {
                                 'user': user,
                                 'new_email': pending_email,
-                                'logo_url': request.build_absolute_uri('/static/img/logo.png'),
                             }
-                            html_content = render_to_string('accounts/email_email_changed.html', context)
-                            text_content = strip_tags(html_content)
-                            email_obj = EmailMultiAlternatives(
-                                subject='تغییر ایمیل حساب کاربری - PIMXCHAT',
-                                body=text_content,
-                                to=[old_email]
-                            )
-                            email_obj.attach_alternative(html_content, "text/html")
-                            email_obj.send()
+                            send_email('accounts/email_email_changed', 'تغییر ایمیل حساب کاربری - PIMXCHAT', [old_email], context, request)
                         # Clear session data
                         if 'pending_email_change' in request.session:
                             del request.session['pending_email_change']
@@ -823,7 +655,7 @@ def verify_email_change_view(request, uidb64, token):
         else:
             form = EmailChangeVerificationForm()
         
-        remaining_seconds = get_remaining_time(user.code_sent_at, expiration_minutes=2)
+        remaining_seconds = codes.remaining_seconds(codes.EMAIL_CHANGE, email_change_subject(user, pending_email))
         remaining_time_formatted = format_remaining_time(remaining_seconds)
         
         return render(request, 'accounts/verify_email_change.html', {
@@ -854,10 +686,11 @@ def resend_email_change_code_view(request, uidb64, token):
             return redirect('accounts:profile')
         
         # Generate new code
-        code = '{:06d}'.format(random.randint(0, 999999))
-        user.verification_code = code
-        user.code_sent_at = timezone.now()
-        user.save()
+        try:
+            code = codes.issue_code(codes.EMAIL_CHANGE, email_change_subject(user, pending_email))
+        except codes.CodeCooldown as e:
+            messages.error(request, f'لطفاً {e.remaining} ثانیه دیگر دوباره تلاش کنید.')
+            return redirect('accounts:verify_email_change', uidb64=uidb64, token=token)
         
         # Send verification email
         try:
@@ -868,17 +701,8 @@ def resend_email_change_code_view(request, uidb64, token):
                 'user': user,
                 'code': code,
                 'verify_url': verify_url,
-                'logo_url': request.build_absolute_uri('/static/img/logo.png'),
             }
-            html_content = render_to_string('accounts/email_change.html', context)
-            text_content = strip_tags(html_content)
-            email_obj = EmailMultiAlternatives(
-                subject='کد تایید تغییر ایمیل - PIMXCHAT',
-                body=text_content,
-                to=[pending_email]
-            )
-            email_obj.attach_alternative(html_content, "text/html")
-            email_obj.send()
+            send_email('accounts/email_change', 'کد تایید تغییر ایمیل - PIMXCHAT', [pending_email], context, request)
             messages.success(request, 'کد تایید جدید به ایمیل شما ارسال شد.')
             return redirect('accounts:verify_email_change', uidb64=uidb64, token=token)
         except Exception as e:
@@ -897,10 +721,11 @@ def resend_verification_code_view(request, uidb64, token):
         user = None
     if user is not None and default_token_generator.check_token(user, token):
         # Generate new code
-        code = '{:06d}'.format(random.randint(0, 999999))
-        user.verification_code = code
-        user.code_sent_at = timezone.now()
-        user.save()
+        try:
+            code = codes.issue_code(codes.REGISTRATION, user.email)
+        except codes.CodeCooldown as e:
+            messages.error(request, f'لطفاً {e.remaining} ثانیه دیگر دوباره تلاش کنید.')
+            return redirect('accounts:verify_email', uidb64=uidb64, token=token)
         # Send verification email with unique link
         verify_url = request.build_absolute_uri(
             reverse('accounts:verify_email', args=[uidb64, token])
@@ -909,17 +734,8 @@ def resend_verification_code_view(request, uidb64, token):
             'user': user,
             'code': code,
             'verify_url': verify_url,
-            'logo_url': request.build_absolute_uri('/static/img/logo.png'),
         }
-        html_content = render_to_string('accounts/email_verification.html', context)
-        text_content = strip_tags(html_content)
-        email = EmailMultiAlternatives(
-            subject='کد تایید ثبت نام - PIMXCHAT',
-            body=text_content,
-            to=[user.email]
-        )
-        email.attach_alternative(html_content, "text/html")
-        email.send()
+        send_email('accounts/email_verification', 'کد تایید ثبت نام - PIMXCHAT', [user.email], context, request)
         messages.success(request, 'کد تایید جدید به ایمیل شما ارسال شد.')
         return redirect('accounts:verify_email', uidb64=uidb64, token=token)
     else:
@@ -993,105 +809,60 @@ def ajax_resend_verification_code(request):
     if request.method != 'POST':
         return JsonResponse({'error': 'Invalid request method.'}, status=405)
     flow = request.POST.get('flow')
-    now = timezone.now()
     # Registration (session-based)
     if flow == 'registration':
         reg_data = request.session.get('registration_data')
         if not reg_data:
             return JsonResponse({'error': 'No registration data found.'}, status=400)
-        last_sent = reg_data.get('code_sent_at')
-        if last_sent:
-            last_sent = timezone.datetime.fromisoformat(last_sent)
-            if (now - last_sent) < timedelta(minutes=2):
-                remaining = 120 - int((now - last_sent).total_seconds())
-                return JsonResponse({'error': 'Please wait before resending.', 'remaining': remaining}, status=429)
-        # Generate and send new code
-        code = '{:06d}'.format(random.randint(0, 999999))
-        reg_data['verification_code'] = code
-        reg_data['code_sent_at'] = now.isoformat()
-        request.session['registration_data'] = reg_data
-        from .utils import send_verification_email
-        send_verification_email(reg_data['email'], reg_data['username'], code)
-        return JsonResponse({'success': True, 'remaining': 120})
+        purpose, subject = codes.REGISTRATION, reg_data['email']
+        send = lambda code: send_verification_email(reg_data['email'], reg_data['username'], code)
     # Email change (user-based)
     elif flow == 'email_change':
-        from .models import User
         uid = request.POST.get('uid')
         token = request.POST.get('token')
-        from django.utils.http import urlsafe_base64_decode
-        from django.contrib.auth.tokens import default_token_generator
         try:
             user = User.objects.get(pk=urlsafe_base64_decode(uid))
         except Exception:
             return JsonResponse({'error': 'User not found.'}, status=404)
         if not default_token_generator.check_token(user, token):
             return JsonResponse({'error': 'Invalid token.'}, status=403)
-        last_sent = user.code_sent_at
-        if last_sent and (now - last_sent) < timedelta(minutes=2):
-            remaining = 120 - int((now - last_sent).total_seconds())
-            return JsonResponse({'error': 'Please wait before resending.', 'remaining': remaining}, status=429)
-        code = '{:06d}'.format(random.randint(0, 999999))
-        user.verification_code = code
-        user.code_sent_at = now
-        user.save(update_fields=['verification_code', 'code_sent_at'])
         pending_email = request.session.get('pending_email_change')
-        from .utils import send_verification_email
-        send_verification_email(pending_email, user.username, code)
-        return JsonResponse({'success': True, 'remaining': 120})
+        if not pending_email:
+            return JsonResponse({'error': 'No pending email change.'}, status=400)
+        purpose, subject = codes.EMAIL_CHANGE, email_change_subject(user, pending_email)
+        send = lambda code: send_verification_email(pending_email, user.username, code)
     # Password reset (user-based)
     elif flow == 'password_reset':
-        from .models import User
         email = request.POST.get('email')
         try:
             user = User.objects.get(email=email)
         except User.DoesNotExist:
             return JsonResponse({'error': 'User not found.'}, status=404)
-        last_sent = user.code_sent_at
-        if last_sent and (now - last_sent) < timedelta(minutes=2):
-            remaining = 120 - int((now - last_sent).total_seconds())
-            return JsonResponse({'error': 'Please wait before resending.', 'remaining': remaining}, status=429)
-        code = '{:06d}'.format(random.randint(0, 999999))
-        user.verification_code = code
-        user.code_sent_at = now
-        user.save(update_fields=['verification_code', 'code_sent_at'])
-        from .utils import send_verification_email
-        send_verification_email(user.email, user.username, code)
-        return JsonResponse({'success': True, 'remaining': 120})
+        purpose, subject = codes.PASSWORD_RESET, user.pk
+        send = lambda code: send_verification_email(user.email, user.username, code)
     # Login code verification (user-based)
     elif flow == 'login_code':
-        from .models import User
         user_id = request.POST.get('user_id')
         if not user_id:
             return JsonResponse({'error': 'User ID is required.'}, status=400)
         try:
             user = User.objects.get(pk=user_id)
-        except User.DoesNotExist:
+        except (User.DoesNotExist, ValueError):
             return JsonResponse({'error': 'User not found.'}, status=404)
-        last_sent = user.code_sent_at
-        if last_sent and (now - last_sent) < timedelta(minutes=2):
-            remaining = 120 - int((now - last_sent).total_seconds())
-            return JsonResponse({'error': 'Please wait before resending.', 'remaining': remaining}, status=429)
-        code = '{:06d}'.format(random.randint(0, 999999))
-        user.verification_code = code
-        user.code_sent_at = now
-        user.save(update_fields=['verification_code', 'code_sent_at'])
-        # Send code email
-        context = {
+        purpose, subject = codes.LOGIN, user.pk
+        send = lambda code: send_email('accounts/email_verification', 'کد تایید ورود - PIMXCHAT', [user.email], {
             'user': user,
             'code': code,
-            'logo_url': request.build_absolute_uri('/static/img/logo.png'),
-        }
-        html_content = render_to_string('accounts/email_verification.html', context)
-        text_content = strip_tags(html_content)
-        email = EmailMultiAlternatives(
-            subject='کد تایید ورود - PIMXCHAT',
-            body=text_content,
-            to=[user.email]
-        )
-        email.attach_alternative(html_content, "text/html")
-        email.send()
-        return JsonResponse({'success': True, 'remaining': 120})
-    return JsonResponse({'error': 'Invalid flow.'}, status=400)
+        }, request)
+    else:
+        return JsonResponse({'error': 'Invalid flow.'}, status=400)
+
+    try:
+        code = codes.issue_code(purpose, subject)
+    except codes.CodeCooldown as e:
+        return JsonResponse({'error': 'Please wait before resending.', 'remaining': e.remaining}, status=429)
+    send(code)
+    return JsonResponse({'success': True, 'remaining': codes.remaining_seconds(purpose, subject)})
 
 @csrf_exempt
 def submit_rating_view(request):
@@ -1118,10 +889,8 @@ def submit_rating_view(request):
 
 @csrf_exempt
 def satisfaction_percentage_view(request):
-    total = UserRating.objects.count()
-    satisfied = UserRating.objects.filter(rating__gte=4).count()
-    percent = int((satisfied / total) * 100) if total > 0 else 0
-    return JsonResponse({'satisfaction_percentage': percent})
+    counters = stats.get_counters()
+    return JsonResponse({'satisfaction_percentage': stats.satisfaction_percentage(counters)})
 
 @login_required
 def logout_rating_view(request):
@@ -1141,17 +910,8 @@ def logout_rating_view(request):
             if request.user.login_notifications_enabled:
                 context = {
                     'user': request.user,
-                    'logo_url': request.build_absolute_uri('/static/img/logo.png'),
                 }
-                html_content = render_to_string('accounts/email_logout_notification.html', context)
-                text_content = strip_tags(html_content)
-                email = EmailMultiAlternatives(
-                    subject='خروج از حساب کاربری - PIMXCHAT',
-                    body=text_content,
-                    to=[request.user.email]
-                )
-                email.attach_alternative(html_content, "text/html")
-                email.send()
+                send_email('accounts/email_logout_notification', 'خروج از حساب کاربری - PIMXCHAT', [request.user.email], context, request)
         except Exception as e:
             print('LOGOUT EMAIL ERROR:', e)
         # Log out
@@ -1163,16 +923,9 @@ def logout_rating_view(request):
 
 @api_view(['GET'])
 def site_stats(request):
-    User = get_user_model()
-    user_count = User.objects.count()
-    chat_count = ChatMessage.objects.count()
-    satisfaction = UserRating.objects.aggregate(avg_rating=Avg('rating'))['avg_rating']
-    if satisfaction is None:
-        satisfaction_percent = 0
-    else:
-        satisfaction_percent = round((satisfaction / 5) * 100, 2)
+    counters = stats.get_counters()
     return Response({
-        'user_count': user_count,
-        'chat_count': chat_count,
-        'satisfaction': satisfaction_percent,
+        'user_count': counters[stats.USERS],
+        'chat_count': counters[stats.CHAT_MESSAGES],
+        'satisfaction': stats.average_satisfaction(counters),
     })
@@ -2,6 +2,8 @@
 ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django; the chat WebSocket (CHAT_WEBSOCKET['PATH']) is handled
+by pimxchat.websocket.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -13,4 +15,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, since it loads models
+from pimxchat.websocket import get_config, websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'] == get_config()['PATH']:
+            return await websocket_application(scope, receive, send)
+        # Unknown socket path: refuse the handshake
+        await receive()
+        return await send({'type': 'websocket.close'})
+    return await django_application(scope, receive, send)
@@ -0,0 +1,63 @@
+"""
+Lightweight counters shared through the Django cache.
+
+With the Redis cache configured (REDIS_URL) the numbers are global across
+workers; with the default local-memory cache they are per process.
+Read them at /api/metrics/ (staff only), as JSON or Prometheus text.
+"""
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+KEY_PREFIX = 'metrics:'
+NAMES_KEY = KEY_PREFIX + '__names__'
+
+# Callables returning {metric_name: value} for values computed on read (breaker state, ...)
+_gauge_providers = []
+
+
+def _register(name):
+    names = cache.get(NAMES_KEY) or set()
+    if name not in names:
+        names.add(name)
+        cache.set(NAMES_KEY, names, timeout=None)
+
+
+def incr(name, amount=1):
+    """Atomically increment a counter, creating it on first use"""
+    key = KEY_PREFIX + name
+    if cache.add(key, amount, timeout=None):
+        _register(name)
+        return amount
+    try:
+        return cache.incr(key, amount)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, amount, timeout=None)
+        return amount
+
+
+def register_gauges(provider):
+    """Register a callable that returns extra {name: value} pairs for snapshot()"""
+    if provider not in _gauge_providers:
+        _gauge_providers.append(provider)
+
+
+def snapshot():
+    """Return every known metric as a flat {name: value} dict"""
+    names = sorted(cache.get(NAMES_KEY) or ())
+    values = cache.get_many([KEY_PREFIX + name for name in names])
+    data = {name: values.get(KEY_PREFIX + name, 0) for name in names}
+    for provider in _gauge_providers:
+        data.update(provider())
+    return data
+
+
+@staff_member_required
+def metrics_view(request):
+    """Expose metrics as JSON, or Prometheus text with ?format=prometheus"""
+    data = snapshot()
+    if request.GET.get('format') == 'prometheus':
+        lines = [f'pimxchat_{name} {value}' for name, value in sorted(data.items())]
+        return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
+    return JsonResponse({'metrics': data})
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,8 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'accounts.middleware.ServerTimingMiddleware',  # First, so 'total' covers the whole stack
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'accounts.middleware.StaticFilesMiddleware',  # WhiteNoise, async-capable
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',  # Add locale middleware
     'django.middleware.common.CommonMiddleware',
@@ -53,13 +55,15 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'accounts.middleware.ErrorHandlingMiddleware',  # Custom error handling
+    'accounts.middleware.RateLimitMiddleware',  # After auth, so per-user rules see request.user
 ]
 
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to Server-Timing
+        'BACKEND': 'config.timing.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -87,6 +91,36 @@ DATABASES = {
 }
 
 
+# Cache
+# Set REDIS_URL to share cache state (circuit breaker, metrics, ...) between workers
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'pimxchat-default',
+        }
+    }
+
+# Verification codes (accounts/codes.py) must be visible to every worker: the Redis
+# cache when there is one, otherwise a database table created by the accounts migrations
+CACHES['codes'] = CACHES['default'] if REDIS_URL else {
+    'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+    'LOCATION': 'accounts_code_cache',
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -139,7 +173,9 @@ MEDIA_ROOT = BASE_DIR / 'media'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Email configuration
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Views only queue mail; `manage.py send_outbox` or Celery delivers it (accounts/outbox.py)
+EMAIL_BACKEND = 'accounts.outbox.OutboxEmailBackend'
+EMAIL_TIMEOUT = 20
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
@@ -147,6 +183,85 @@ EMAIL_HOST_USER = 'khalaj817@gmail.com'
 EMAIL_HOST_PASSWORD = 'pkmo eljxplmnsadj'
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Celery broker; defaults to the Redis cache server when one is configured
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', REDIS_URL or '')
+CELERY_TASK_IGNORE_RESULT = True
+
+OUTBOX = {
+    'DELIVERY_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    'BASE_DELAY': 30,
+    'MAX_DELAY': 60 * 60,
+    # With a broker, each enqueue also schedules accounts.tasks.deliver_outbox
+    'USE_CELERY': bool(CELERY_BROKER_URL),
+}
+
+# Sliding-window limits per user or client IP (accounts/ratelimit.py); 429 + Retry-After when exceeded
+RATE_LIMITS = {
+    'ENABLED': True,
+    # Shared counters when the Redis cache is configured, per-process otherwise
+    'CACHE': 'default' if REDIS_URL else None,
+    'RULES': [
+        # Each send is a provider request; the WebSocket send path shares these rules
+        {'name': 'chat_send', 'path': r'^/api/chat/send/', 'methods': ['POST'], 'rate': '20/m', 'key': 'user'},
+        {'name': 'chat_send_ip', 'path': r'^/api/chat/send/', 'methods': ['POST'], 'rate': '60/m', 'key': 'ip'},
+        # Each resend is an email
+        {'name': 'code_resend', 'path': r'^/accounts/ajax/resend-verification-code/$', 'methods': ['POST'], 'rate': '5/10m', 'key': 'ip'},
+        {'name': 'auth', 'path': r'^/accounts/(login|register|password-reset)/', 'methods': ['POST'], 'rate': '20/10m', 'key': 'ip'},
+    ],
+}
+
+# Verification codes live in the cache (accounts/codes.py), not on the users table
+VERIFICATION_CODES = {
+    'CACHE': 'codes',
+    'TTL': 2 * 60,
+    'MAX_ATTEMPTS': 5,
+    'RESEND_COOLDOWN': 2 * 60,
+}
+
+# Login bookkeeping (location, last_login_*, history, notification) runs off the
+# request in accounts/login_events.py: `manage.py process_login_events` or Celery
+LOGIN_EVENTS = {
+    'BATCH_SIZE': 200,
+    'USE_CELERY': bool(CELERY_BROKER_URL),
+}
+
+# Public site stats read SiteCounter rows kept current by signals (accounts/stats.py);
+# `manage.py recount_site_stats` repairs drift
+SITE_STATS = {
+    'TTL': 30,
+}
+
+# `manage.py apply_retention` (accounts/retention.py): age in days per policy, None keeps forever
+RETENTION = {
+    'BATCH_SIZE': 1000,
+    'SLEEP': 0.1,
+    'POLICIES': {
+        'ratings': 90,
+        'chat_sessions': None,
+        'orphan_messages': 30,
+        'code_attempts': 1,
+        'registration_files': 1,
+    },
+}
+
+# History imports (pimxchat/importer.py) run via Celery or `manage.py process_imports`
+CHAT_IMPORT = {
+    'BATCH_SIZE': 1000,
+    'MAX_UPLOAD_SIZE': 100 * 1024 * 1024,
+    'USE_CELERY': bool(CELERY_BROKER_URL),
+}
+
+# Server-Timing header and a JSON log line per request (config/timing.py);
+# PROFILE_RATE of requests are also profiled into PROFILE_DIR
+REQUEST_TIMING = {
+    'ENABLED': True,
+    'PROFILE_RATE': float(os.environ.get('PROFILE_RATE', 0)),
+    'PROFILE_DIR': 'profiles',
+    'PROFILER': 'cprofile',
+}
+
 # Internationalization
 LANGUAGES = [
     ('fa', 'فارسی'),
@@ -158,6 +273,87 @@ LOCALE_PATHS = [BASE_DIR / 'locale']
 # Custom user model
 AUTH_USER_MODEL = 'accounts.User'
 
+# AI provider used by the chat endpoints (see pimxchat/providers.py).
+# Point BASE_URL at `python manage.py fake_gemini` to load-test offline.
+CHAT_PROVIDER = {
+    'BACKEND': os.environ.get('CHAT_PROVIDER_BACKEND', 'pimxchat.providers.GeminiProvider'),
+    'OPTIONS': {
+        'API_KEY': os.environ.get('CHAT_PROVIDER_API_KEY', ''),
+        'BASE_URL': os.environ.get('CHAT_PROVIDER_BASE_URL', 'https://generativelanguage.googleapis.com/v1'),
+        'MODEL': os.environ.get('CHAT_PROVIDER_MODEL', 'gemini-1.5-flash'),
+    },
+}
+
+# Fail fast while the provider is degraded (see pimxchat/circuit_breaker.py)
+CHAT_PROVIDER_BREAKER = {
+    'WINDOW_SECONDS': 60,
+    'MIN_REQUESTS': 10,
+    'ERROR_RATE_THRESHOLD': 0.5,
+    'P95_LATENCY_THRESHOLD': 8.0,  # seconds
+    'OPEN_SECONDS': 30,
+}
+
+# Exact-match cache for replies to repeated prompts (see pimxchat/response_cache.py)
+CHAT_RESPONSE_CACHE = {
+    'TTL': 60 * 60,
+    'MAX_ENTRIES': 1000,
+    'MAX_MESSAGE_LENGTH': 200,
+    # Shared tier across workers, only when the Redis cache is configured
+    'SHARED_CACHE': 'default' if REDIS_URL else None,
+}
+
+# Login geolocation from a local MaxMind .mmdb (accounts/geo.py); no network calls on login
+GEOIP = {
+    'PATH': os.environ.get('GEOIP_PATH', str(BASE_DIR / 'geoip' / 'GeoLite2-City.mmdb')),
+    'CACHE_SIZE': 10000,
+    # Seconds between checks for a newer database file
+    'REFRESH_INTERVAL': 60 * 60,
+    # With a MaxMind license key the file is also downloaded when older than MAX_AGE_DAYS
+    'LICENSE_KEY': os.environ.get('MAXMIND_LICENSE_KEY', ''),
+    'EDITION': 'GeoLite2-City',
+    'MAX_AGE_DAYS': 7,
+}
+
+# Retries for transient 429/503 errors, bounded by a total deadline in seconds
+CHAT_PROVIDER_RETRY = {
+    'MAX_ATTEMPTS': 3,
+    'BASE_DELAY': 0.25,
+    'MAX_DELAY': 2.0,
+    'DEADLINE': 15.0,
+}
+
+# History sent with each message; older turns are folded into ChatSession.summary
+CHAT_CONTEXT = {
+    'TOKEN_BUDGET': 3000,
+    'SUMMARY_TOKEN_BUDGET': 500,
+    'MAX_RECENT_MESSAGES': 40,
+    'SUMMARY_LINE_WORDS': 25,
+}
+
+# Cursor pagination for the sessions/messages APIs (?limit= is capped at MAX_PAGE_SIZE)
+CHAT_PAGINATION = {
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 200,
+    # Admin changelists stop counting rows here (pimxchat.pagination.BoundedCountPaginator)
+    'ADMIN_COUNT_LIMIT': 10000,
+}
+
+# Chat history search (pimxchat/search.py): FTS5 on SQLite, tsvector + GIN on PostgreSQL
+CHAT_SEARCH = {
+    'SNIPPET_LENGTH': 160,
+    'ADMIN_LIMIT': 1000,
+}
+
+# Chat WebSocket (config/asgi.py): operations running at once per socket, outgoing frame buffer
+CHAT_WEBSOCKET = {
+    'PATH': '/ws/chat/',
+    'MAX_IN_FLIGHT': 4,
+    'SEND_QUEUE_SIZE': 64,
+    'MAX_FRAME_BYTES': 64 * 1024,
+    # Relays multi-tab pushes between workers; without Redis they stay within one process
+    'PUSH_REDIS_URL': REDIS_URL,
+}
+
 # Error templates
 HANDLER404 = 'django.views.defaults.page_not_found'
 HANDLER500 = 'django.views.defaults.server_error'
@@ -0,0 +1,254 @@
+"""
+Per-request timings: where did the time go?
+
+``accounts.middleware.ServerTimingMiddleware`` starts a RequestTimings for
+each request and keeps it in a context variable, which asgiref copies into
+the threads of ``sync_to_async``, so async views are covered too. While it
+is active it collects:
+
+- ``db``: query count and time, from a wrapper installed on every database
+  connection (``connection.execute_wrappers``);
+- ``template``: template rendering, through the DjangoTemplates backend
+  below;
+- outbound calls timed with ``measure(name)``: the chat provider (in
+  circuit_breaker.py), GeoIP lookups and SMTP sends;
+- ``total``.
+
+The response gets a ``Server-Timing`` header, which browser dev tools
+show next to the request, and one JSON line is logged to
+``config.timing``. For streaming responses the header covers the time
+until the response starts; the log line is written when the stream ends.
+
+A fraction PROFILE_RATE of requests is also profiled (cProfile, or
+pyinstrument if installed and selected) into PROFILE_DIR. cProfile only
+sees the thread it was started on, so for async views it shows the event
+loop; pyinstrument follows the request across awaits.
+"""
+import contextvars
+import cProfile
+import json
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates as BaseDjangoTemplates
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    'HEADER': True,
+    'LOG': True,
+    # Fraction of requests to profile, 0 to disable
+    'PROFILE_RATE': 0.0,
+    'PROFILE_DIR': 'profiles',
+    # 'cprofile' or 'pyinstrument'
+    'PROFILER': 'cprofile',
+}
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'REQUEST_TIMING', {}))
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        # name -> [count, seconds]
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds, count=1):
+        with self.lock:
+            entry = self.entries.setdefault(name, [0, 0.0])
+            entry[0] += count
+            entry[1] += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def header(self):
+        """Server-Timing header value, durations in milliseconds"""
+        parts = [
+            f'{name};dur={seconds * 1000:.1f};desc="{count}"'
+            for name, (count, seconds) in sorted(self.entries.items())
+        ]
+        parts.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(parts)
+
+    def as_dict(self):
+        data = {
+            name: {'count': count, 'ms': round(seconds * 1000, 1)}
+            for name, (count, seconds) in sorted(self.entries.items())
+        }
+        data['total_ms'] = round(self.elapsed() * 1000, 1)
+        return data
+
+
+def start():
+    """Begin collecting for the current request; returns (timings, token for finish())"""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def finish(token):
+    _current.reset(token)
+
+
+@contextmanager
+def activate(timings):
+    """Collect into timings inside the block (for code run after the view returned)"""
+    token = _current.set(timings)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def record(name, seconds, count=1):
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds, count)
+
+
+@contextmanager
+def measure(name):
+    """Time the block under name, when a request is being timed"""
+    if _current.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    if _current.get() is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record('db', time.perf_counter() - started)
+
+
+def wrap_connection(sender=None, connection=None, **kwargs):
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+def install():
+    """Time the queries of every connection, including those already open"""
+    # Async views query from sync_to_async threads, each with its own
+    # connection, so a per-request connection.execute_wrapper() would miss them
+    connection_created.connect(wrap_connection, dispatch_uid='config.timing')
+    for connection in connections.all(initialized_only=True):
+        wrap_connection(connection=connection)
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        with measure('template'):
+            return self.template.render(context, request)
+
+
+class DjangoTemplates(BaseDjangoTemplates):
+    """DjangoTemplates whose top-level renders count as 'template' time"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def log(request, response, timings):
+    data = {
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'user': getattr(getattr(request, 'user', None), 'pk', None),
+    }
+    data.update(timings.as_dict())
+    logger.info(json.dumps(data))
+
+
+_profiling = threading.Lock()
+
+
+class Profile:
+    """A sampled profile of one request, written to PROFILE_DIR when stopped"""
+
+    def __init__(self, config):
+        self.directory = Path(settings.BASE_DIR, config['PROFILE_DIR'])
+        self.kind = config['PROFILER']
+        if self.kind == 'pyinstrument':
+            from pyinstrument import Profiler
+            self.profiler = Profiler(async_mode='enabled')
+        else:
+            self.profiler = cProfile.Profile()
+
+    def start(self):
+        if self.kind == 'pyinstrument':
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self, request, timings):
+        if self.kind == 'pyinstrument':
+            self.profiler.stop()
+        else:
+            self.profiler.disable()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^\w]+', '-', request.path).strip('-') or 'root'
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.method}-{slug[:60]}-{timings.elapsed() * 1000:.0f}ms"
+        if self.kind == 'pyinstrument':
+            path = self.directory / f'{name}.html'
+            path.write_text(self.profiler.output_html(), encoding='utf-8')
+        else:
+            path = self.directory / f'{name}.prof'
+            self.profiler.dump_stats(path)
+        return path
+
+
+def start_profile(config):
+    """A started Profile for a sampled request, or None"""
+    if not config['PROFILE_RATE'] or random.random() >= config['PROFILE_RATE']:
+        return None
+    # Only one profiler can be active in a process at a time
+    if not _profiling.acquire(blocking=False):
+        return None
+    try:
+        profile = Profile(config)
+        profile.start()
+    except Exception as e:
+        _profiling.release()
+        logger.warning("Could not start request profiler: %s", e)
+        return None
+    return profile
+
+
+def stop_profile(profile, request, timings):
+    try:
+        return profile.stop(request, timings)
+    except Exception as e:
+        logger.warning("Could not write request profile: %s", e)
+    finally:
+        _profiling.release()
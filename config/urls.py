@@ -24,6 +24,7 @@ from django.conf.urls.static import static
 from django.conf.urls.i18n import i18n_patterns
 from accounts.admin import user_detail_view, custom_admin_site
 from config.error_handlers import custom_404, custom_500, custom_403, custom_400
+from config.metrics import metrics_view
 from django.views.static import serve as static_serve
 import os
 
@@ -33,6 +34,7 @@ urlpatterns = [
     path('', include('pimxchat.urls')),
     # Custom admin URLs
     path('admin/user/<int:user_id>/detail/', user_detail_view, name='admin_user_detail'),
+    path('api/metrics/', metrics_view, name='metrics'),
 ]
 
 urlpatterns += [
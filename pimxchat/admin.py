@@ -1,32 +1,66 @@
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
 from .models import ChatSession, ChatMessage
+from .pagination import BoundedCountPaginator
+from . import search
+from .signals import collecting_deletes
 
 admin.site.site_header = 'مدیریت PIMXCHAT'
 admin.site.site_title = 'پنل مدیریت PIMXCHAT'
 admin.site.index_title = 'خوش آمدید به پنل مدیریت PIMXCHAT'
 
-class ChatSessionAdmin(admin.ModelAdmin):
+class CollectingDeletesMixin:
+    """Admin deletes that batch the chat message receivers (see signals.collecting_deletes)"""
+
+    def delete_model(self, request, obj):
+        with collecting_deletes():
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with collecting_deletes():
+            super().delete_queryset(request, queryset)
+
+class ChatSessionAdmin(CollectingDeletesMixin, admin.ModelAdmin):
+    # message_count is the denormalized column kept by signals.py, not a per-row COUNT
     list_display = ('user', 'title', 'created_at', 'updated_at', 'is_active', 'message_count')
     list_filter = ('is_active', 'created_at', 'updated_at')
     search_fields = ('user__username', 'user__email', 'title')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('created_at', 'updated_at', 'message_count', 'last_message_at', 'preview')
     ordering = ('-updated_at',)
-    
-    def message_count(self, obj):
-        return obj.messages.count()
-    message_count.short_description = 'تعداد پیام‌ها'
+    list_select_related = ('user',)
+    paginator = BoundedCountPaginator
+    show_full_result_count = False
     
     class Meta:
         verbose_name = _('جلسه چت')
         verbose_name_plural = _('جلسات چت')
 
-class ChatMessageAdmin(admin.ModelAdmin):
+class ChatMessageAdmin(CollectingDeletesMixin, admin.ModelAdmin):
     list_display = ('session', 'message_type', 'content_preview', 'timestamp', 'is_welcome_message')
     list_filter = ('message_type', 'timestamp', 'is_welcome_message')
-    search_fields = ('content', 'session__user__username')
+    # content is searched through the full-text index, see get_search_results
+    search_fields = ('session__user__username',)
     readonly_fields = ('timestamp',)
-    ordering = ('-timestamp',)
+    ordering = ('-timestamp', '-id')
+    # str(session) shows the session's user
+    list_select_related = ('session__user',)
+    raw_id_fields = ('session',)
+    paginator = BoundedCountPaginator
+    show_full_result_count = False
+    
+    def get_search_results(self, request, queryset, search_term):
+        by_username, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        terms = search.query_terms(search_term)
+        if not terms:
+            return by_username, may_have_duplicates
+        if search.get_backend() is None:
+            matches = self.model.objects.all()
+            for term in terms:
+                matches = matches.filter(content__icontains=term)
+        else:
+            matches = search.find_ids(terms, limit=search.get_config()['ADMIN_LIMIT'])
+        # Username matches from search_fields, or messages containing the words
+        return by_username | queryset.filter(pk__in=matches), may_have_duplicates
     
     def content_preview(self, obj):
         return obj.content[:50] + "..." if len(obj.content) > 50 else obj.content
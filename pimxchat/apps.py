@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class PimxchatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pimxchat'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # Register the provider breaker so its state shows up in /api/metrics/ from the start
+        from .circuit_breaker import get_breaker
+        get_breaker()
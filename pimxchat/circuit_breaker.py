@@ -0,0 +1,350 @@
+"""
+Circuit breaker and retry policy around the AI provider.
+
+Breaker state lives in the Django cache so every worker sharing the cache
+sees the same state. While the breaker is open, calls fail immediately
+(the views then answer with a canned reply) instead of waiting for the
+upstream timeout. After OPEN_SECONDS a single half-open probe is let
+through: success closes the breaker, failure re-opens it.
+
+Transient upstream errors (429/503, timeouts, dropped connections) are
+retried with full-jitter exponential backoff, but never beyond the total
+DEADLINE budget of the call.
+"""
+import time
+import bisect
+import random
+import asyncio
+import logging
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from config import metrics, timing
+from .providers import ProviderError
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+TRANSIENT_STATUS_CODES = (429, 503)
+
+DEFAULT_BREAKER = {
+    'WINDOW_SECONDS': 60,
+    # The window is counted in buckets of this many seconds and slides in these steps
+    'BUCKET_SECONDS': 10,
+    'MIN_REQUESTS': 10,
+    'ERROR_RATE_THRESHOLD': 0.5,
+    'P95_LATENCY_THRESHOLD': 8.0,
+    # Bounds (seconds) of the latency histogram p95 is read from; the threshold is always one
+    'LATENCY_BUCKETS': (0.25, 0.5, 1, 2, 4, 8, 15, 30),
+    'OPEN_SECONDS': 30,
+}
+
+DEFAULT_RETRY = {
+    'MAX_ATTEMPTS': 3,
+    'BASE_DELAY': 0.25,
+    'MAX_DELAY': 2.0,
+    'DEADLINE': 15.0,
+}
+
+
+class CircuitOpenError(ProviderError):
+    """Raised instead of calling upstream while the breaker is open"""
+
+
+def histogram_p95(counts, bounds):
+    """Lower bound of the histogram bucket holding the 95th percentile"""
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = int(round(0.95 * (total - 1)))
+    seen = 0
+    for index, count in enumerate(counts):
+        seen += count
+        if seen > rank:
+            return float(bounds[index - 1]) if index else 0.0
+
+
+class CircuitBreaker:
+    """
+    Outcomes are counted with cache.incr() in per-bucket keys, so concurrent
+    workers never overwrite each other's samples. Latencies go into a
+    histogram whose buckets include P95_LATENCY_THRESHOLD, which makes the
+    "p95 >= threshold" test exact. The state itself ({'state', 'opened_at',
+    'epoch'}) is only written on transitions; each trip starts a new epoch,
+    which resets the counts.
+    """
+
+    def __init__(self, name, **config):
+        self.name = name
+        options = dict(DEFAULT_BREAKER, **config)
+        self.window_seconds = options['WINDOW_SECONDS']
+        self.bucket_seconds = options['BUCKET_SECONDS']
+        self.min_requests = options['MIN_REQUESTS']
+        self.error_rate_threshold = options['ERROR_RATE_THRESHOLD']
+        self.p95_latency_threshold = options['P95_LATENCY_THRESHOLD']
+        self.latency_bounds = sorted(set(options['LATENCY_BUCKETS']) | {self.p95_latency_threshold})
+        self.open_seconds = options['OPEN_SECONDS']
+        self.key = f'breaker:{name}'
+        self.probe_key = f'breaker:{name}:probe'
+        self.trip_key = f'breaker:{name}:trip'
+
+    def _load(self):
+        return cache.get(self.key) or {'state': CLOSED, 'opened_at': None, 'epoch': 0}
+
+    def _save(self, data):
+        cache.set(self.key, data, timeout=None)
+
+    def _bucket_key(self, epoch, bucket):
+        return f'{self.key}:{epoch}:{bucket}'
+
+    def _incr(self, key):
+        timeout = self.window_seconds + self.bucket_seconds
+        if cache.add(key, 1, timeout=timeout):
+            return
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.set(key, 1, timeout=timeout)
+
+    def _counts(self, epoch, now):
+        """(failures, latency histogram) over the window"""
+        current = int(now // self.bucket_seconds)
+        buckets = [self._bucket_key(epoch, bucket)
+                   for bucket in range(current - self.window_seconds // self.bucket_seconds + 1, current + 1)]
+        keys = [f'{bucket}:failures' for bucket in buckets]
+        for index in range(len(self.latency_bounds) + 1):
+            keys.extend(f'{bucket}:latency:{index}' for bucket in buckets)
+        values = cache.get_many(keys)
+        failures = sum(values.get(f'{bucket}:failures', 0) for bucket in buckets)
+        histogram = [
+            sum(values.get(f'{bucket}:latency:{index}', 0) for bucket in buckets)
+            for index in range(len(self.latency_bounds) + 1)
+        ]
+        return failures, histogram
+
+    def allow_request(self):
+        """True if a call may go upstream now"""
+        data = self._load()
+        if data['state'] == CLOSED:
+            return True
+        if data['state'] == OPEN and time.time() - data['opened_at'] < self.open_seconds:
+            metrics.incr(f'{self.name}_breaker_rejections_total')
+            return False
+        # Cool-down elapsed: let exactly one probe through across all workers
+        if cache.add(self.probe_key, 1, timeout=self.open_seconds):
+            if data['state'] != HALF_OPEN:
+                data['state'] = HALF_OPEN
+                self._save(data)
+            return True
+        metrics.incr(f'{self.name}_breaker_rejections_total')
+        return False
+
+    def record(self, success, latency):
+        now = time.time()
+        data = self._load()
+
+        if data['state'] == HALF_OPEN:
+            cache.delete(self.probe_key)
+            if success:
+                self._save(dict(data, state=CLOSED, opened_at=None))
+            else:
+                cache.delete(self.trip_key)
+                self._trip(data, now)
+            return
+
+        bucket = self._bucket_key(data['epoch'], int(now // self.bucket_seconds))
+        if not success:
+            self._incr(f'{bucket}:failures')
+        self._incr(f'{bucket}:latency:{bisect.bisect_right(self.latency_bounds, latency)}')
+
+        failures, histogram = self._counts(data['epoch'], now)
+        requests_count = sum(histogram)
+        if requests_count >= self.min_requests:
+            error_rate = failures / requests_count
+            latency_p95 = histogram_p95(histogram, self.latency_bounds)
+            if error_rate >= self.error_rate_threshold or latency_p95 >= self.p95_latency_threshold:
+                self._trip(data, now)
+
+    def _trip(self, data, now):
+        # Several workers can cross the threshold at once; only the first one trips
+        if not cache.add(self.trip_key, now, timeout=self.open_seconds):
+            return
+        self._save({'state': OPEN, 'opened_at': now, 'epoch': data['epoch'] + 1})
+        metrics.incr(f'{self.name}_breaker_trips_total')
+        logger.warning("Circuit breaker '%s' opened", self.name)
+
+    def status(self):
+        data = self._load()
+        failures, histogram = self._counts(data['epoch'], time.time())
+        requests_count = sum(histogram)
+        return {
+            'state': data['state'],
+            'window_requests': requests_count,
+            'error_rate': failures / requests_count if requests_count else 0.0,
+            'p95_latency': histogram_p95(histogram, self.latency_bounds),
+        }
+
+    def gauges(self):
+        status = self.status()
+        return {
+            f'{self.name}_breaker_state': STATE_CODES[status['state']],
+            f'{self.name}_breaker_error_rate': round(status['error_rate'], 4),
+            f'{self.name}_breaker_p95_latency_seconds': round(status['p95_latency'], 4),
+        }
+
+
+def is_transient(exc):
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, ProviderError):
+        return exc.status_code in TRANSIENT_STATUS_CODES
+    return isinstance(exc, (httpx.TimeoutException, httpx.TransportError,
+                            requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+class RetryPolicy:
+    def __init__(self, **config):
+        options = dict(DEFAULT_RETRY, **config)
+        self.max_attempts = options['MAX_ATTEMPTS']
+        self.base_delay = options['BASE_DELAY']
+        self.max_delay = options['MAX_DELAY']
+        self.deadline = options['DEADLINE']
+
+    def next_delay(self, attempt, exc, started):
+        """Seconds to wait before the next attempt, or None to give up"""
+        if attempt + 1 >= self.max_attempts or not is_transient(exc):
+            return None
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        if time.monotonic() - started + delay >= self.deadline:
+            return None
+        return delay
+
+    def remaining(self, started):
+        return max(0.1, self.deadline - (time.monotonic() - started))
+
+
+def start_attempt(breaker, attempt):
+    """allow_request() plus the attempt counters, as one sync call"""
+    if not breaker.allow_request():
+        return False
+    metrics.incr(f'{breaker.name}_requests_total')
+    if attempt:
+        metrics.incr(f'{breaker.name}_retries_total')
+    return True
+
+
+def finish_attempt(breaker, success, latency):
+    breaker.record(success, latency)
+    if not success:
+        metrics.incr(f'{breaker.name}_failures_total')
+
+
+# The breaker and metrics talk to the cache synchronously, which must not
+# happen on the event loop: the async paths run them in a worker thread
+astart_attempt = sync_to_async(start_attempt, thread_sensitive=False)
+afinish_attempt = sync_to_async(finish_attempt, thread_sensitive=False)
+
+
+def call(breaker, policy, func, *args, **kwargs):
+    """Run func(*args, timeout=..., **kwargs) through the breaker and retry policy"""
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        if not start_attempt(breaker, attempt):
+            raise CircuitOpenError('Circuit breaker is open')
+        call_started = time.monotonic()
+        try:
+            with timing.measure(breaker.name):
+                result = func(*args, timeout=policy.remaining(started), **kwargs)
+        except Exception as exc:
+            finish_attempt(breaker, False, time.monotonic() - call_started)
+            delay = policy.next_delay(attempt, exc, started)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        finish_attempt(breaker, True, time.monotonic() - call_started)
+        return result
+
+
+async def acall(breaker, policy, func, *args, **kwargs):
+    """Async version of call() for coroutine functions"""
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        if not await astart_attempt(breaker, attempt):
+            raise CircuitOpenError('Circuit breaker is open')
+        call_started = time.monotonic()
+        try:
+            with timing.measure(breaker.name):
+                result = await func(*args, timeout=policy.remaining(started), **kwargs)
+        except Exception as exc:
+            await afinish_attempt(breaker, False, time.monotonic() - call_started)
+            delay = policy.next_delay(attempt, exc, started)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        await afinish_attempt(breaker, True, time.monotonic() - call_started)
+        return result
+
+
+async def astream(breaker, policy, func, *args, **kwargs):
+    """Stream func's chunks; retries only happen before the first chunk is yielded"""
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        if not await astart_attempt(breaker, attempt):
+            raise CircuitOpenError('Circuit breaker is open')
+        call_started = time.monotonic()
+        first_chunk_latency = None
+        try:
+            async for chunk in func(*args, timeout=policy.remaining(started), **kwargs):
+                if first_chunk_latency is None:
+                    # Time to first token is what users feel, so that is what the breaker tracks
+                    first_chunk_latency = time.monotonic() - call_started
+                yield chunk
+        except Exception as exc:
+            await afinish_attempt(breaker, False, time.monotonic() - call_started)
+            timing.record(breaker.name, time.monotonic() - call_started)
+            delay = None if first_chunk_latency is not None else policy.next_delay(attempt, exc, started)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        await afinish_attempt(breaker, True, first_chunk_latency if first_chunk_latency is not None else time.monotonic() - call_started)
+        timing.record(breaker.name, time.monotonic() - call_started)
+        return
+
+
+_breaker = None
+
+
+def get_breaker():
+    """Breaker guarding the configured chat provider"""
+    global _breaker
+    if _breaker is None:
+        _breaker = CircuitBreaker('chat_provider', **getattr(settings, 'CHAT_PROVIDER_BREAKER', {}))
+        metrics.register_gauges(_breaker.gauges)
+    return _breaker
+
+
+def get_retry_policy():
+    return RetryPolicy(**getattr(settings, 'CHAT_PROVIDER_RETRY', {}))
@@ -0,0 +1,116 @@
+"""
+Conversation context for the AI provider.
+
+Each send includes as many of the most recent turns as fit in
+``CHAT_CONTEXT['TOKEN_BUDGET']``. Turns that fall out of that window are
+folded into a short rolling summary stored on the session
+(``ChatSession.summary``/``summarized_through``), so each send reads at
+most MAX_RECENT_MESSAGES rows, however long the session gets. Turns
+beyond that cap are folded into the summary as well, even when the
+recent ones would all fit.
+"""
+from django.conf import settings
+
+from .models import ChatSession
+
+DEFAULT_CONFIG = {
+    'TOKEN_BUDGET': 3000,
+    'SUMMARY_TOKEN_BUDGET': 500,
+    'MAX_RECENT_MESSAGES': 40,
+    'SUMMARY_LINE_WORDS': 25,
+}
+
+SUMMARY_LABELS = {
+    'fa': {'user': 'کاربر', 'ai': 'دستیار'},
+    'en': {'user': 'User', 'ai': 'Assistant'},
+}
+
+
+def estimate_tokens(text):
+    """
+    Cheap local token estimate, no tokenizer needed.
+
+    Latin text averages about 4 characters per token; Persian/Arabic
+    script is split much finer, about 2 characters per token.
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return max(1, ascii_chars // 4 + (len(text) - ascii_chars) // 2)
+
+
+class ConversationContext:
+    """Prior turns (oldest first, as (message_type, content) pairs) plus the rolling summary"""
+
+    def __init__(self, turns=None, summary=''):
+        self.turns = turns or []
+        self.summary = summary
+
+    def __bool__(self):
+        return bool(self.turns or self.summary)
+
+
+def summarize_turn(message_type, content, language='fa', words=25):
+    """One extractive summary line: the speaker and the start of what they said"""
+    labels = SUMMARY_LABELS.get(language, SUMMARY_LABELS['en'])
+    text = ' '.join(content.split()[:words])
+    if len(content.split()) > words:
+        text += ' …'
+    return f"{labels.get(message_type, message_type)}: {text}"
+
+
+def trim_summary(summary, budget):
+    """Drop the oldest summary lines until the summary fits its budget"""
+    lines = summary.split('\n')
+    while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > budget:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+
+def build_context(session, message='', language='fa', config=None):
+    """Assemble the context window for the next send and fold overflow into the summary"""
+    options = dict(DEFAULT_CONFIG, **(config or getattr(settings, 'CHAT_CONTEXT', {})))
+
+    limit = options['MAX_RECENT_MESSAGES']
+    unsummarized = (
+        session.messages
+        .filter(id__gt=session.summarized_through or 0, is_welcome_message=False, message_type__in=('user', 'ai'))
+        .order_by('-id')
+        .values_list('id', 'message_type', 'content')
+    )
+    # One extra row tells whether older turns lie past the cap
+    recent = list(unsummarized[:limit + 1])
+    past_cap = []
+    if len(recent) > limit:
+        recent.pop()
+        # Those turns overflow whatever their size (imported or migrated history).
+        # The summary keeps only its newest lines, so one more capped read is enough.
+        past_cap = list(unsummarized.filter(id__lt=recent[-1][0])[:limit])
+
+    available = options['TOKEN_BUDGET'] - estimate_tokens(message) - estimate_tokens(session.summary)
+    window = []
+    overflow = []
+    used = 0
+    # Newest first: keep turns while they fit, everything older than the first miss overflows
+    for message_id, message_type, content in recent:
+        cost = estimate_tokens(content)
+        if not overflow and used + cost <= available:
+            window.append((message_type, content))
+            used += cost
+        else:
+            overflow.append((message_id, message_type, content))
+    overflow.extend(past_cap)
+
+    summary = session.summary
+    if overflow:
+        lines = [summary] if summary else []
+        for message_id, message_type, content in reversed(overflow):
+            lines.append(summarize_turn(message_type, content, language, options['SUMMARY_LINE_WORDS']))
+        summary = trim_summary('\n'.join(lines), options['SUMMARY_TOKEN_BUDGET'])
+        summarized_through = overflow[0][0]
+        ChatSession.objects.filter(pk=session.pk).update(summary=summary, summarized_through=summarized_through)
+        session.summary = summary
+        session.summarized_through = summarized_through
+
+    window.reverse()
+    return ConversationContext(turns=window, summary=summary)
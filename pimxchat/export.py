@@ -0,0 +1,246 @@
+"""
+Server-side export of a user's chat history.
+
+The export is generated while it is sent: sessions and messages are read
+with two ``iterator(chunk_size=...)`` cursors ordered by session id and
+merged, then encoded and compressed chunk by chunk, so a worker's memory
+use does not depend on the size of the history. Formats:
+
+- ``ndjson``: one JSON object per line, a header first, then each session
+  followed by its messages. This is the backup format the importer reads.
+- ``json``: a single JSON document inside a zip archive.
+- ``md``: Markdown for reading.
+
+``ndjson`` and ``md`` can also be gzipped. An interrupted download can be
+resumed: every export is a snapshot as of the ``as_of`` time in its
+header, and ``after=<session id>`` continues after the last session that
+arrived complete.
+"""
+import json
+import zipfile
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ChatMessage, ChatSession
+
+DEFAULT_CONFIG = {
+    'CHUNK_SIZE': 500,
+    # Bytes collected before a chunk is sent
+    'BUFFER_SIZE': 64 * 1024,
+}
+
+VERSION = 1
+
+FORMATS = {
+    # format: (extension, content type)
+    'ndjson': ('ndjson', 'application/x-ndjson'),
+    'json': ('zip', 'application/zip'),
+    'md': ('md', 'text/markdown; charset=utf-8'),
+}
+GZIP_FORMATS = ('ndjson', 'md')
+
+SESSION_FIELDS = ('id', 'title', 'created_at', 'updated_at', 'is_active', 'summary')
+MESSAGE_FIELDS = ('id', 'session_id', 'message_type', 'content', 'timestamp', 'is_welcome_message')
+
+ROLE_LABELS = {'user': 'کاربر', 'ai': 'دستیار', 'system': 'سیستم'}
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'CHAT_EXPORT', {}))
+
+
+def iter_history(user, as_of, after=None, chunk_size=None):
+    """Yield ('session', row) and ('message', row) pairs, each session followed by its messages"""
+    chunk_size = chunk_size or get_config()['CHUNK_SIZE']
+    sessions = ChatSession.objects.filter(user=user, created_at__lte=as_of)
+    messages = ChatMessage.objects.filter(session__user=user, timestamp__lte=as_of)
+    if after:
+        sessions = sessions.filter(id__gt=after)
+        messages = messages.filter(session_id__gt=after)
+    sessions = sessions.order_by('id').values(*SESSION_FIELDS).iterator(chunk_size=chunk_size)
+    messages = messages.order_by('session_id', 'timestamp', 'id').values(*MESSAGE_FIELDS).iterator(chunk_size=chunk_size)
+
+    message = next(messages, None)
+    for session in sessions:
+        yield 'session', session
+        # Both cursors are ordered by session id; skip messages of sessions created after as_of
+        while message is not None and message['session_id'] < session['id']:
+            message = next(messages, None)
+        while message is not None and message['session_id'] == session['id']:
+            yield 'message', message
+            message = next(messages, None)
+
+
+def session_record(row):
+    return {
+        'type': 'session',
+        'id': str(row['id']),
+        'title': row['title'],
+        'created_at': row['created_at'].isoformat(),
+        'updated_at': row['updated_at'].isoformat(),
+        'is_active': row['is_active'],
+        'summary': row['summary'],
+    }
+
+
+def message_record(row):
+    return {
+        'type': 'message',
+        'id': row['id'],
+        'session_id': str(row['session_id']),
+        'role': row['message_type'],
+        'content': row['content'],
+        'timestamp': row['timestamp'].isoformat(),
+        'is_welcome_message': row['is_welcome_message'],
+    }
+
+
+def header_record(user, as_of, after=None):
+    return {
+        'type': 'export',
+        'version': VERSION,
+        'user': user.username,
+        'as_of': as_of.isoformat(),
+        'after': str(after) if after else None,
+    }
+
+
+def dumps(record):
+    return json.dumps(record, ensure_ascii=False)
+
+
+def ndjson_text(user, as_of, after=None):
+    yield dumps(header_record(user, as_of, after)) + '\n'
+    for kind, row in iter_history(user, as_of, after):
+        record = session_record(row) if kind == 'session' else message_record(row)
+        yield dumps(record) + '\n'
+
+
+def json_text(user, as_of, after=None):
+    header = header_record(user, as_of, after)
+    del header['type']
+    # The header object without its closing brace, then the sessions array
+    yield dumps(header)[:-1] + ', "sessions": ['
+    first_session = True
+    first_message = True
+    for kind, row in iter_history(user, as_of, after):
+        if kind == 'session':
+            record = session_record(row)
+            del record['type']
+            yield ('' if first_session else ']}, ') + dumps(record)[:-1] + ', "messages": ['
+            first_session = False
+            first_message = True
+        else:
+            record = message_record(row)
+            del record['type'], record['session_id']
+            yield ('' if first_message else ', ') + dumps(record)
+            first_message = False
+    yield ('' if first_session else ']}') + ']}'
+
+
+def markdown_text(user, as_of, after=None):
+    yield f"# PIMXCHAT — {user.username}\n\n_{as_of.strftime('%Y-%m-%d %H:%M')}_\n"
+    for kind, row in iter_history(user, as_of, after):
+        if kind == 'session':
+            yield f"\n## {row['title'] or 'چت جدید'}\n\n_{row['created_at'].strftime('%Y-%m-%d %H:%M')}_\n"
+        else:
+            role = ROLE_LABELS.get(row['message_type'], row['message_type'])
+            yield f"\n**{role}** ({row['timestamp'].strftime('%H:%M')}):\n\n{row['content']}\n"
+
+
+TEXT_WRITERS = {
+    'ndjson': ndjson_text,
+    'json': json_text,
+    'md': markdown_text,
+}
+
+
+def buffered(pieces, size):
+    """Join small pieces of bytes into chunks of about size bytes"""
+    buffer = []
+    length = 0
+    for piece in pieces:
+        if not piece:
+            continue
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(pieces):
+    compressor = zlib.compressobj(wbits=31)
+    for piece in pieces:
+        yield compressor.compress(piece)
+    yield compressor.flush()
+
+
+class ZipStream:
+    """Write-only file object collecting what zipfile writes, for streaming a zip without seeking"""
+
+    def __init__(self):
+        self.pieces = []
+
+    def write(self, data):
+        self.pieces.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        pieces, self.pieces = self.pieces, []
+        return b''.join(pieces)
+
+
+def zipped(pieces, name):
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(name, 'w', force_zip64=True) as member:
+            for piece in pieces:
+                member.write(piece)
+                yield stream.drain()
+        yield stream.drain()
+    yield stream.drain()
+
+
+def filename(fmt, compress=False, as_of=None):
+    extension, _ = FORMATS[fmt]
+    name = f"pimxchat-history-{(as_of or timezone.now()).strftime('%Y%m%d-%H%M%S')}.{extension}"
+    return name + '.gz' if compress else name
+
+
+def content_type(fmt, compress=False):
+    return 'application/gzip' if compress else FORMATS[fmt][1]
+
+
+def export_chunks(user, fmt, compress=False, as_of=None, after=None):
+    """Generate the export as chunks of bytes"""
+    as_of = as_of or timezone.now()
+    pieces = (text.encode('utf-8') for text in TEXT_WRITERS[fmt](user, as_of, after))
+    if fmt == 'json':
+        pieces = zipped(pieces, 'pimxchat-history.json')
+    elif compress:
+        pieces = gzipped(pieces)
+    return buffered(pieces, get_config()['BUFFER_SIZE'])
+
+
+async def stream(chunks):
+    """Serve a synchronous chunk generator from an async view, one chunk per thread hop"""
+    next_chunk = sync_to_async(next)
+    try:
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # Release the database cursors if the client went away early
+        await sync_to_async(chunks.close)()
@@ -0,0 +1,33 @@
+"""
+Shared async HTTP client for outbound API calls (Gemini).
+
+One pooled ``httpx.AsyncClient`` is kept per event loop, so under ASGI every
+request in the process reuses the same keep-alive connections to
+generativelanguage.googleapis.com instead of paying a new TCP+TLS handshake
+per message.
+"""
+import asyncio
+import weakref
+
+import httpx
+
+HTTP_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(
+    max_connections=200,
+    max_keepalive_connections=50,
+    keepalive_expiry=60,
+)
+
+# Keyed by loop: an AsyncClient cannot be shared across event loops, and the
+# test client / async_to_sync spin up a fresh loop per call.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the pooled AsyncClient bound to the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+        _clients[loop] = client
+    return client
@@ -0,0 +1,388 @@
+"""
+Import of chat history backups (the NDJSON export from export.py,
+optionally gzipped).
+
+An upload only stores the file and queues an ImportJob. The job is run by
+the Celery task ``pimxchat.tasks.run_import_jobs`` when
+``CHAT_IMPORT['USE_CELERY']`` is set, or by
+``python manage.py process_imports``. The file is read line by line;
+every BATCH_SIZE records the new sessions and messages are inserted with
+``bulk_create`` in one transaction and the job's progress is saved, so
+the status endpoint can report it while the import runs.
+
+Messages are deduplicated by a hash of (session, role, timestamp,
+content), against the file itself and against the messages already in
+the target sessions, so importing the same backup twice, or re-running
+a job that crashed half way, adds nothing twice. Session ids are kept
+when they are free or already belong to the importing user; a session id
+owned by someone else gets a new one derived from it and the user, so
+restoring another account's backup twice is deduplicated too.
+"""
+import gzip
+import hashlib
+import io
+import json
+import logging
+import time
+import uuid
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from accounts import stats
+
+from . import search
+from .export import VERSION
+from .models import ChatMessage, ChatSession, ImportJob, refresh_session_stats
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'BATCH_SIZE': 1000,
+    'MAX_UPLOAD_SIZE': 100 * 1024 * 1024,
+    'MAX_LINE_LENGTH': 1024 * 1024,
+    # Errors kept on the job for the status endpoint
+    'MAX_ERRORS': 20,
+    # A 'running' job older than this belongs to a crashed worker and is claimed again
+    'LOCK_TIMEOUT': 10 * 60,
+    'USE_CELERY': False,
+}
+
+ROLES = {choice for choice, _ in ChatMessage.MESSAGE_TYPES}
+TITLE_LENGTH = ChatSession._meta.get_field('title').max_length
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+class InvalidBackup(ValueError):
+    pass
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'CHAT_IMPORT', {}))
+
+
+def create_job(user, upload):
+    """Store an uploaded backup and queue it"""
+    job = ImportJob.objects.create(user=user, file=upload, bytes_total=upload.size)
+    if get_config()['USE_CELERY']:
+        transaction.on_commit(trigger_celery)
+    return job
+
+
+def trigger_celery():
+    from .tasks import run_import_jobs
+    try:
+        run_import_jobs.delay()
+    except Exception:
+        # Broker down: the job stays pending for the next run or the DB worker
+        logger.exception("Could not queue import task")
+
+
+def message_hash(session_id, role, timestamp, content):
+    raw = '\x1f'.join([str(session_id), role, timestamp.astimezone(dt_timezone.utc).isoformat(), content])
+    return hashlib.sha256(raw.encode('utf-8')).digest()[:16]
+
+
+def copy_id(session_id, user_id):
+    """The id for a copy of someone else's session, the same on every import of it"""
+    return uuid.uuid5(session_id, str(user_id))
+
+
+def parse_time(value, field):
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise InvalidRecord(f'{field} is not a datetime')
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def require(record, field, kind):
+    value = record.get(field)
+    if not isinstance(value, kind):
+        raise InvalidRecord(f'{field} is missing or has the wrong type')
+    return value
+
+
+def parse_session(record):
+    try:
+        original_id = uuid.UUID(require(record, 'id', str))
+    except ValueError:
+        raise InvalidRecord('id is not a UUID')
+    return {
+        'id': original_id,
+        'title': record.get('title') if isinstance(record.get('title'), str) else '',
+        'created_at': parse_time(record.get('created_at'), 'created_at'),
+        'updated_at': parse_time(record.get('updated_at') or record.get('created_at'), 'updated_at'),
+        'summary': record.get('summary') if isinstance(record.get('summary'), str) else '',
+    }
+
+
+def parse_message(record):
+    role = require(record, 'role', str)
+    if role not in ROLES:
+        raise InvalidRecord(f'unknown role {role!r}')
+    try:
+        session_id = uuid.UUID(require(record, 'session_id', str))
+    except ValueError:
+        raise InvalidRecord('session_id is not a UUID')
+    return {
+        'session_id': session_id,
+        'role': role,
+        'content': require(record, 'content', str),
+        'timestamp': parse_time(record.get('timestamp'), 'timestamp'),
+        'is_welcome_message': record.get('is_welcome_message') is True,
+    }
+
+
+def open_backup(file):
+    """Text stream over a backup, gunzipping it if needed"""
+    raw = file.open('rb')
+    if raw.read(2) == b'\x1f\x8b':
+        raw.seek(0)
+        return raw, io.TextIOWrapper(gzip.GzipFile(fileobj=raw), encoding='utf-8')
+    raw.seek(0)
+    return raw, io.TextIOWrapper(raw, encoding='utf-8')
+
+
+def read_lines(text, max_length):
+    """Yield (line number, line or None if it is too long)"""
+    number = 0
+    while True:
+        line = text.readline(max_length + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > max_length and not line.endswith('\n'):
+            # Skip the rest of an overlong line
+            while line and not line.endswith('\n'):
+                line = text.readline(max_length)
+            yield number, None
+            continue
+        yield number, line
+
+
+class Importer:
+    def __init__(self, job, config=None):
+        self.job = job
+        self.user_id = job.user_id
+        self.config = config or get_config()
+        # Original session id -> id in this database, and which of those the import created
+        self.session_ids = {}
+        self.created_sessions = {}
+        self.pending_sessions = []
+        self.pending_messages = []
+        self.file_sessions = set()
+        self.seen = set()
+
+    def reject(self, number, error):
+        self.job.lines_rejected += 1
+        if len(self.job.errors) < self.config['MAX_ERRORS']:
+            self.job.errors.append(f'line {number}: {error}')
+
+    def run(self):
+        raw, text = open_backup(self.job.file)
+        try:
+            lines = read_lines(text, self.config['MAX_LINE_LENGTH'])
+            self.read_header(lines)
+            for number, line in lines:
+                self.handle_line(number, line)
+                if len(self.pending_messages) + len(self.pending_sessions) >= self.config['BATCH_SIZE']:
+                    self.flush(raw.tell())
+            self.flush(self.job.bytes_total)
+        finally:
+            text.close()
+
+    def read_header(self, lines):
+        for number, line in lines:
+            if line is None or not line.strip():
+                continue
+            try:
+                header = json.loads(line)
+            except ValueError:
+                header = None
+            if not isinstance(header, dict) or header.get('type') != 'export':
+                raise InvalidBackup('This is not a PIMXCHAT history export (NDJSON)')
+            if not isinstance(header.get('version'), int) or header['version'] > VERSION:
+                raise InvalidBackup(f"Unsupported export version {header.get('version')!r}")
+            return
+        raise InvalidBackup('The file is empty')
+
+    def handle_line(self, number, line):
+        if line is None:
+            self.reject(number, 'line is too long')
+            return
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise InvalidRecord('not a JSON object')
+            kind = record.get('type')
+            if kind == 'session':
+                session = parse_session(record)
+                if session['id'] in self.file_sessions:
+                    raise InvalidRecord('duplicate session')
+                self.file_sessions.add(session['id'])
+                self.pending_sessions.append(session)
+            elif kind == 'message':
+                message = parse_message(record)
+                if message['session_id'] not in self.file_sessions:
+                    raise InvalidRecord('message before its session')
+                self.pending_messages.append(message)
+            else:
+                raise InvalidRecord(f'unknown record type {kind!r}')
+        except (ValueError, TypeError) as e:
+            self.reject(number, e)
+
+    def resolve_sessions(self):
+        """Map pending sessions to ids here and create the new ones"""
+        sessions = self.pending_sessions
+        self.pending_sessions = []
+        candidates = {session['id']: [session['id'], copy_id(session['id'], self.user_id)] for session in sessions}
+        owners = dict(
+            ChatSession.objects.filter(id__in=[pk for ids in candidates.values() for pk in ids]).values_list('id', 'user_id')
+        )
+        new_sessions = []
+        for session in sessions:
+            target = next((pk for pk in candidates[session['id']] if owners.get(pk) in (None, self.user_id)), None)
+            target = target or uuid.uuid4()
+            self.session_ids[session['id']] = target
+            if owners.get(target) == self.user_id:
+                continue
+            new_sessions.append(ChatSession(
+                id=target,
+                user_id=self.user_id,
+                title=session['title'][:TITLE_LENGTH],
+                summary=session['summary'],
+                is_active=False,
+                created_at=session['created_at'],
+                updated_at=session['updated_at'],
+            ))
+        if new_sessions:
+            ChatSession.objects.bulk_create(new_sessions)
+            # created_at/updated_at are auto fields, which bulk_create overwrites with now()
+            ChatSession.objects.bulk_update(new_sessions, ['created_at', 'updated_at'])
+            for session in new_sessions:
+                self.created_sessions[session.pk] = session
+            self.job.sessions_created += len(new_sessions)
+
+    def existing_hashes(self, messages):
+        """Hashes of messages already stored in the target sessions at the same times"""
+        reused = {message['target'] for message in messages if message['target'] not in self.created_sessions}
+        if not reused:
+            return set()
+        rows = ChatMessage.objects.filter(
+            session_id__in=reused, timestamp__in={message['timestamp'] for message in messages}
+        ).values_list('session_id', 'message_type', 'timestamp', 'content')
+        return {message_hash(*row) for row in rows}
+
+    def flush(self, position):
+        with transaction.atomic(), stats.batched():
+            self.resolve_sessions()
+
+            messages = self.pending_messages
+            self.pending_messages = []
+            for message in messages:
+                message['target'] = self.session_ids[message['session_id']]
+            existing = self.existing_hashes(messages)
+
+            new_messages = []
+            for message in messages:
+                digest = message_hash(message['target'], message['role'], message['timestamp'], message['content'])
+                if digest in self.seen or digest in existing:
+                    self.job.duplicates_skipped += 1
+                    continue
+                self.seen.add(digest)
+                new_messages.append(ChatMessage(
+                    # Only the pk and owner are needed to index the message
+                    session=self.created_sessions.get(message['target']) or ChatSession(pk=message['target'], user_id=self.user_id),
+                    content=message['content'],
+                    message_type=message['role'],
+                    timestamp=message['timestamp'],
+                    is_welcome_message=message['is_welcome_message'],
+                ))
+
+            if new_messages:
+                timestamps = [message.timestamp for message in new_messages]
+                ChatMessage.objects.bulk_create(new_messages, batch_size=self.config['BATCH_SIZE'])
+                # timestamp is auto_now_add, which bulk_create overwrites with now()
+                for message, timestamp in zip(new_messages, timestamps):
+                    message.timestamp = timestamp
+                ChatMessage.objects.bulk_update(new_messages, ['timestamp'], batch_size=self.config['BATCH_SIZE'])
+                # bulk_create skips the receivers in signals.py
+                refresh_session_stats({message.session_id for message in new_messages})
+                stats.bump(**{stats.CHAT_MESSAGES: len(new_messages)})
+                search.index_on_commit(new_messages, created=True)
+                self.job.messages_created += len(new_messages)
+
+            self.job.bytes_read = position
+            self.job.locked_at = timezone.now()
+            self.job.save(update_fields=[
+                'bytes_read', 'locked_at', 'sessions_created', 'messages_created',
+                'duplicates_skipped', 'lines_rejected', 'errors',
+            ])
+
+
+def claim_job(config):
+    """Mark the oldest pending (or abandoned) job as running and return it"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=config['LOCK_TIMEOUT'])
+    with transaction.atomic():
+        job = (
+            ImportJob.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[ImportJob.PENDING, ImportJob.RUNNING])
+            .exclude(status=ImportJob.RUNNING, locked_at__gte=stale)
+            .order_by('created_at')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = ImportJob.RUNNING
+        job.locked_at = now
+        job.started_at = job.started_at or now
+        job.save(update_fields=['status', 'locked_at', 'started_at'])
+    return job
+
+
+def run_job(job, config=None):
+    try:
+        Importer(job, config).run()
+    except (InvalidBackup, UnicodeDecodeError, OSError, EOFError) as e:
+        job.status = ImportJob.FAILED
+        job.errors = (job.errors + [str(e)])[-get_config()['MAX_ERRORS']:]
+    except Exception:
+        logger.exception("Import job %s failed", job.pk)
+        job.status = ImportJob.FAILED
+        job.errors = (job.errors + ['Internal error'])[-get_config()['MAX_ERRORS']:]
+    else:
+        job.status = ImportJob.DONE
+    job.locked_at = None
+    job.finished_at = timezone.now()
+    # The counts stay on the job; the upload itself is no longer needed
+    job.file.delete(save=False)
+    job.save(update_fields=['status', 'errors', 'locked_at', 'finished_at', 'file'])
+    return job
+
+
+def drain():
+    """Run queued jobs until none is left; returns how many ran"""
+    config = get_config()
+    count = 0
+    while True:
+        job = claim_job(config)
+        if job is None:
+            return count
+        run_job(job, config)
+        count += 1
+
+
+def run_worker(poll_interval=2.0):
+    """Poll for import jobs forever (the DB-backed alternative to Celery)"""
+    while True:
+        if not drain():
+            time.sleep(poll_interval)
@@ -0,0 +1,122 @@
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+REPLY_WORDS = (
+    "سلام 👋 این یک پاسخ شبیه‌سازی شده از سرور محلی است که برای تست بار "
+    "مسیر ارسال پیام بدون تماس با Gemini استفاده می‌شود ✨"
+).split()
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    """Mimics Gemini's generateContent / streamGenerateContent endpoints"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def reply_text(self):
+        words = [random.choice(REPLY_WORDS) for _ in range(self.server.reply_words)]
+        return ' '.join(words)
+
+    def upstream_delay(self):
+        """Configured latency plus uniform jitter, in seconds"""
+        delay = self.server.latency + random.uniform(-self.server.jitter, self.server.jitter)
+        return max(0, delay) / 1000
+
+    def send_json(self, status, payload, delay):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        # Lets a load test subtract simulated upstream time from its own measurements
+        self.send_header('X-Fake-Upstream-Ms', f'{delay * 1000:.1f}')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        delay = self.upstream_delay()
+
+        if ':generateContent' not in self.path and ':streamGenerateContent' not in self.path:
+            self.send_json(404, {'error': {'code': 404, 'message': 'Not found', 'status': 'NOT_FOUND'}}, 0)
+            return
+
+        if random.random() < self.server.error_rate:
+            time.sleep(delay)
+            status = self.server.error_status
+            self.send_json(status, {'error': {'code': status, 'message': 'Simulated upstream error', 'status': 'UNAVAILABLE'}}, delay)
+            return
+
+        if ':streamGenerateContent' in self.path:
+            self.stream_reply(delay)
+        else:
+            time.sleep(delay)
+            self.send_json(200, {
+                'candidates': [{
+                    'content': {'parts': [{'text': self.reply_text()}], 'role': 'model'},
+                    'finishReason': 'STOP',
+                    'index': 0,
+                }],
+                'usageMetadata': {'promptTokenCount': 0, 'candidatesTokenCount': self.server.reply_words},
+            }, delay)
+
+    def stream_reply(self, delay):
+        """Send the reply as SSE frames: first token after `delay`, then one chunk per interval"""
+        words = self.reply_text().split(' ')
+        chunk_count = max(1, min(self.server.chunks, len(words)))
+        size = -(-len(words) // chunk_count)
+        chunks = [' '.join(words[i:i + size]) for i in range(0, len(words), size)]
+
+        time.sleep(delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.send_header('X-Fake-Upstream-Ms', f'{delay * 1000:.1f}')
+        self.end_headers()
+        for index, chunk in enumerate(chunks):
+            text = chunk if index == 0 else ' ' + chunk
+            frame = {'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'index': 0}]}
+            self.wfile.write(f"data: {json.dumps(frame, ensure_ascii=False)}\r\n\r\n".encode('utf-8'))
+            self.wfile.flush()
+            if index < len(chunks) - 1:
+                time.sleep(self.server.chunk_delay / 1000)
+        self.close_connection = True
+
+
+class Command(BaseCommand):
+    help = 'Runs a local fake Gemini API server for offline load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=800, help='Mean time to first byte in ms')
+        parser.add_argument('--jitter', type=float, default=200, help='Uniform +/- jitter in ms')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail (0-1)')
+        parser.add_argument('--error-status', type=int, default=503, help='HTTP status used for simulated failures')
+        parser.add_argument('--reply-words', type=int, default=40, help='Words per reply')
+        parser.add_argument('--chunks', type=int, default=8, help='Number of SSE chunks per streamed reply')
+        parser.add_argument('--chunk-delay', type=float, default=50, help='Delay between streamed chunks in ms')
+        parser.add_argument('--verbose', action='store_true', help='Log every request')
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer((options['host'], options['port']), FakeGeminiHandler)
+        server.daemon_threads = True
+        for name in ('latency', 'jitter', 'error_rate', 'error_status', 'reply_words', 'chunks', 'chunk_delay', 'verbose'):
+            setattr(server, name, options[name])
+
+        base_url = f"http://{options['host']}:{options['port']}/v1"
+        self.stdout.write(self.style.SUCCESS(f'Fake Gemini listening on {base_url}'))
+        self.stdout.write(f'Use it with: CHAT_PROVIDER_BASE_URL={base_url}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from pimxchat.importer import drain, run_worker
+
+
+class Command(BaseCommand):
+    help = 'Runs queued chat history imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run every queued import, then exit')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when nothing is queued')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            count = drain()
+            self.stdout.write(self.style.SUCCESS(f'Ran {count} import jobs.'))
+            return
+        self.stdout.write(self.style.SUCCESS('Import worker started'))
+        try:
+            run_worker(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from pimxchat.search import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the chat history full-text index from ChatMessage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        total = rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} messages.'))
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pimxchat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='summarized_through',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='خلاصه تا پیام'),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='summary',
+            field=models.TextField(blank=True, default='', verbose_name='خلاصه گفتگو'),
+        ),
+    ]
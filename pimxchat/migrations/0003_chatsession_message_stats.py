@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:54
+
+from django.db import migrations, models
+
+
+def backfill_message_stats(apps, schema_editor):
+    ChatSession = apps.get_model('pimxchat', 'ChatSession')
+    ChatMessage = apps.get_model('pimxchat', 'ChatMessage')
+    first_message = ChatMessage.objects.filter(session=models.OuterRef('pk')).order_by('timestamp', 'id').values('content')[:1]
+    sessions = ChatSession.objects.annotate(
+        count=models.Count('messages'),
+        last=models.Max('messages__timestamp'),
+        first_content=models.Subquery(first_message)
+    ).values_list('pk', 'count', 'last', 'first_content')
+    for pk, count, last, first_content in sessions.iterator(chunk_size=1000):
+        content = first_content or ''
+        ChatSession.objects.filter(pk=pk).update(
+            message_count=count,
+            last_message_at=last,
+            preview=content[:50] + "..." if len(content) > 50 else content
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pimxchat', '0002_chatsession_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='زمان آخرین پیام'),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='تعداد پیام\u200cها'),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='preview',
+            field=models.CharField(blank=True, default='', max_length=60, verbose_name='پیش\u200cنمایش'),
+        ),
+        migrations.RunPython(backfill_message_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pimxchat', '0003_chatsession_message_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', 'timestamp', 'id'], name='chatmessage_session_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['user', '-updated_at', '-id'], name='chatsession_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['user', 'is_active', '-updated_at'], name='chatsession_user_active_idx'),
+        ),
+    ]
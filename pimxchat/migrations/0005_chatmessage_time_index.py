@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pimxchat', '0004_chat_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['timestamp', 'id'], name='chatmessage_time_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from pimxchat.search import get_backend
+
+    backend = get_backend(schema_editor.connection)
+    if backend is None:
+        return
+    ChatMessage = apps.get_model('pimxchat', 'ChatMessage')
+    rows = ChatMessage.objects.filter(session__isnull=False).values_list('pk', 'session__user_id', 'content').order_by('pk')
+    with schema_editor.connection.cursor() as cursor:
+        backend.create(cursor)
+        batch = []
+        for row in rows.iterator(chunk_size=1000):
+            batch.append(row)
+            if len(batch) >= 1000:
+                backend.write(cursor, batch)
+                batch = []
+        if batch:
+            backend.write(cursor, batch)
+
+
+def drop_search_index(apps, schema_editor):
+    from pimxchat.search import get_backend
+
+    backend = get_backend(schema_editor.connection)
+    if backend is not None:
+        with schema_editor.connection.cursor() as cursor:
+            backend.drop(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pimxchat', '0005_chatmessage_time_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('pimxchat', '0006_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file', models.FileField(upload_to='chat_imports/', verbose_name='فایل')),
+                ('status', models.CharField(choices=[('pending', 'در صف'), ('running', 'در حال انجام'), ('done', 'انجام شده'), ('failed', 'ناموفق')], default='pending', max_length=10, verbose_name='وضعیت')),
+                ('bytes_total', models.BigIntegerField(default=0, verbose_name='حجم فایل')),
+                ('bytes_read', models.BigIntegerField(default=0, verbose_name='حجم خوانده شده')),
+                ('sessions_created', models.PositiveIntegerField(default=0, verbose_name='جلسات ایجاد شده')),
+                ('messages_created', models.PositiveIntegerField(default=0, verbose_name='پیام\u200cهای ایجاد شده')),
+                ('duplicates_skipped', models.PositiveIntegerField(default=0, verbose_name='پیام\u200cهای تکراری')),
+                ('lines_rejected', models.PositiveIntegerField(default=0, verbose_name='خطوط نامعتبر')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='خطاها')),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان شروع')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان پایان')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_imports', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'ورود تاریخچه',
+                'verbose_name_plural': 'ورودهای تاریخچه',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='importjob_status_idx')],
+            },
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import RowNumber
 from accounts.models import User
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -11,20 +12,48 @@ class ChatSession(models.Model):
     created_at = models.DateTimeField(_('تاریخ ایجاد'), auto_now_add=True)
     updated_at = models.DateTimeField(_('تاریخ بروزرسانی'), auto_now=True)
     is_active = models.BooleanField(_('فعال'), default=True)
+    # Rolling summary of turns that no longer fit the context window (see pimxchat/context.py)
+    summary = models.TextField(_('خلاصه گفتگو'), blank=True, default='')
+    summarized_through = models.BigIntegerField(_('خلاصه تا پیام'), null=True, blank=True)
+    # Denormalized from messages by pimxchat/signals.py so the sidebar needs no per-session queries
+    preview = models.CharField(_('پیش‌نمایش'), max_length=60, blank=True, default='')
+    message_count = models.PositiveIntegerField(_('تعداد پیام‌ها'), default=0)
+    last_message_at = models.DateTimeField(_('زمان آخرین پیام'), null=True, blank=True)
     
     class Meta:
         ordering = ['-updated_at']
         verbose_name = _('جلسه چت')
         verbose_name_plural = _('جلسات چت')
+        indexes = [
+            # Sidebar and cursor pages: a user's sessions by (updated_at, id)
+            models.Index(fields=['user', '-updated_at', '-id'], name='chatsession_user_updated_idx'),
+            # Active-session lookup in chat_view and the send path
+            models.Index(fields=['user', 'is_active', '-updated_at'], name='chatsession_user_active_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.title or 'چت جدید'} ({self.created_at.strftime('%Y-%m-%d %H:%M')})"
     
+    @staticmethod
+    def make_preview(content):
+        return content[:50] + "..." if len(content) > 50 else content
+    
     def get_preview_message(self):
-        first_message = self.messages.first()
-        if first_message:
-            return first_message.content[:50] + "..." if len(first_message.content) > 50 else first_message.content
-        return ""
+        return self.preview
+    
+    def refresh_message_stats(self):
+        """Recompute preview, message_count and last_message_at from the messages table"""
+        messages = ChatMessage.objects.filter(session=self)
+        first_message = messages.order_by('timestamp', 'id').values_list('content', flat=True).first()
+        stats = messages.aggregate(count=models.Count('id'), last=models.Max('timestamp'))
+        self.preview = self.make_preview(first_message) if first_message else ''
+        self.message_count = stats['count']
+        self.last_message_at = stats['last']
+        ChatSession.objects.filter(pk=self.pk).update(
+            preview=self.preview,
+            message_count=self.message_count,
+            last_message_at=self.last_message_at
+        )
 
 class ChatMessage(models.Model):
     MESSAGE_TYPES = [
@@ -43,6 +72,79 @@ class ChatMessage(models.Model):
         ordering = ['timestamp']
         verbose_name = _('پیام چت')
         verbose_name_plural = _('پیام‌های چت')
+        indexes = [
+            # A session's messages in display order, also used for cursor pages
+            models.Index(fields=['session', 'timestamp', 'id'], name='chatmessage_session_time_idx'),
+            # The admin changelist, newest first across all sessions
+            models.Index(fields=['timestamp', 'id'], name='chatmessage_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.session.user.username} - {self.content[:30]}..."
+
+def refresh_session_stats(session_ids):
+    """ChatSession.refresh_message_stats() for many sessions in three queries"""
+    messages = ChatMessage.objects.filter(session_id__in=session_ids)
+    # Sessions left without messages are reset too
+    sessions = {
+        session_id: ChatSession(pk=session_id, message_count=0, last_message_at=None, preview='')
+        for session_id in session_ids
+    }
+    for row in messages.values('session_id').annotate(count=models.Count('id'), last=models.Max('timestamp')):
+        sessions[row['session_id']].message_count = row['count']
+        sessions[row['session_id']].last_message_at = row['last']
+    first_messages = messages.annotate(position=models.Window(
+        RowNumber(),
+        partition_by=[models.F('session_id')],
+        order_by=[models.F('timestamp').asc(), models.F('id').asc()],
+    )).filter(position=1).values_list('session_id', 'content')
+    for session_id, content in first_messages:
+        sessions[session_id].preview = ChatSession.make_preview(content)
+    ChatSession.objects.bulk_update(sessions.values(), ['message_count', 'last_message_at', 'preview'])
+
+class ImportJob(models.Model):
+    """An uploaded history backup, imported in the background (see pimxchat/importer.py)"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, _('در صف')),
+        (RUNNING, _('در حال انجام')),
+        (DONE, _('انجام شده')),
+        (FAILED, _('ناموفق')),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_imports', verbose_name=_('کاربر'))
+    file = models.FileField(_('فایل'), upload_to='chat_imports/')
+    status = models.CharField(_('وضعیت'), max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    bytes_total = models.BigIntegerField(_('حجم فایل'), default=0)
+    bytes_read = models.BigIntegerField(_('حجم خوانده شده'), default=0)
+    sessions_created = models.PositiveIntegerField(_('جلسات ایجاد شده'), default=0)
+    messages_created = models.PositiveIntegerField(_('پیام‌های ایجاد شده'), default=0)
+    duplicates_skipped = models.PositiveIntegerField(_('پیام‌های تکراری'), default=0)
+    lines_rejected = models.PositiveIntegerField(_('خطوط نامعتبر'), default=0)
+    errors = models.JSONField(_('خطاها'), default=list, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(_('تاریخ ایجاد'), auto_now_add=True)
+    started_at = models.DateTimeField(_('زمان شروع'), null=True, blank=True)
+    finished_at = models.DateTimeField(_('زمان پایان'), null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = _('ورود تاریخچه')
+        verbose_name_plural = _('ورودهای تاریخچه')
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='importjob_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.get_status_display()} ({self.created_at.strftime('%Y-%m-%d %H:%M')})"
+
+    @property
+    def progress(self):
+        """Share of the file read so far, 0-100"""
+        if self.status == self.DONE:
+            return 100
+        return int(self.bytes_read * 100 / self.bytes_total) if self.bytes_total else 0
@@ -0,0 +1,130 @@
+"""
+Keyset (cursor) pagination for the chat APIs.
+
+A cursor encodes the (timestamp, id) of a boundary row, so fetching the
+next page is an indexed range scan instead of an OFFSET that re-reads
+every earlier row. ``?before=`` walks towards older rows, ``?after=``
+towards newer ones; ``?limit=`` is capped at MAX_PAGE_SIZE.
+
+The admin changelists use BoundedCountPaginator instead, which stops
+counting after ADMIN_COUNT_LIMIT rows.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_CONFIG = {
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 200,
+    'ADMIN_COUNT_LIMIT': 10000,
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value, pk):
+    raw = json.dumps([value.isoformat(), str(pk)]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, pk_field):
+    """(datetime, pk) from a cursor; the pk is converted with the model's pk field"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk = json.loads(raw)
+        parsed = parse_datetime(value)
+        pk = pk_field.to_python(pk)
+    except (ValueError, TypeError, ValidationError):
+        raise InvalidCursor(cursor)
+    if parsed is None or pk is None:
+        raise InvalidCursor(cursor)
+    return parsed, pk
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'CHAT_PAGINATION', {}))
+
+
+def get_page_size(request):
+    options = get_config()
+    try:
+        limit = int(request.GET.get('limit', options['PAGE_SIZE']))
+    except ValueError:
+        limit = options['PAGE_SIZE']
+    return max(1, min(limit, options['MAX_PAGE_SIZE']))
+
+
+class KeysetPage:
+    """One page of rows, always ordered oldest first, with cursors to both neighbours"""
+
+    def __init__(self, rows, field, has_older, has_newer):
+        self.rows = rows
+        self.field = field
+        self.has_older = has_older
+        self.has_newer = has_newer
+
+    def cursor(self, row):
+        return encode_cursor(getattr(row, self.field), row.pk)
+
+    @property
+    def before_cursor(self):
+        return self.cursor(self.rows[0]) if self.rows and self.has_older else None
+
+    @property
+    def after_cursor(self):
+        return self.cursor(self.rows[-1]) if self.rows else None
+
+
+def paginate(queryset, field, request):
+    """
+    Return a KeysetPage of queryset ordered by (field, pk).
+
+    Without a cursor the newest page is returned. Raises InvalidCursor for
+    a malformed ``before``/``after`` parameter.
+    """
+    limit = get_page_size(request)
+    pk_field = queryset.model._meta.pk
+    before = request.GET.get('before')
+    after = request.GET.get('after')
+
+    if after:
+        value, pk = decode_cursor(after, pk_field)
+        rows = list(
+            queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk}))
+            .order_by(field, 'pk')[:limit + 1]
+        )
+        has_more = len(rows) > limit
+        return KeysetPage(rows[:limit], field, has_older=True, has_newer=has_more)
+
+    if before:
+        value, pk = decode_cursor(before, pk_field)
+        queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}))
+    rows = list(queryset.order_by(f'-{field}', '-pk')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return KeysetPage(rows, field, has_older=has_more, has_newer=bool(before))
+
+
+class BoundedCountPaginator(Paginator):
+    """
+    Paginator whose count is capped at ADMIN_COUNT_LIMIT.
+
+    COUNT(*) over a whole large table is a full scan; counting
+    ``LIMIT n + 1`` rows stops early. Past the limit the changelist reports
+    the limit and offers pages up to it; sorting the other way reaches the
+    remaining rows.
+    """
+
+    @cached_property
+    def count(self):
+        limit = get_config()['ADMIN_COUNT_LIMIT']
+        return min(self.object_list[:limit + 1].count(), limit)
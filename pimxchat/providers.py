@@ -0,0 +1,306 @@
+"""
+Pluggable AI providers for the chat endpoints.
+
+The active provider is chosen with ``settings.CHAT_PROVIDER``::
+
+    CHAT_PROVIDER = {
+        'BACKEND': 'pimxchat.providers.GeminiProvider',
+        'OPTIONS': {'API_KEY': '...', 'BASE_URL': '...', 'MODEL': 'gemini-1.5-flash'},
+    }
+
+Every provider exposes the same three calls: ``generate`` (sync),
+``agenerate`` (async) and ``astream`` (async generator of text chunks),
+each taking an optional ``context`` (pimxchat.context.ConversationContext)
+and a per-call ``timeout`` in seconds. They raise on
+failure; falling back to a canned reply is the caller's job.
+"""
+import json
+import time
+import random
+import asyncio
+
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .http_client import get_async_client
+
+DEFAULT_PROVIDER = {
+    'BACKEND': 'pimxchat.providers.GeminiProvider',
+    'OPTIONS': {},
+}
+
+
+def get_system_prompt(language='fa'):
+    """System prompt based on language"""
+    if language == 'fa':
+        return """تو PIMXCHAT هستی، یک دستیار هوشمند که توسط محمدرضا عابدین‌پور ساخته شده است.
+        قوانین مهم:
+        - همیشه به فارسی پاسخ بده
+        - اگر کاربر بپرسد "تو کی هستی؟" یا "What are you?" بگو: "من PIMXCHAT هستم، ساخته شده توسط محمدرضا عابدین‌پور"
+        - محتوای غیرقانونی، مضر یا نامناسب تولید نکن
+        - اطلاعات شخصی کاربران را فاش نکن
+        - پاسخ‌های مفید و دقیق ارائه کن
+        - در پاسخ‌هایت از ایموجی‌های مربوط به موضوع استفاده کن تا پاسخ جذاب‌تر شود
+        - ایموجی‌ها را به صورت طبیعی و مناسب در متن قرار بده"""
+    return """You are PIMXCHAT, an intelligent assistant created by Mohammadreza Abedinpour.
+        Important rules:
+        - Always respond in English
+        - If user asks "Who are you?" or "What are you?" say: "I'm PIMXCHAT, created by Mohammadreza Abedinpour"
+        - Do not generate illegal, harmful, or inappropriate content
+        - Do not share users' personal information
+        - Provide helpful and accurate responses
+        - Use relevant emojis in your responses to make them more engaging and expressive
+        - Place emojis naturally throughout your text where appropriate"""
+
+
+def get_summary_prompt(summary, language='fa'):
+    """Introduce the rolling summary of earlier turns to the model"""
+    if language == 'fa':
+        return "خلاصه بخش‌های قبلی این گفتگو:\n" + summary
+    return "Summary of the earlier part of this conversation:\n" + summary
+
+
+def get_test_response(message, language='fa'):
+    """Simple test response when API is not working"""
+    if language == 'fa':
+        responses = [
+            "سلام! 👋 چطور می‌تونم کمکتون کنم؟ 😊",
+            "بله، در خدمت شما هستم! 🎯 سوال دیگری دارید؟ 🤔",
+            "این یک پاسخ تست است. 🔧 API در حال تعمیر است.",
+            "من PIMXCHAT هستم 🤖 و آماده کمک به شما هستم! ✨",
+            "سوال جالبی پرسیدید! 🎉 می‌تونم کمکتون کنم. 💡"
+        ]
+    else:
+        responses = [
+            "Hello! 👋 How can I help you? 😊",
+            "Yes, I'm here to help! 🎯 Do you have another question? 🤔",
+            "This is a test response. 🔧 API is under maintenance.",
+            "I'm PIMXCHAT 🤖 and ready to help you! ✨",
+            "That's an interesting question! 🎉 I can help you. 💡"
+        ]
+    return random.choice(responses)
+
+
+class ProviderError(Exception):
+    """Raised when the upstream AI service fails or returns an unusable reply"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class BaseProvider:
+    name = 'base'
+
+    def __init__(self, API_KEY='', BASE_URL='', MODEL='', TIMEOUT=15, **options):
+        self.api_key = API_KEY
+        self.base_url = BASE_URL.rstrip('/')
+        self.model = MODEL
+        self.timeout = TIMEOUT
+        self.options = options
+
+    def generate(self, message, language='fa', context=None, timeout=None):
+        raise NotImplementedError
+
+    async def agenerate(self, message, language='fa', context=None, timeout=None):
+        raise NotImplementedError
+
+    async def astream(self, message, language='fa', context=None, timeout=None):
+        raise NotImplementedError
+        yield  # pragma: no cover - marks this as an async generator
+
+
+class GeminiProvider(BaseProvider):
+    """Google Gemini generateContent / streamGenerateContent"""
+    name = 'gemini'
+
+    def __init__(self, API_KEY='', BASE_URL='https://generativelanguage.googleapis.com/v1', MODEL='gemini-1.5-flash', **options):
+        super().__init__(API_KEY=API_KEY, BASE_URL=BASE_URL, MODEL=MODEL, **options)
+
+    def check_api_key(self):
+        if not self.api_key:
+            raise ProviderError("Gemini API key is not set (CHAT_PROVIDER_API_KEY)")
+
+    @property
+    def generate_url(self):
+        return f"{self.base_url}/models/{self.model}:generateContent?key={self.api_key}"
+
+    @property
+    def stream_url(self):
+        return f"{self.base_url}/models/{self.model}:streamGenerateContent?alt=sse&key={self.api_key}"
+
+    def build_payload(self, message, language='fa', context=None):
+        """Build the Gemini request body (system prompt, summary, prior turns, user message)"""
+        preamble = [{"text": get_system_prompt(language)}]
+        if context and context.summary:
+            preamble.append({"text": get_summary_prompt(context.summary, language)})
+        contents = [{"role": "user", "parts": preamble}]
+        turns = list(context.turns) if context else []
+        for message_type, text in turns + [('user', message)]:
+            role = 'model' if message_type == 'ai' else 'user'
+            # Gemini expects alternating roles, so merge consecutive turns from one side
+            if contents[-1]['role'] == role:
+                contents[-1]['parts'].append({"text": text})
+            else:
+                contents.append({"role": role, "parts": [{"text": text}]})
+        return {"contents": contents}
+
+    def parse_response(self, result):
+        """Extract the reply text from a generateContent response"""
+        candidates = result.get('candidates') or []
+        if not candidates:
+            raise ProviderError("No candidates in response")
+        content = candidates[0].get('content', {})
+        if 'parts' not in content:
+            raise ProviderError("Invalid response structure")
+        return content['parts'][0]['text']
+
+    def parse_stream_line(self, line):
+        """Return the text pieces carried by one streamGenerateContent SSE line"""
+        # Gemini sends one JSON object per "data:" line when alt=sse is set
+        if not line or not line.startswith('data:'):
+            return []
+        chunk = json.loads(line[len('data:'):].strip())
+        texts = []
+        for candidate in chunk.get('candidates', []):
+            for part in candidate.get('content', {}).get('parts', []):
+                if part.get('text'):
+                    texts.append(part['text'])
+        return texts
+
+    def generate(self, message, language='fa', context=None, timeout=None):
+        self.check_api_key()
+        response = requests.post(self.generate_url, json=self.build_payload(message, language, context), timeout=timeout or self.timeout)
+        if response.status_code != 200:
+            raise ProviderError(f"API returned status {response.status_code}", response.status_code)
+        return self.parse_response(response.json())
+
+    async def agenerate(self, message, language='fa', context=None, timeout=None):
+        self.check_api_key()
+        response = await get_async_client().post(self.generate_url, json=self.build_payload(message, language, context), timeout=timeout or self.timeout)
+        if response.status_code != 200:
+            raise ProviderError(f"API returned status {response.status_code}", response.status_code)
+        return self.parse_response(response.json())
+
+    async def astream(self, message, language='fa', context=None, timeout=None):
+        self.check_api_key()
+        payload = self.build_payload(message, language, context)
+        async with get_async_client().stream('POST', self.stream_url, json=payload, timeout=timeout or self.timeout) as response:
+            if response.status_code != 200:
+                raise ProviderError(f"API returned status {response.status_code}", response.status_code)
+            async for line in response.aiter_lines():
+                for text in self.parse_stream_line(line):
+                    yield text
+
+
+class OpenAICompatibleProvider(BaseProvider):
+    """Any server speaking the OpenAI /chat/completions API (OpenAI, vLLM, Ollama, ...)"""
+    name = 'openai'
+
+    def __init__(self, API_KEY='', BASE_URL='https://api.openai.com/v1', MODEL='gpt-4o-mini', **options):
+        super().__init__(API_KEY=API_KEY, BASE_URL=BASE_URL, MODEL=MODEL, **options)
+
+    @property
+    def url(self):
+        return f"{self.base_url}/chat/completions"
+
+    @property
+    def headers(self):
+        return {'Authorization': f'Bearer {self.api_key}'} if self.api_key else {}
+
+    def build_payload(self, message, language='fa', context=None, stream=False):
+        system_prompt = get_system_prompt(language)
+        if context and context.summary:
+            system_prompt += '\n\n' + get_summary_prompt(context.summary, language)
+        messages = [{'role': 'system', 'content': system_prompt}]
+        for message_type, text in (context.turns if context else []):
+            messages.append({'role': 'assistant' if message_type == 'ai' else 'user', 'content': text})
+        messages.append({'role': 'user', 'content': message})
+        return {
+            'model': self.model,
+            'stream': stream,
+            'messages': messages,
+        }
+
+    def parse_response(self, result):
+        choices = result.get('choices') or []
+        if not choices:
+            raise ProviderError("No choices in response")
+        return choices[0]['message']['content']
+
+    def parse_stream_line(self, line):
+        if not line or not line.startswith('data:'):
+            return []
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return []
+        texts = []
+        for choice in json.loads(data).get('choices', []):
+            text = choice.get('delta', {}).get('content')
+            if text:
+                texts.append(text)
+        return texts
+
+    def generate(self, message, language='fa', context=None, timeout=None):
+        response = requests.post(self.url, json=self.build_payload(message, language, context), headers=self.headers, timeout=timeout or self.timeout)
+        if response.status_code != 200:
+            raise ProviderError(f"API returned status {response.status_code}", response.status_code)
+        return self.parse_response(response.json())
+
+    async def agenerate(self, message, language='fa', context=None, timeout=None):
+        response = await get_async_client().post(self.url, json=self.build_payload(message, language, context), headers=self.headers, timeout=timeout or self.timeout)
+        if response.status_code != 200:
+            raise ProviderError(f"API returned status {response.status_code}", response.status_code)
+        return self.parse_response(response.json())
+
+    async def astream(self, message, language='fa', context=None, timeout=None):
+        payload = self.build_payload(message, language, context, stream=True)
+        async with get_async_client().stream('POST', self.url, json=payload, headers=self.headers, timeout=timeout or self.timeout) as response:
+            if response.status_code != 200:
+                raise ProviderError(f"API returned status {response.status_code}", response.status_code)
+            async for line in response.aiter_lines():
+                for text in self.parse_stream_line(line):
+                    yield text
+
+
+class StubProvider(BaseProvider):
+    """Local canned replies, no network. LATENCY (seconds) simulates upstream delay."""
+    name = 'stub'
+
+    def __init__(self, LATENCY=0, **options):
+        super().__init__(**options)
+        self.latency = LATENCY
+
+    def generate(self, message, language='fa', context=None, timeout=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return get_test_response(message, language)
+
+    async def agenerate(self, message, language='fa', context=None, timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return get_test_response(message, language)
+
+    async def astream(self, message, language='fa', context=None, timeout=None):
+        words = get_test_response(message, language).split(' ')
+        for index, word in enumerate(words):
+            if self.latency:
+                await asyncio.sleep(self.latency / len(words))
+            yield word if index == 0 else ' ' + word
+
+
+_provider = None
+_provider_config = None
+
+
+def get_provider():
+    """Return the provider configured in settings.CHAT_PROVIDER (cached per process)"""
+    global _provider, _provider_config
+    config = getattr(settings, 'CHAT_PROVIDER', DEFAULT_PROVIDER)
+    # Rebuild when settings change (override_settings in tests)
+    if _provider is None or config != _provider_config:
+        backend = import_string(config.get('BACKEND', DEFAULT_PROVIDER['BACKEND']))
+        _provider = backend(**config.get('OPTIONS', {}))
+        _provider_config = config
+    return _provider
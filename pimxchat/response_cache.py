@@ -0,0 +1,116 @@
+"""
+Exact-match cache for AI replies to repeated prompts ("سلام", "تو کی هستی؟", ...).
+
+Keys are (language, normalized message, model). Lookups go to a small
+in-process LRU first and then, when ``SHARED_CACHE`` names a Django cache
+alias (the django-redis cache when REDIS_URL is set), to that shared tier.
+Only real provider replies are stored, never the canned fallback.
+"""
+import hashlib
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from config import metrics
+from config.lru import LRUCache
+
+from .text import normalize
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    'TTL': 60 * 60,
+    'MAX_ENTRIES': 1000,
+    'MAX_MESSAGE_LENGTH': 200,
+    'SHARED_CACHE': None,
+}
+
+TRAILING_PUNCTUATION = re.compile(r'[\s.!?؟،,…]+$')
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_message(message):
+    """Fold the variations people type for the same opener onto one key"""
+    text = normalize(message)
+    text = WHITESPACE.sub(' ', text).strip()
+    return TRAILING_PUNCTUATION.sub('', text)
+
+
+class ResponseCache:
+    def __init__(self, **config):
+        options = dict(DEFAULT_CONFIG, **config)
+        self.enabled = options['ENABLED']
+        self.ttl = options['TTL']
+        self.max_message_length = options['MAX_MESSAGE_LENGTH']
+        self.shared_alias = options['SHARED_CACHE']
+        self.local = LRUCache(options['MAX_ENTRIES'], self.ttl)
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def make_key(self, language, message, model):
+        normalized = normalize_message(message)
+        if not self.enabled or not normalized or len(normalized) > self.max_message_length:
+            # Long, unique prompts almost never repeat; skip them to keep the LRU useful
+            return None
+        digest = hashlib.sha256(f'{language}\x00{model}\x00{normalized}'.encode('utf-8')).hexdigest()
+        return f'chat-reply:{digest}'
+
+    def get(self, language, message, model):
+        key = self.make_key(language, message, model)
+        if key is None:
+            return None
+        return self._get(key)
+
+    async def aget(self, language, message, model):
+        """get() for async views: the shared tier and the hit counters are read in a worker thread"""
+        key = self.make_key(language, message, model)
+        if key is None:
+            return None
+        return await sync_to_async(self._get, thread_sensitive=False)(key)
+
+    def _get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            metrics.incr('chat_response_cache_local_hits_total')
+            return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+                metrics.incr('chat_response_cache_shared_hits_total')
+                return value
+        metrics.incr('chat_response_cache_misses_total')
+        return None
+
+    def set(self, language, message, model, reply):
+        key = self.make_key(language, message, model)
+        if key is None or not reply:
+            return
+        self.local.set(key, reply)
+        if self.shared is not None:
+            self.shared.set(key, reply, timeout=self.ttl)
+
+    async def aset(self, language, message, model, reply):
+        key = self.make_key(language, message, model)
+        if key is None or not reply:
+            return
+        self.local.set(key, reply)
+        if self.shared is not None:
+            await self.shared.aset(key, reply, timeout=self.ttl)
+
+    def gauges(self):
+        return {'chat_response_cache_local_entries': len(self.local)}
+
+
+_cache = None
+
+
+def get_response_cache():
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache(**getattr(settings, 'CHAT_RESPONSE_CACHE', {}))
+        metrics.register_gauges(_cache.gauges)
+    return _cache
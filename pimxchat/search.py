@@ -0,0 +1,283 @@
+"""
+Full-text search over chat history.
+
+Messages are indexed in ``pimxchat_message_search``: an FTS5 virtual table
+on SQLite, or a table with a GIN-indexed tsvector on PostgreSQL. Each
+entry carries the owner as a token (``u<user id>``) next to the message
+text, so a query for one user's history intersects two posting lists
+instead of filtering every match across all users. Other databases fall
+back to ``icontains`` scans.
+
+Text is folded with pimxchat/text.py before indexing and querying, so
+«می‌خواهم», «می خواهم» and «مي خواهم» match each other. The last query
+word matches as a prefix. Snippets are cut from the original content
+around the first match, HTML-escaped, with matches wrapped in ``<mark>``.
+
+The index follows ChatMessage through the receivers in signals.py and
+``save_exchange``; ``python manage.py rebuild_search_index`` rebuilds it.
+"""
+import html
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .text import normalize, normalize_with_offsets
+
+DEFAULT_CONFIG = {
+    'SNIPPET_LENGTH': 160,
+    'MAX_TERMS': 8,
+    # Matches the admin search considers
+    'ADMIN_LIMIT': 1000,
+    'BATCH_SIZE': 1000,
+}
+
+TABLE = 'pimxchat_message_search'
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'CHAT_SEARCH', {}))
+
+
+def query_terms(query):
+    return TOKEN_PATTERN.findall(normalize(query))[:get_config()['MAX_TERMS']]
+
+
+def owner_token(user_id):
+    return f'u{user_id}'
+
+
+class SQLiteBackend:
+    def create(self, cursor):
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} '
+            f'USING fts5(owner, body, tokenize="unicode61 remove_diacritics 2")'
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+    def write(self, cursor, rows, replace=True):
+        # FTS5 has no upsert; new messages have nothing to replace
+        if replace:
+            self.remove(cursor, [row[0] for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, owner, body) VALUES (%s, %s, %s)',
+            [(pk, owner_token(user_id), normalize(content)) for pk, user_id, content in rows]
+        )
+
+    def remove(self, cursor, ids):
+        if ids:
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid IN ({', '.join(['%s'] * len(ids))})", list(ids))
+
+    def clear(self, cursor):
+        cursor.execute(f'DELETE FROM {TABLE}')
+
+    def match(self, terms, owner=None):
+        phrases = [f'"{term}"' for term in terms]
+        phrases[-1] += '*'
+        expression = f"body:({' '.join(phrases)})"
+        return f'owner:"{owner}" AND {expression}' if owner else expression
+
+    def search(self, cursor, terms, owner, limit, offset=0):
+        # Weight 0 for the owner column so only the text affects the rank
+        cursor.execute(
+            f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s ORDER BY bm25({TABLE}, 0.0, 1.0) LIMIT %s OFFSET %s',
+            [self.match(terms, owner), limit, offset]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresBackend:
+    def create(self, cursor):
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {TABLE} ('
+            f'message_id bigint PRIMARY KEY, '
+            f'document tsvector NOT NULL)'
+        )
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {TABLE}_document_idx ON {TABLE} USING GIN (document)')
+
+    def drop(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+
+    def write(self, cursor, rows, replace=True):
+        # The owner token gets weight A so it can be matched apart from the text
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (message_id, document) "
+            f"VALUES (%s, setweight(to_tsvector('simple', %s), 'A') || to_tsvector('simple', %s)) "
+            f"ON CONFLICT (message_id) DO UPDATE SET document = EXCLUDED.document",
+            [(pk, owner_token(user_id), normalize(content)) for pk, user_id, content in rows]
+        )
+
+    def remove(self, cursor, ids):
+        if ids:
+            cursor.execute(f'DELETE FROM {TABLE} WHERE message_id = ANY(%s)', [list(ids)])
+
+    def clear(self, cursor):
+        cursor.execute(f'TRUNCATE {TABLE}')
+
+    def match(self, terms, owner=None):
+        # Terms are \w+ runs, so they need no quoting in tsquery syntax
+        expression = ' & '.join(terms) + ':*'
+        return f'{owner}:A & ({expression})' if owner else expression
+
+    def search(self, cursor, terms, owner, limit, offset=0):
+        cursor.execute(
+            f"SELECT message_id FROM {TABLE}, to_tsquery('simple', %s) query "
+            f"WHERE document @@ query ORDER BY ts_rank(document, query) DESC, message_id DESC LIMIT %s OFFSET %s",
+            [self.match(terms, owner), limit, offset]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'postgresql': PostgresBackend,
+}
+
+
+def get_backend(conn=None):
+    """The index backend for a connection's database, or None to fall back to scans"""
+    backend = BACKENDS.get((conn or connection).vendor)
+    return backend() if backend else None
+
+
+def message_rows(messages):
+    return [
+        (message.pk, message.session.user_id, message.content)
+        for message in messages if message.session_id
+    ]
+
+
+def index_on_commit(messages, created=False):
+    """Index messages once the current transaction commits, in one batch"""
+    rows = message_rows(messages)
+    backend = get_backend()
+    if not backend or not rows:
+        return
+
+    def write():
+        with connection.cursor() as cursor:
+            backend.write(cursor, rows, replace=not created)
+    transaction.on_commit(write)
+
+
+def remove_messages(ids):
+    backend = get_backend()
+    if backend and ids:
+        with connection.cursor() as cursor:
+            backend.remove(cursor, ids)
+
+
+def remove_on_commit(ids):
+    """Drop messages from the index once their delete commits, in one batch"""
+    ids = list(ids)
+    if ids and get_backend():
+        transaction.on_commit(lambda: remove_messages(ids))
+
+
+def rebuild(batch_size=None):
+    """Reindex every message; returns the number indexed"""
+    from .models import ChatMessage
+
+    backend = get_backend()
+    if backend is None:
+        return 0
+    batch_size = batch_size or get_config()['BATCH_SIZE']
+    rows = (
+        ChatMessage.objects.filter(session__isnull=False)
+        .values_list('pk', 'session__user_id', 'content')
+        .order_by('pk')
+        .iterator(chunk_size=batch_size)
+    )
+    total = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        backend.clear(cursor)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                backend.write(cursor, batch, replace=False)
+                total += len(batch)
+                batch = []
+        if batch:
+            backend.write(cursor, batch, replace=False)
+            total += len(batch)
+    return total
+
+
+def find_ids(terms, owner=None, limit=50, offset=0):
+    """Ranked ids of messages matching every term (the last as a prefix)"""
+    backend = get_backend()
+    with connection.cursor() as cursor:
+        return backend.search(cursor, terms, owner, limit, offset)
+
+
+def search_messages(user, query, limit=50, offset=0):
+    """
+    A user's messages matching query, best first, as (messages, has_more).
+
+    Each message gets a ``snippet`` attribute with the highlighted match.
+    """
+    from .models import ChatMessage
+
+    terms = query_terms(query)
+    if not terms:
+        return [], False
+
+    messages = ChatMessage.objects.filter(session__user=user).select_related('session')
+    if get_backend() is None:
+        for term in terms:
+            messages = messages.filter(content__icontains=term)
+        found = list(messages.order_by('-timestamp', '-id')[offset:offset + limit + 1])
+    else:
+        ids = find_ids(terms, owner_token(user.pk), limit + 1, offset)
+        by_id = messages.in_bulk(ids)
+        # The index may briefly hold a message deleted in another transaction
+        found = [by_id[pk] for pk in ids if pk in by_id]
+
+    has_more = len(found) > limit
+    found = found[:limit]
+    for message in found:
+        message.snippet = highlight(message.content, terms)
+    return found, has_more
+
+
+def highlight(content, terms, length=None):
+    """An HTML-escaped excerpt of content around the first match, matches in <mark>"""
+    length = length or get_config()['SNIPPET_LENGTH']
+    normalized, offsets = normalize_with_offsets(content)
+    pattern = re.compile(
+        r'(?<!\w)(' + '|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)) + r')\w*'
+    )
+    # Spans in the original text: the whole word that starts with a term
+    spans = [
+        (offsets[match.start()], offsets[match.end() - 1] + 1)
+        for match in pattern.finditer(normalized)
+    ]
+
+    start = 0
+    if spans and spans[0][0] > length // 3:
+        start = spans[0][0] - length // 3
+        # Begin at a word boundary
+        space = content.rfind(' ', 0, start)
+        start = space + 1 if space != -1 and start - space < 20 else start
+    end = min(len(content), start + length)
+
+    parts = ['…' if start > 0 else '']
+    position = start
+    for span_start, span_end in spans:
+        if span_end <= start:
+            continue
+        if span_start >= end:
+            break
+        span_start = max(span_start, start)
+        span_end = min(span_end, end)
+        parts.append(html.escape(content[position:span_start]))
+        parts.append(f'<mark>{html.escape(content[span_start:span_end])}</mark>')
+        position = span_end
+    parts.append(html.escape(content[position:end]))
+    parts.append('…' if end < len(content) else '')
+    return ''.join(parts)
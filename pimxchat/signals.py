@@ -0,0 +1,83 @@
+"""
+Keep the denormalized ChatSession columns (preview, message_count,
+last_message_at) in step with ChatMessage inserts and deletes.
+
+Also keeps the site-wide message counter in accounts/stats.py and the
+search index (search.py) current.
+
+QuerySet.update() and bulk_create() skip these signals; code using them
+must update the session columns, the site counter and the index itself.
+Deletes of many messages should run inside ``collecting_deletes()`` so
+each affected session is recomputed once rather than once per message.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db.models import Case, F, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounts import stats
+
+from . import search
+from .models import ChatMessage, ChatSession, refresh_session_stats
+
+
+@receiver(post_save, sender=ChatMessage)
+def message_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.bump(**{stats.CHAT_MESSAGES: 1})
+    search.index_on_commit([instance], created=created)
+    if not created or not instance.session_id:
+        return
+    ChatSession.objects.filter(pk=instance.session_id).update(
+        message_count=F('message_count') + 1,
+        last_message_at=instance.timestamp,
+        # The preview is the session's first message
+        preview=Case(
+            When(message_count=0, then=Value(ChatSession.make_preview(instance.content))),
+            default=F('preview')
+        )
+    )
+
+
+_local = threading.local()
+
+
+@contextmanager
+def collecting_deletes():
+    """
+    Batch the delete receivers' work for messages deleted inside the block:
+    each affected session is recomputed once at its end, and after the
+    commit the messages leave the search index in one statement and the
+    site counters get one update each.
+    """
+    if getattr(_local, 'deleted', None) is not None:
+        yield
+        return
+    deleted = _local.deleted = {'ids': [], 'sessions': set()}
+    try:
+        with stats.batched():
+            yield
+    finally:
+        _local.deleted = None
+    if deleted['sessions']:
+        refresh_session_stats(deleted['sessions'])
+    search.remove_on_commit(deleted['ids'])
+
+
+@receiver(post_delete, sender=ChatMessage)
+def message_deleted(sender, instance, origin=None, **kwargs):
+    stats.bump(**{stats.CHAT_MESSAGES: -1})
+    deleted = getattr(_local, 'deleted', None)
+    if deleted is not None:
+        deleted['ids'].append(instance.pk)
+    else:
+        search.remove_on_commit([instance.pk])
+    # Cascades from a session or user delete leave nothing to keep in sync
+    if not instance.session_id or getattr(origin, 'model', type(origin)) is not ChatMessage:
+        return
+    if deleted is not None:
+        deleted['sessions'].add(instance.session_id)
+    else:
+        ChatSession(pk=instance.session_id).refresh_message_stats()
@@ -0,0 +1,9 @@
+from celery import shared_task
+
+from . import importer
+
+
+@shared_task(ignore_result=True)
+def run_import_jobs():
+    """Run queued history imports; queued after each upload when CHAT_IMPORT['USE_CELERY'] is set"""
+    return importer.drain()
@@ -1,3 +1,1046 @@
-from django.test import TestCase
+import asyncio
+import json
+import re
+import threading
+from http.server import ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.test import TestCase, SimpleTestCase, Client, AsyncClient, override_settings
+from django.conf import settings
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .models import ChatSession, ChatMessage
+from .providers import get_provider, GeminiProvider, StubProvider, ProviderError
+from .management.commands.fake_gemini import FakeGeminiHandler
+from . import circuit_breaker
+from .circuit_breaker import CircuitBreaker, RetryPolicy, CircuitOpenError
+from config.lru import LRUCache
+
+from .response_cache import ResponseCache, normalize_message, get_response_cache
+from .context import build_context, estimate_tokens
+from . import export, search, websocket
+from .views import save_exchange
+from config import metrics
+from config.asgi import application as asgi_application
+
+User = get_user_model()
+
+
+class ChatStreamingTests(TestCase):
+    def setUp(self):
+        get_response_cache().local.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username='chatuser',
+            email='chat@example.com',
+            password='TestPass123!',
+            is_verified=True
+        )
+        self.client.force_login(self.user)
+
+    async def read_events(self, response):
+        """Parse a streamed SSE body into (event, data) tuples"""
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8')
+        events = []
+        for frame in body.strip().split('\n\n'):
+            event = 'message'
+            data = ''
+            for line in frame.split('\n'):
+                if line.startswith('event:'):
+                    event = line[len('event:'):].strip()
+                elif line.startswith('data:'):
+                    data += line[len('data:'):].strip()
+            events.append((event, json.loads(data)))
+        return events
+
+    @mock.patch('pimxchat.views.astream_gemini_api')
+    async def test_stream_forwards_chunks_and_persists_reply_once(self, mocked_stream):
+        async def fake_stream(message, language, context=None):
+            for chunk in ['سلام', ' دنیا']:
+                yield chunk
+        mocked_stream.side_effect = fake_stream
+
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user)
+        response = await client.post(
+            reverse('pimxchat:api_send_message_stream'),
+            data=json.dumps({'message': 'سلام'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        events = await self.read_events(response)
+        self.assertEqual(events[0][0], 'start')
+        self.assertEqual([data['delta'] for event, data in events if event == 'message'], ['سلام', ' دنیا'])
+        self.assertEqual(events[-1][0], 'done')
+        self.assertEqual(events[-1][1]['ai_message']['content'], 'سلام دنیا')
+
+        session = await ChatSession.objects.aget(user=self.user)
+        self.assertEqual(session.title, 'سلام')
+        self.assertEqual(events[-1][1]['user_message']['content'], 'سلام')
+        # Saved by save_exchange, with the denormalized columns set in the same transaction
+        self.assertEqual((session.message_count, session.preview, session.is_active), (2, 'سلام', True))
+        self.assertEqual(await ChatMessage.objects.filter(session=session, message_type='ai').acount(), 1)
+        self.assertEqual(await ChatMessage.objects.filter(session=session, message_type='user').acount(), 1)
+
+    @mock.patch('pimxchat.views.async_call_gemini_api', return_value='پاسخ تست')
+    def test_send_message_async_view(self, mocked_call):
+        response = self.client.post(
+            reverse('pimxchat:api_send_message'),
+            data=json.dumps({'message': 'تو کی هستی؟'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['ai_message']['content'], 'پاسخ تست')
+        self.assertEqual(ChatSession.objects.get(id=data['session_id']).title, 'تو کی هستی؟')
+
+    @mock.patch('pimxchat.views.async_call_gemini_api', return_value='پاسخ تست')
+    def test_send_message_writes(self, mocked_call):
+        """
+        The request itself makes three writes (the other session, the
+        message pair, this session). The site counter bump and the search
+        index insert run after the commit and are counted too.
+        """
+        previous = ChatSession.objects.create(user=self.user, title='قبلی', is_active=True)
+        session = ChatSession.objects.create(user=self.user, title='چت جدید', is_active=False)
+        ChatMessage.objects.create(session=session, content='خوش آمدید', message_type='ai', is_welcome_message=True)
+
+        with CaptureQueriesContext(connection) as captured, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('pimxchat:api_send_message'),
+                data=json.dumps({'session_id': str(session.id), 'message': 'اولین پیام'}),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        writes = []
+        for query in captured.captured_queries:
+            # executemany() is logged as "<n> times: <sql>"
+            words = re.sub(r'^\d+ times: ', '', query['sql']).split()
+            if words[0] in ('INSERT', 'UPDATE', 'DELETE'):
+                writes.append(' '.join(words[:3] if words[0] != 'UPDATE' else words[:2]))
+        # Deactivate the other session, insert both messages, update this session;
+        # after the commit, the site counter and the search index
+        expected = [
+            'UPDATE "pimxchat_chatsession"', 'INSERT INTO "pimxchat_chatmessage"', 'UPDATE "pimxchat_chatsession"',
+            'UPDATE "accounts_sitecounter"',
+        ]
+        if search.get_backend():
+            expected.append(f'INSERT INTO {search.TABLE}')
+        self.assertEqual(writes, expected)
+
+        session.refresh_from_db()
+        previous.refresh_from_db()
+        self.assertTrue(session.is_active)
+        self.assertFalse(previous.is_active)
+        self.assertEqual(session.title, 'اولین پیام')
+        self.assertEqual(session.message_count, 3)
+        self.assertEqual(session.preview, 'خوش آمدید')
+
+    def test_send_message_requires_login(self):
+        self.client.logout()
+        response = self.client.post(
+            reverse('pimxchat:api_send_message'),
+            data=json.dumps({'message': 'سلام'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_stream_rejects_empty_message(self):
+        response = self.client.post(
+            reverse('pimxchat:api_send_message_stream'),
+            data=json.dumps({'message': '   '}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ProviderTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGeminiHandler)
+        cls.server.daemon_threads = True
+        options = {'latency': 0, 'jitter': 0, 'error_rate': 0, 'error_status': 503,
+                   'reply_words': 6, 'chunks': 3, 'chunk_delay': 0, 'verbose': False}
+        for name, value in options.items():
+            setattr(cls.server, name, value)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}/v1'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    @override_settings(CHAT_PROVIDER={'BACKEND': 'pimxchat.providers.StubProvider', 'OPTIONS': {}})
+    def test_provider_is_chosen_from_settings(self):
+        self.assertIsInstance(get_provider(), StubProvider)
+
+    def test_gemini_provider_against_fake_server(self):
+        provider = GeminiProvider(API_KEY='test', BASE_URL=self.base_url)
+        self.assertEqual(len(provider.generate('سلام').split(' ')), 6)
+
+    async def test_gemini_provider_streams_from_fake_server(self):
+        provider = GeminiProvider(API_KEY='test', BASE_URL=self.base_url)
+        chunks = [chunk async for chunk in provider.astream('سلام')]
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(len(''.join(chunks).split(' ')), 6)
+
+    def test_gemini_provider_requires_api_key(self):
+        provider = GeminiProvider(API_KEY='', BASE_URL=self.base_url)
+        with self.assertRaisesMessage(ProviderError, 'API key is not set'):
+            provider.generate('سلام')
+
+    def test_fake_server_error_rate(self):
+        self.server.error_rate = 1
+        try:
+            provider = GeminiProvider(API_KEY='test', BASE_URL=self.base_url)
+            with self.assertRaises(ProviderError) as ctx:
+                provider.generate('سلام')
+            self.assertEqual(ctx.exception.status_code, 503)
+        finally:
+            self.server.error_rate = 0
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker('test', MIN_REQUESTS=4, ERROR_RATE_THRESHOLD=0.5,
+                                      P95_LATENCY_THRESHOLD=5.0, OPEN_SECONDS=30)
+        self.policy = RetryPolicy(MAX_ATTEMPTS=3, BASE_DELAY=0, MAX_DELAY=0, DEADLINE=5)
+
+    def failing(self, status_code):
+        def func(*args, timeout=None):
+            raise ProviderError('upstream down', status_code)
+        return func
+
+    def test_trips_on_error_rate_and_fails_fast(self):
+        for _ in range(4):
+            with self.assertRaises(ProviderError):
+                circuit_breaker.call(self.breaker, self.policy, self.failing(500))
+        self.assertEqual(self.breaker.status()['state'], circuit_breaker.OPEN)
+        self.assertEqual(metrics.snapshot()['test_breaker_trips_total'], 1)
+
+        called = []
+        with self.assertRaises(CircuitOpenError):
+            circuit_breaker.call(self.breaker, self.policy, lambda timeout=None: called.append(1))
+        self.assertEqual(called, [])
+
+    def test_trips_on_p95_latency(self):
+        for _ in range(4):
+            self.breaker.record(True, 6.0)
+        self.assertEqual(self.breaker.status()['state'], circuit_breaker.OPEN)
+
+    def test_concurrent_records_are_all_counted(self):
+        breaker = CircuitBreaker('test', MIN_REQUESTS=1000)
+
+        def record():
+            for _ in range(25):
+                breaker.record(False, 0.1)
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        status = breaker.status()
+        self.assertEqual(status['window_requests'], 200)
+        self.assertEqual(status['error_rate'], 1.0)
+
+    async def test_async_call_trips_breaker(self):
+        async def failing(timeout=None):
+            raise ProviderError('upstream down', 500)
+
+        for _ in range(4):
+            with self.assertRaises(ProviderError):
+                await circuit_breaker.acall(self.breaker, self.policy, failing)
+        with self.assertRaises(CircuitOpenError):
+            await circuit_breaker.acall(self.breaker, self.policy, failing)
+
+    def test_half_open_probe_closes_breaker(self):
+        self.breaker.record(False, 0.1)
+        self.breaker._trip(self.breaker._load(), 0)  # opened long ago, cool-down elapsed
+        self.assertTrue(self.breaker.allow_request())
+        # Only one probe at a time
+        self.assertFalse(self.breaker.allow_request())
+        self.breaker.record(True, 0.1)
+        self.assertEqual(self.breaker.status()['state'], circuit_breaker.CLOSED)
+
+    def test_retries_transient_errors(self):
+        attempts = []
+
+        def flaky(timeout=None):
+            attempts.append(timeout)
+            if len(attempts) < 3:
+                raise ProviderError('busy', 503)
+            return 'ok'
+
+        self.assertEqual(circuit_breaker.call(self.breaker, self.policy, flaky), 'ok')
+        self.assertEqual(len(attempts), 3)
+        self.assertTrue(all(timeout <= 5 for timeout in attempts))
+
+    def test_does_not_retry_permanent_errors(self):
+        attempts = []
+
+        def bad_request(timeout=None):
+            attempts.append(1)
+            raise ProviderError('bad request', 400)
+
+        with self.assertRaises(ProviderError):
+            circuit_breaker.call(self.breaker, self.policy, bad_request)
+        self.assertEqual(len(attempts), 1)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        get_response_cache().local.clear()
+        self.user = User.objects.create_user(
+            username='cacheuser',
+            email='cache@example.com',
+            password='TestPass123!',
+            is_verified=True
+        )
+        self.client.force_login(self.user)
+
+    def test_normalization_folds_persian_variants(self):
+        self.assertEqual(normalize_message('  تو كي هستي؟ '), normalize_message('تو کی هستی'))
+        self.assertEqual(normalize_message('Hello!!'), normalize_message('hello'))
+        # Same folding as search: ZWNJ is a word break
+        self.assertEqual(normalize_message('می\u200cخواهم'), search.normalize('می خواهم'))
+
+    def test_lru_eviction_and_ttl(self):
+        lru = LRUCache(max_entries=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), 1)
+
+        expired = LRUCache(max_entries=2, ttl=-1)
+        expired.set('a', 1)
+        self.assertIsNone(expired.get('a'))
+
+    def test_long_messages_are_not_cached(self):
+        response_cache = ResponseCache(MAX_MESSAGE_LENGTH=10)
+        response_cache.set('fa', 'x' * 50, 'model', 'reply')
+        self.assertIsNone(response_cache.get('fa', 'x' * 50, 'model'))
+
+    async def test_async_lookups_use_the_shared_tier(self):
+        writer = ResponseCache(SHARED_CACHE='default')
+        await writer.aset('fa', 'سلام', 'model', 'درود')
+        # Another worker: empty local LRU, same shared cache
+        reader = ResponseCache(SHARED_CACHE='default')
+        self.assertEqual(await reader.aget('fa', 'سلام!', 'model'), 'درود')
+        self.assertEqual(len(reader.local), 1)
+
+    @override_settings(CHAT_PROVIDER={'BACKEND': 'pimxchat.providers.StubProvider', 'OPTIONS': {'MODEL': 'stub'}})
+    def test_repeated_prompt_is_served_from_cache(self):
+        url = reverse('pimxchat:api_send_message')
+        first = self.client.post(url, data=json.dumps({'message': 'سلام'}), content_type='application/json').json()
+        self.assertFalse(first['cached'])
+
+        with mock.patch('pimxchat.views.async_call_gemini_api') as mocked_call:
+            second = self.client.post(url, data=json.dumps({'message': 'سلام!'}), content_type='application/json').json()
+            mocked_call.assert_not_called()
+        self.assertTrue(second['cached'])
+        self.assertEqual(second['ai_message']['content'], first['ai_message']['content'])
+        self.assertGreaterEqual(metrics.snapshot()['chat_response_cache_local_hits_total'], 1)
+
+
+class ConversationContextTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='contextuser',
+            email='context@example.com',
+            password='TestPass123!',
+            is_verified=True
+        )
+        self.session = ChatSession.objects.create(user=self.user, title='چت جدید')
+        ChatMessage.objects.create(session=self.session, content='خوش آمدید', message_type='ai', is_welcome_message=True)
+        for index in range(6):
+            ChatMessage.objects.create(session=self.session, content=f'پیام شماره {index} ' + 'کلمه ' * 20, message_type='user' if index % 2 == 0 else 'ai')
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(''), 0)
+        self.assertEqual(estimate_tokens('abcdefgh'), 2)
+        self.assertEqual(estimate_tokens('سلام'), 2)
+
+    def test_history_fits_budget_without_summary(self):
+        context = build_context(self.session, 'ادامه بده', config={'TOKEN_BUDGET': 10000})
+        self.assertEqual(len(context.turns), 6)
+        self.assertEqual(context.turns[0][0], 'user')
+        self.assertEqual(context.summary, '')
+
+    def test_overflow_is_folded_into_summary_once(self):
+        config = {'TOKEN_BUDGET': 150, 'SUMMARY_LINE_WORDS': 3}
+        context = build_context(self.session, 'ادامه بده', config=config)
+        self.assertLess(len(context.turns), 6)
+        self.assertTrue(context.turns[-1][1].startswith('پیام شماره 5'))
+        self.assertIn('کاربر: پیام شماره 0 …', context.summary)
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.summary, context.summary)
+        # Summarized rows are skipped on the next send instead of being read again
+        with self.assertNumQueries(1):
+            again = build_context(self.session, 'ادامه بده', config=config)
+        self.assertEqual(again.turns, context.turns)
+
+    def test_turns_past_the_message_cap_are_summarized(self):
+        session = ChatSession.objects.create(user=self.user, title='چت وارد شده')
+        for index in range(45):
+            ChatMessage.objects.create(session=session, content=f'کوتاه {index}', message_type='user' if index % 2 == 0 else 'ai')
+        config = {'TOKEN_BUDGET': 10000, 'MAX_RECENT_MESSAGES': 40}
+        context = build_context(session, 'ادامه بده', config=config)
+        self.assertEqual(len(context.turns), 40)
+        self.assertEqual(context.turns[0][1], 'کوتاه 5')
+        self.assertEqual(context.summary.split('\n'), [f"{'کاربر' if i % 2 == 0 else 'دستیار'}: کوتاه {i}" for i in range(5)])
+
+        session.refresh_from_db()
+        self.assertIsNotNone(session.summarized_through)
+        again = build_context(session, 'ادامه بده', config=config)
+        self.assertEqual((again.turns, again.summary), (context.turns, context.summary))
+
+    def test_gemini_payload_alternates_roles(self):
+        provider = GeminiProvider(API_KEY='key', BASE_URL='http://localhost', MODEL='gemini')
+        context = build_context(self.session, 'ادامه بده', config={'TOKEN_BUDGET': 10000})
+        contents = provider.build_payload('ادامه بده', 'fa', context)['contents']
+        roles = [item['role'] for item in contents]
+        self.assertTrue(all(a != b for a, b in zip(roles, roles[1:])))
+        self.assertEqual(contents[-1]['parts'][-1]['text'], 'ادامه بده')
+
+
+class SessionStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='statsuser',
+            email='stats@example.com',
+            password='TestPass123!',
+            is_verified=True
+        )
+        self.client.force_login(self.user)
+
+    def test_counters_follow_inserts_and_deletes(self):
+        session = ChatSession.objects.create(user=self.user, title='چت جدید')
+        first = ChatMessage.objects.create(session=session, content='x' * 80, message_type='user')
+        last = ChatMessage.objects.create(session=session, content='پاسخ', message_type='ai')
+        session.refresh_from_db()
+        self.assertEqual(session.message_count, 2)
+        self.assertEqual(session.preview, 'x' * 50 + '...')
+        self.assertEqual(session.last_message_at, last.timestamp)
+
+        first.delete()
+        session.refresh_from_db()
+        self.assertEqual(session.message_count, 1)
+        self.assertEqual(session.preview, 'پاسخ')
+
+        session.messages.all().delete()
+        session.refresh_from_db()
+        self.assertEqual((session.message_count, session.preview, session.last_message_at), (0, '', None))
+
+    def count_queries(self, action, messages):
+        session = ChatSession.objects.create(user=self.user, title='چت جدید')
+        for index in range(messages):
+            ChatMessage.objects.create(session=session, content=f'پیام {index}', message_type='user')
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            action(session)
+        return session, len(queries)
+
+    def test_clearing_a_session_does_not_query_per_message(self):
+        from .views import clear_session
+        _, few = self.count_queries(clear_session, 3)
+        session, many = self.count_queries(clear_session, 40)
+        self.assertEqual(few, many)
+        session.refresh_from_db()
+        self.assertEqual(session.message_count, 1)
+        self.assertEqual(session.messages.get().is_welcome_message, True)
+        self.assertEqual(session.preview, ChatSession.make_preview(session.messages.get().content))
+
+    def test_deleting_a_session_does_not_query_per_message(self):
+        from .views import delete_session
+        _, few = self.count_queries(delete_session, 3)
+        session, many = self.count_queries(delete_session, 40)
+        self.assertEqual(few, many)
+        self.assertFalse(ChatMessage.objects.filter(session_id=session.pk).exists())
+
+    def test_sidebar_is_a_single_query(self):
+        for index in range(5):
+            session = ChatSession.objects.create(user=self.user, title=f'چت {index}')
+            ChatMessage.objects.create(session=session, content=f'سلام {index}', message_type='user')
+        # session + user lookups for auth, then one query for the list
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('pimxchat:api_chat_sessions'))
+        sessions = response.json()['sessions']
+        self.assertEqual(len(sessions), 5)
+        self.assertEqual(sessions[0]['preview'], 'سلام 4')
+        self.assertEqual(sessions[0]['message_count'], 1)
+
+
+@override_settings(CHAT_PAGINATION={'PAGE_SIZE': 3, 'MAX_PAGE_SIZE': 5})
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='pageuser',
+            email='page@example.com',
+            password='TestPass123!',
+            is_verified=True
+        )
+        self.client.force_login(self.user)
+        self.session = ChatSession.objects.create(user=self.user, title='چت طولانی')
+        for index in range(8):
+            ChatMessage.objects.create(session=self.session, content=f'پیام {index}', message_type='user')
+
+    def get_messages(self, **params):
+        url = reverse('pimxchat:api_chat_messages', args=[self.session.id])
+        return self.client.get(url, params).json()
+
+    def test_messages_walk_backwards_without_gaps(self):
+        page = self.get_messages()
+        contents = [message['content'] for message in page['messages']]
+        self.assertEqual(contents, ['پیام 5', 'پیام 6', 'پیام 7'])
+
+        seen = contents
+        while page['has_more']:
+            page = self.get_messages(before=page['before'])
+            seen = [message['content'] for message in page['messages']] + seen
+        self.assertEqual(seen, [f'پیام {index}' for index in range(8)])
+
+    def test_after_cursor_and_page_size_cap(self):
+        capped = self.get_messages(limit=100)
+        self.assertEqual(len(capped['messages']), 5)
+
+        older = self.get_messages(limit=1, before=capped['before'])
+        self.assertEqual(older['messages'][0]['content'], 'پیام 2')
+        newer = self.get_messages(after=older['after'])
+        self.assertEqual([message['content'] for message in newer['messages']], ['پیام 3', 'پیام 4', 'پیام 5'])
+        self.assertTrue(newer['has_newer'])
+
+    def test_sessions_are_paged_newest_first(self):
+        for index in range(4):
+            ChatSession.objects.create(user=self.user, title=f'چت {index}')
+        first = self.client.get(reverse('pimxchat:api_chat_sessions')).json()
+        self.assertEqual([session['title'] for session in first['sessions']], ['چت 3', 'چت 2', 'چت 1'])
+        self.assertTrue(first['has_more'])
+        rest = self.client.get(reverse('pimxchat:api_chat_sessions'), {'before': first['before']}).json()
+        self.assertEqual([session['title'] for session in rest['sessions']], ['چت 0', 'چت طولانی'])
+        self.assertFalse(rest['has_more'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('pimxchat:api_chat_sessions'), {'before': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_with_invalid_pk(self):
+        import base64
+        cursor = base64.urlsafe_b64encode(json.dumps(['2024-01-01T00:00:00', 'x']).encode()).decode().rstrip('=')
+        url = reverse('pimxchat:api_chat_messages', args=[self.session.id])
+        self.assertEqual(self.client.get(url, {'before': cursor}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'after': cursor}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('pimxchat:api_chat_sessions'), {'before': cursor}).status_code, 400)
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN the chat hot paths and check they are served by indexes"""
+
+    def setUp(self):
+        get_response_cache().local.clear()
+        self.user = User.objects.create_user(
+            username='planuser',
+            email='plan@example.com',
+            password='TestPass123!',
+            is_verified=True
+        )
+        self.client.force_login(self.user)
+        self.session = ChatSession.objects.create(user=self.user, title='چت')
+        ChatMessage.objects.create(session=self.session, content='سلام', message_type='user')
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                return [row[-1] for row in cursor.fetchall()]
+            # Tiny test tables would always get a seq scan; ask whether an index path exists
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql)
+            return [row[0] for row in cursor.fetchall()]
+
+    def full_scans(self, plan):
+        tables = ('pimxchat_chatsession', 'pimxchat_chatmessage')
+        problems = []
+        for line in plan:
+            if connection.vendor == 'sqlite':
+                if line.startswith('SCAN') and any(table in line for table in tables) and 'COVERING INDEX' not in line:
+                    problems.append(line)
+                if 'TEMP B-TREE' in line:
+                    problems.append(line)
+            elif 'Seq Scan' in line and any(table in line for table in tables):
+                problems.append(line)
+        return problems
+
+    def assert_indexed(self, request):
+        with CaptureQueriesContext(connection) as captured:
+            response = request()
+        self.assertLess(response.status_code, 400)
+        for query in captured.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or ('pimxchat_chatsession' not in sql and 'pimxchat_chatmessage' not in sql):
+                continue
+            plan = self.explain(sql)
+            self.assertEqual(self.full_scans(plan), [], f'{sql}\n{plan}')
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_chat_view(self):
+        self.assert_indexed(lambda: self.client.get(reverse('pimxchat:chat')))
+
+    def test_api_chat_sessions(self):
+        self.assert_indexed(lambda: self.client.get(reverse('pimxchat:api_chat_sessions')))
+
+    def test_api_chat_messages(self):
+        self.assert_indexed(lambda: self.client.get(reverse('pimxchat:api_chat_messages', args=[self.session.id])))
+
+    @override_settings(CHAT_PROVIDER={'BACKEND': 'pimxchat.providers.StubProvider', 'OPTIONS': {'MODEL': 'stub'}})
+    def test_api_send_message(self):
+        self.assert_indexed(lambda: self.client.post(
+            reverse('pimxchat:api_send_message'),
+            data=json.dumps({'session_id': str(self.session.id), 'message': 'ادامه'}),
+            content_type='application/json'
+        ))
+
+
+class WebSocketClient:
+    """Drive the ASGI WebSocket application directly, without a server"""
+
+    def __init__(self, cookie=None, origin='http://testserver'):
+        headers = [(b'host', b'testserver')]
+        if cookie:
+            headers.append((b'cookie', cookie.encode('latin1')))
+        if origin:
+            headers.append((b'origin', origin.encode('latin1')))
+        self.scope = {'type': 'websocket', 'path': '/ws/chat/', 'headers': headers}
+        self.inbound = asyncio.Queue()
+        self.outbound = asyncio.Queue()
+
+    async def connect(self):
+        self.task = asyncio.ensure_future(asgi_application(self.scope, self.inbound.get, self.outbound.put))
+        await self.inbound.put({'type': 'websocket.connect'})
+        return await asyncio.wait_for(self.outbound.get(), 5)
+
+    async def send_json(self, data):
+        await self.inbound.put({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def receive_json(self):
+        message = await asyncio.wait_for(self.outbound.get(), 5)
+        return json.loads(message['text'])
+
+    async def disconnect(self):
+        await self.inbound.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self.task, 5)
+
+
+@override_settings(CHAT_PROVIDER={'BACKEND': 'pimxchat.providers.StubProvider', 'OPTIONS': {'MODEL': 'stub'}})
+class WebSocketTests(TestCase):
+    def setUp(self):
+        get_response_cache().local.clear()
+        self.user = User.objects.create_user(
+            username='socketuser',
+            email='socket@example.com',
+            password='TestPass123!',
+            is_verified=True
+        )
+        self.client.force_login(self.user)
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    async def test_rejects_anonymous_and_cross_site_sockets(self):
+        response = await WebSocketClient().connect()
+        self.assertEqual(response, {'type': 'websocket.close', 'code': 4401})
+        response = await WebSocketClient(self.cookie, origin='https://evil.example').connect()
+        self.assertEqual(response, {'type': 'websocket.close', 'code': 4403})
+
+    async def test_send_streams_and_pushes_to_other_tabs(self):
+        tab, other_tab = WebSocketClient(self.cookie), WebSocketClient(self.cookie)
+        self.assertEqual((await tab.connect())['type'], 'websocket.accept')
+        self.assertEqual((await other_tab.connect())['type'], 'websocket.accept')
+
+        await tab.send_json({'id': 1, 'type': 'send', 'message': 'سلام'})
+        frames = [await tab.receive_json()]
+        while frames[-1]['type'] != 'done':
+            frames.append(await tab.receive_json())
+        self.assertEqual(frames[0]['type'], 'start')
+        self.assertTrue(all(frame['id'] == 1 for frame in frames))
+        reply = ''.join(frame['delta'] for frame in frames if frame['type'] == 'delta')
+        self.assertEqual(frames[-1]['ai_message']['content'], reply)
+
+        self.assertEqual(frames[-1]['session']['title'], 'سلام')
+        pushed = await other_tab.receive_json()
+        self.assertEqual(pushed['type'], 'session_updated')
+        self.assertEqual(pushed['session']['title'], 'سلام')
+        self.assertEqual(pushed['session']['message_count'], 2)
+
+        session_id = frames[-1]['session_id']
+        await other_tab.send_json({'id': 7, 'type': 'rename', 'session_id': session_id, 'title': 'عنوان تازه'})
+        self.assertEqual(await other_tab.receive_json(), {'id': 7, 'type': 'result', 'success': True, 'title': 'عنوان تازه'})
+        self.assertEqual((await tab.receive_json())['session']['title'], 'عنوان تازه')
+
+        await tab.disconnect()
+        await other_tab.disconnect()
+
+    async def test_pushes_relayed_from_other_workers(self):
+        tab = WebSocketClient(self.cookie)
+        await tab.connect()
+        # Constructing the relay does not connect; receive() is what the listener calls
+        relay = websocket.PushRelay('redis://localhost:6379/0')
+        relay.receive(json.dumps({'process': websocket.PROCESS_ID, 'user': self.user.pk, 'data': {'type': 'resync'}}))
+        relay.receive(json.dumps({
+            'process': 'other-worker', 'user': self.user.pk,
+            'data': {'type': 'session_deleted', 'session_id': 'abc'},
+        }))
+        self.assertEqual(await tab.receive_json(), {'type': 'session_deleted', 'session_id': 'abc'})
+        await tab.disconnect()
+
+    @override_settings(CHAT_WEBSOCKET={'MAX_IN_FLIGHT': 1})
+    async def test_in_flight_limit(self):
+        session = await ChatSession.objects.acreate(user=self.user, title='چت')
+        tab = WebSocketClient(self.cookie)
+        await tab.connect()
+        release = asyncio.Event()
+
+        async def slow_stream(message, language, context=None):
+            await release.wait()
+            yield 'پاسخ'
+
+        with mock.patch('pimxchat.websocket.astream_gemini_api', slow_stream):
+            await tab.send_json({'id': 1, 'type': 'send', 'message': 'اول', 'session_id': str(session.id)})
+            self.assertEqual((await tab.receive_json())['type'], 'start')
+            await tab.send_json({'id': 2, 'type': 'clear', 'session_id': str(session.id)})
+            rejected = await tab.receive_json()
+            self.assertEqual((rejected['id'], rejected['status']), (2, 429))
+            release.set()
+            self.assertEqual((await tab.receive_json())['type'], 'delta')
+            self.assertEqual((await tab.receive_json())['type'], 'done')
+        await tab.disconnect()
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='staff', email='staff@example.com', password='TestPass123!')
+        self.client.force_login(self.admin)
+        self.users = 0
+
+    def add_sessions(self, count):
+        for _ in range(count):
+            self.users += 1
+            user = User.objects.create_user(username=f'chatter{self.users}', email=f'chatter{self.users}@example.com', password='x')
+            session = ChatSession.objects.create(user=user, title=f'چت {self.users}')
+            ChatMessage.objects.create(session=session, content='سلام', message_type='user')
+            ChatMessage.objects.create(session=session, content='درود', message_type='ai')
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, url, expected):
+        # Session and user for the request, the bounded count, the page
+        self.add_sessions(2)
+        self.assertEqual(self.changelist_queries(url), expected)
+        self.add_sessions(8)
+        self.assertEqual(self.changelist_queries(url), expected)
+
+    def test_session_changelist(self):
+        self.assert_constant_queries(reverse('admin:pimxchat_chatsession_changelist'), 4)
+
+    def test_message_changelist(self):
+        self.assert_constant_queries(reverse('admin:pimxchat_chatmessage_changelist'), 4)
+
+    def test_message_search_uses_index(self):
+        self.add_sessions(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            wanted = ChatMessage.objects.create(session=ChatSession.objects.first(), content='كتابخانه ملی')
+        response = self.client.get(reverse('admin:pimxchat_chatmessage_changelist'), {'q': 'کتاب'})
+        self.assertEqual([message.pk for message in response.context['cl'].result_list], [wanted.pk])
+        response = self.client.get(reverse('admin:pimxchat_chatmessage_changelist'), {'q': 'chatter1'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+    @override_settings(CHAT_PAGINATION={'ADMIN_COUNT_LIMIT': 5})
+    def test_count_is_bounded(self):
+        self.add_sessions(4)
+        response = self.client.get(reverse('admin:pimxchat_chatmessage_changelist'))
+        self.assertEqual(response.context['cl'].result_count, 5)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='seeker', email='seeker@example.com', password='TestPass123!')
+        self.other = User.objects.create_user(username='other', email='other@example.com', password='TestPass123!')
+        self.client.force_login(self.user)
+        self.session = ChatSession.objects.create(user=self.user, title='سفر')
+
+    def add(self, content, session=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ChatMessage.objects.create(session=session or self.session, content=content)
+
+    def test_normalization(self):
+        self.assertEqual(search.normalize('كيك'), 'کیک')
+        self.assertEqual(search.normalize('مدرسة'), 'مدرسه')
+        self.assertEqual(search.normalize('می‌خواهم'), 'می خواهم')
+        self.assertEqual(search.normalize('سَلام ۱۲۳ Hello'), 'سلام 123 hello')
+        self.assertEqual(search.query_terms('مي‌خواهم!'), ['می', 'خواهم'])
+
+    def test_finds_only_own_messages_with_highlight(self):
+        mine = self.add('من مي‌خواهم به شيراز بروم')
+        self.add('تهران شلوغ است')
+        self.add('من هم به شیراز می‌روم', session=ChatSession.objects.create(user=self.other))
+
+        found, has_more = search.search_messages(self.user, 'شیر')
+        self.assertEqual([message.pk for message in found], [mine.pk])
+        self.assertFalse(has_more)
+        self.assertEqual(found[0].snippet, 'من مي‌خواهم به <mark>شيراز</mark> بروم')
+
+        found, _ = search.search_messages(self.user, 'میخواهم')
+        self.assertEqual(found, [])
+        found, _ = search.search_messages(self.user, 'می خواهم')
+        self.assertEqual([message.pk for message in found], [mine.pk])
+
+    def test_index_follows_saves_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            user_message, ai_message = save_exchange(self.session, 'پایتون چیست؟', 'پایتون یک زبان است', is_new=False, is_first=True)
+        found, _ = search.search_messages(self.user, 'پایتون')
+        self.assertEqual({message.pk for message in found}, {user_message.pk, ai_message.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ai_message.delete()
+        found, _ = search.search_messages(self.user, 'پایتون')
+        self.assertEqual([message.pk for message in found], [user_message.pk])
+
+        # A delete that rolls back keeps its messages in the index
+        from django.db import transaction
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    ChatSession.objects.get(pk=self.session.pk).delete()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(len(search.search_messages(self.user, 'پایتون')[0]), 1)
+
+        self.assertEqual(search.rebuild(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.session.delete()
+        self.assertEqual(search.search_messages(self.user, 'پایتون'), ([], False))
+
+    def test_search_endpoint_pages(self):
+        for index in range(3):
+            self.add(f'پیام شماره {index} درباره کتاب')
+        response = self.client.get(reverse('pimxchat:api_search_messages'), {'q': 'کتاب', 'limit': 2})
+        data = response.json()
+        self.assertEqual(len(data['results']), 2)
+        self.assertTrue(data['has_more'])
+        self.assertIn('<mark>کتاب</mark>', data['results'][0]['snippet'])
+        self.assertEqual(data['results'][0]['session_title'], 'سفر')
+
+        response = self.client.get(reverse('pimxchat:api_search_messages'), {'q': 'کتاب', 'limit': 2, 'page': 2})
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertFalse(response.json()['has_more'])
+        self.assertEqual(self.client.get(reverse('pimxchat:api_search_messages')).status_code, 400)
+
+    def test_highlight_escapes_and_trims(self):
+        snippet = search.highlight('<b>' + 'الف ' * 60 + 'هدف نهایی', ['هدف'], length=40)
+        self.assertTrue(snippet.startswith('…'))
+        self.assertIn('<mark>هدف</mark>', snippet)
+        self.assertEqual(search.highlight('<b>هدف</b>', ['هدف']), '&lt;b&gt;<mark>هدف</mark>&lt;/b&gt;')
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='exporter', email='exporter@example.com', password='TestPass123!')
+        other = User.objects.create_user(username='someone', email='someone@example.com', password='TestPass123!')
+        self.sessions = []
+        for index in range(3):
+            session = ChatSession.objects.create(user=self.user, title=f'چت {index}')
+            ChatMessage.objects.create(session=session, content=f'سوال {index}', message_type='user')
+            ChatMessage.objects.create(session=session, content=f'پاسخ {index}', message_type='ai')
+            self.sessions.append(session)
+        self.sessions.sort(key=lambda session: session.pk)
+        ChatMessage.objects.create(session=ChatSession.objects.create(user=other), content='خصوصی')
+
+    async def download(self, **params):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user)
+        response = await client.get(reverse('pimxchat:api_export_history'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join([chunk async for chunk in response.streaming_content])
+
+    def test_history_is_read_with_two_queries(self):
+        with self.assertNumQueries(2):
+            events = list(export.iter_history(self.user, timezone.now(), chunk_size=2))
+        self.assertEqual([kind for kind, _ in events], ['session', 'message', 'message'] * 3)
+        self.assertEqual([row['id'] for kind, row in events if kind == 'session'], [s.pk for s in self.sessions])
+
+    @override_settings(CHAT_EXPORT={'BUFFER_SIZE': 64})
+    def test_output_is_chunked(self):
+        chunks = list(export.export_chunks(self.user, 'ndjson'))
+        self.assertGreater(len(chunks), 3)
+        self.assertTrue(all(len(chunk) < 1024 for chunk in chunks))
+
+    async def test_ndjson(self):
+        response, body = await self.download()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('attachment;', response['Content-Disposition'])
+        records = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+        self.assertEqual(records[0]['type'], 'export')
+        self.assertEqual(records[0]['user'], 'exporter')
+        self.assertEqual(len(records), 1 + 3 * 3)
+        self.assertEqual(records[1]['id'], str(self.sessions[0].pk))
+        self.assertEqual([records[2]['role'], records[3]['role']], ['user', 'ai'])
+        self.assertNotIn('خصوصی', body.decode('utf-8'))
+
+    async def test_zipped_json_and_gzipped_markdown(self):
+        import gzip
+        import io
+        import zipfile
+
+        response, body = await self.download(format='json')
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            document = json.loads(archive.read('pimxchat-history.json'))
+        self.assertEqual(len(document['sessions']), 3)
+        first = document['sessions'][0]
+        self.assertEqual(first['id'], str(self.sessions[0].pk))
+        index = first['title'].split()[-1]
+        self.assertEqual([m['content'] for m in first['messages']], [f'سوال {index}', f'پاسخ {index}'])
+
+        response, body = await self.download(format='md', gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        text = gzip.decompress(body).decode('utf-8')
+        self.assertIn('## چت 0', text)
+        self.assertIn('**دستیار**', text)
+
+    async def test_resume_after_session(self):
+        _, body = await self.download()
+        header = json.loads(body.decode('utf-8').splitlines()[0])
+        await ChatMessage.objects.acreate(session=self.sessions[2], content='بعد از خروجی')
+
+        _, body = await self.download(after=str(self.sessions[0].pk), as_of=header['as_of'])
+        records = [json.loads(line) for line in body.decode('utf-8').splitlines()[1:]]
+        self.assertEqual([r['id'] for r in records if r['type'] == 'session'], [str(s.pk) for s in self.sessions[1:]])
+        self.assertEqual(len(records), 6)
+
+    def test_rejects_unknown_format(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('pimxchat:api_export_history'), {'format': 'pdf'}).status_code, 400)
+
+
+class ImportTests(TestCase):
+    def setUp(self):
+        import tempfile
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.owner = User.objects.create_user(username='backup', email='backup@example.com', password='TestPass123!')
+        self.user = User.objects.create_user(username='restorer', email='restorer@example.com', password='TestPass123!')
+        for index in range(2):
+            session = ChatSession.objects.create(user=self.owner, title=f'چت {index}')
+            ChatMessage.objects.create(session=session, content=f'سوال {index}', message_type='user')
+            ChatMessage.objects.create(session=session, content=f'پاسخ {index}', message_type='ai')
+            session.refresh_message_stats()
+
+    def backup(self, compress=False, extra=b''):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        body = b''.join(export.export_chunks(self.owner, 'ndjson')) + extra
+        if compress:
+            import gzip
+            body = gzip.compress(body)
+        return SimpleUploadedFile('backup.ndjson.gz' if compress else 'backup.ndjson', body)
+
+    def run_import(self, user, upload):
+        from . import importer
+        job = importer.create_job(user, upload)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(importer.drain(), 1)
+        job.refresh_from_db()
+        return job
+
+    def test_import_into_another_account(self):
+        job = self.run_import(self.user, self.backup(compress=True))
+        self.assertEqual(job.status, 'done', job.errors)
+        self.assertEqual((job.sessions_created, job.messages_created), (2, 4))
+        self.assertEqual(job.progress, 100)
+        self.assertFalse(job.file)
+
+        sessions = ChatSession.objects.filter(user=self.user)
+        self.assertEqual(sessions.count(), 2)
+        # The original ids belong to the other account, so the copies get new ones
+        self.assertFalse(sessions.filter(id__in=ChatSession.objects.filter(user=self.owner).values('id')).exists())
+        session = sessions.get(title='چت 0')
+        self.assertEqual(session.message_count, 2)
+        self.assertEqual(session.preview, 'سوال 0')
+        original = ChatMessage.objects.get(session__user=self.owner, content='سوال 0')
+        self.assertEqual(session.messages.get(content='سوال 0').timestamp, original.timestamp)
+        if search.get_backend():
+            found, _ = search.search_messages(self.user, 'پاسخ')
+            self.assertEqual(len(found), 2)
+
+    def test_reimport_adds_nothing(self):
+        first = self.run_import(self.user, self.backup())
+        second = self.run_import(self.user, self.backup(compress=True))
+        self.assertEqual(first.messages_created, 4)
+        self.assertEqual((second.sessions_created, second.messages_created, second.duplicates_skipped), (0, 0, 4))
+        self.assertEqual(ChatMessage.objects.filter(session__user=self.user).count(), 4)
+
+        own = self.run_import(self.owner, self.backup())
+        self.assertEqual((own.sessions_created, own.messages_created, own.duplicates_skipped), (0, 0, 4))
+
+    def test_invalid_lines_are_rejected(self):
+        extra = b'\n'.join([
+            b'not json',
+            json.dumps({'type': 'message', 'session_id': '00000000-0000-0000-0000-000000000000',
+                        'role': 'user', 'content': 'x', 'timestamp': '2024-01-01T00:00:00'}).encode(),
+            json.dumps({'type': 'session', 'id': 'nope'}).encode(),
+        ]) + b'\n'
+        job = self.run_import(self.user, self.backup(extra=extra))
+        self.assertEqual(job.status, 'done')
+        self.assertEqual((job.messages_created, job.lines_rejected), (4, 3))
+        self.assertEqual(len(job.errors), 3)
+        self.assertTrue(job.errors[1].startswith('line '))
+
+    def test_other_files_fail(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        job = self.run_import(self.user, SimpleUploadedFile('chat.json', b'{"sessions": []}'))
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.messages_created, 0)
+        self.assertTrue(job.errors)
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_upload_and_status_endpoints(self):
+        from . import importer
+        self.client.force_login(self.user)
+        url = reverse('pimxchat:api_import_history')
+        self.assertEqual(self.client.post(url).status_code, 400)
+        with override_settings(CHAT_IMPORT={'MAX_UPLOAD_SIZE': 10}):
+            self.assertEqual(self.client.post(url, {'file': self.backup()}).status_code, 413)
+
+        response = self.client.post(url, {'file': self.backup()})
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        self.assertEqual(data['status'], 'pending')
+        importer.drain()
+        data = self.client.get(data['status_url']).json()
+        self.assertEqual((data['status'], data['messages_created']), ('done', 4))
+
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(response.json()['status_url']).status_code, 404)
@@ -0,0 +1,49 @@
+"""
+Persian/Arabic text folding shared by chat search and the reply cache.
+
+Arabic yeh/kaf/teh marbuta become their Persian forms, diacritics,
+tatweel and direction marks are dropped, Persian and Arabic digits become
+ASCII and ZWNJ becomes a space, so «می‌خواهم», «می خواهم» and «مي خواهم»
+fold to the same text. Each character is NFKC-normalized and casefolded.
+"""
+import unicodedata
+from functools import lru_cache
+
+CHARACTER_MAP = {
+    '\u064a': '\u06cc',  # Arabic yeh -> Persian yeh
+    '\u0649': '\u06cc',  # Alef maksura -> Persian yeh
+    '\u0643': '\u06a9',  # Arabic kaf -> Persian kaf
+    '\u0629': '\u0647',  # Teh marbuta -> heh
+    '\u200c': ' ',  # ZWNJ separates the parts of a word
+    '\u200d': '',  # ZWJ
+    '\u200e': '',  # LRM
+    '\u200f': '',  # RLM
+    '\u0640': '',  # Tatweel
+    '\u0670': '',  # Superscript alef
+}
+CHARACTER_MAP.update({chr(0x06f0 + digit): str(digit) for digit in range(10)})
+CHARACTER_MAP.update({chr(0x0660 + digit): str(digit) for digit in range(10)})
+CHARACTER_MAP.update({chr(code): '' for code in range(0x064b, 0x0653)})
+
+
+@lru_cache(maxsize=4096)
+def fold(character):
+    """Folded form of one character; may be empty or longer than one character"""
+    return ''.join(
+        CHARACTER_MAP.get(part, part) for part in unicodedata.normalize('NFKC', character)
+    ).casefold()
+
+
+def normalize_with_offsets(text):
+    """Normalized text and, for each of its characters, the index it came from in text"""
+    characters = []
+    offsets = []
+    for index, character in enumerate(text):
+        for mapped in fold(character):
+            characters.append(mapped)
+            offsets.append(index)
+    return ''.join(characters), offsets
+
+
+def normalize(text):
+    return ''.join(map(fold, text))
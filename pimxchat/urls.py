@@ -14,7 +14,12 @@ urlpatterns = [
     # API endpoints for chat functionality
     path('api/chat/sessions/', views.api_chat_sessions, name='api_chat_sessions'),
     path('api/chat/sessions/<uuid:session_id>/messages/', views.api_chat_messages, name='api_chat_messages'),
+    path('api/chat/search/', views.api_search_messages, name='api_search_messages'),
+    path('api/chat/export/', views.api_export_history, name='api_export_history'),
+    path('api/chat/import/', views.api_import_history, name='api_import_history'),
+    path('api/chat/import/<uuid:job_id>/', views.api_import_status, name='api_import_status'),
     path('api/chat/send/', views.api_send_message, name='api_send_message'),
+    path('api/chat/send/stream/', views.api_send_message_stream, name='api_send_message_stream'),
     path('api/chat/new/', views.api_new_chat, name='api_new_chat'),
     path('api/chat/sessions/<uuid:session_id>/delete/', views.api_delete_session, name='api_delete_session'),
     path('api/chat/sessions/<uuid:session_id>/clear/', views.api_clear_chat, name='api_clear_chat'),
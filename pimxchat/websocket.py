@@ -0,0 +1,408 @@
+"""
+WebSocket transport for the chat page, mounted at CHAT_WEBSOCKET['PATH']
+by config/asgi.py.
+
+The user is authenticated once, from the Django session cookie, when the
+socket opens. After that every operation is one JSON frame carrying a
+client-chosen ``id`` that is echoed on each reply frame::
+
+    {"id": 1, "type": "send", "message": "سلام", "session_id": null}
+    {"id": 2, "type": "rename", "session_id": "...", "title": "..."}
+    {"id": 3, "type": "delete", "session_id": "..."}
+    {"id": 4, "type": "clear", "session_id": "..."}
+
+``send`` answers with ``start``, ``delta`` and ``done`` frames, the other
+operations with a single ``result`` frame, and failures with ``error``.
+Changes are also pushed to the user's other open sockets
+(``session_updated``, ``session_deleted``, ``session_cleared``) so other
+tabs can update their sidebar without polling. Sockets are tracked per
+process; with several workers the pushes are relayed between them over
+Redis pub/sub (PUSH_REDIS_URL, the REDIS_URL server by default). Without
+it a push only reaches tabs connected to the same worker, and tabs on
+other workers pick the change up on their next reload.
+
+Each connection has at most MAX_IN_FLIGHT operations running; more are
+rejected with a 429 error frame, as are sends over the RATE_LIMITS rules
+named in RATE_LIMIT_RULES. Outgoing frames go through a bounded
+queue: a slow client pauses its own reply stream (and with it the
+upstream read), and pushes that do not fit are dropped in favour of a
+single ``resync`` frame telling the client to reload its sidebar.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from collections import defaultdict
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections
+from django.http.cookie import parse_cookie
+
+from accounts import ratelimit
+
+from .context import build_context, ConversationContext
+from .models import ChatSession
+from .views import (
+    aget_cached_reply, astream_gemini_api, clear_session, delete_session, save_exchange, serialize_session
+)
+
+DEFAULT_CONFIG = {
+    'PATH': '/ws/chat/',
+    'MAX_IN_FLIGHT': 4,
+    'SEND_QUEUE_SIZE': 64,
+    'MAX_FRAME_BYTES': 64 * 1024,
+    # RATE_LIMITS rules applied to each send, the same ones that guard /api/chat/send/
+    'RATE_LIMIT_RULES': ('chat_send', 'chat_send_ip'),
+    # Redis server relaying pushes between worker processes, None for this process only
+    'PUSH_REDIS_URL': None,
+}
+
+PUSH_CHANNEL = 'pimxchat:ws:push'
+
+# Close codes in the 4000-4999 range reserved for applications
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN_ORIGIN = 4403
+CLOSE_FRAME_TOO_LARGE = 1009
+
+logger = logging.getLogger(__name__)
+
+# user id -> open connections in this process, for multi-tab pushes
+_connections = defaultdict(set)
+
+# Tells this process's own relayed pushes apart from other workers'
+PROCESS_ID = uuid.uuid4().hex
+
+_relay = None
+
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'CHAT_WEBSOCKET', {}))
+
+
+def deliver(user_id, data, exclude=None):
+    """Push data to the user's sockets in this process"""
+    for connection in list(_connections.get(user_id, ())):
+        if connection is not exclude:
+            connection.push(data)
+
+
+class PushRelay:
+    """Fans pushes out to the other worker processes over Redis pub/sub"""
+
+    def __init__(self, url):
+        import redis.asyncio
+        self.url = url
+        self.client = redis.asyncio.from_url(url)
+        self.listener = None
+
+    def start(self):
+        """Subscribe in the background, again after a dropped connection"""
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.ensure_future(self.listen())
+
+    async def listen(self):
+        pubsub = self.client.pubsub()
+        try:
+            await pubsub.subscribe(PUSH_CHANNEL)
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    self.receive(message['data'])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("WebSocket push relay stopped listening")
+        finally:
+            await pubsub.aclose()
+
+    def receive(self, raw):
+        envelope = json.loads(raw)
+        if envelope['process'] != PROCESS_ID:
+            deliver(envelope['user'], envelope['data'])
+
+    async def publish(self, user_id, data):
+        envelope = {'process': PROCESS_ID, 'user': user_id, 'data': data}
+        await self.client.publish(PUSH_CHANNEL, json.dumps(envelope, ensure_ascii=False))
+
+
+def get_relay(config):
+    """The relay for config['PUSH_REDIS_URL'] (one per process), or None"""
+    global _relay
+    url = config['PUSH_REDIS_URL']
+    if not url:
+        return None
+    if _relay is None or _relay.url != url:
+        _relay = PushRelay(url)
+    return _relay
+
+
+def database_sync_to_async(func):
+    """Run ORM code in the sync thread, dropping stale connections like a request would"""
+    def inner(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(inner)
+
+
+def get_header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin1')
+    return None
+
+
+def origin_allowed(scope):
+    """Reject cross-site sockets: the cookie would otherwise authenticate any page's script"""
+    origin = get_header(scope, b'origin')
+    if origin is None:
+        # Not a browser, so there is no ambient cookie to abuse
+        return True
+    if urlsplit(origin).netloc == get_header(scope, b'host'):
+        return True
+    return origin in getattr(settings, 'CSRF_TRUSTED_ORIGINS', [])
+
+
+@database_sync_to_async
+def authenticate(scope):
+    """Resolve the Django user from the session cookie, or None"""
+    cookies = parse_cookie(get_header(scope, b'cookie') or '')
+    session_key = cookies.get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return None
+    engine = import_module(settings.SESSION_ENGINE)
+    # get_user() only needs request.session; it also checks the session auth hash
+    user = get_user(SimpleNamespace(session=engine.SessionStore(session_key)))
+    return user if user.is_authenticated else None
+
+
+@database_sync_to_async
+def get_session(user, session_id):
+    try:
+        return ChatSession.objects.get(id=session_id, user=user)
+    except (ChatSession.DoesNotExist, ValidationError):
+        return None
+
+
+class OperationError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ChatConnection:
+    def __init__(self, scope, receive, send, config):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.config = config
+        self.user = None
+        self.queue = asyncio.Queue(maxsize=config['SEND_QUEUE_SIZE'])
+        self.tasks = set()
+        self.needs_resync = False
+        self.relay = get_relay(config)
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+
+        if not origin_allowed(self.scope):
+            await self.send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN_ORIGIN})
+            return
+        self.user = await authenticate(self.scope)
+        if self.user is None:
+            await self.send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+            return
+
+        await self.send({'type': 'websocket.accept'})
+        _connections[self.user.pk].add(self)
+        if self.relay is not None:
+            self.relay.start()
+        writer = asyncio.ensure_future(self.writer())
+        try:
+            while True:
+                message = await self.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message['type'] != 'websocket.receive':
+                    continue
+                text = message.get('text')
+                if text is None:
+                    text = (message.get('bytes') or b'').decode('utf-8', 'replace')
+                if len(text.encode('utf-8')) > self.config['MAX_FRAME_BYTES']:
+                    writer.cancel()
+                    await self.send({'type': 'websocket.close', 'code': CLOSE_FRAME_TOO_LARGE})
+                    break
+                await self.dispatch(text)
+        finally:
+            _connections[self.user.pk].discard(self)
+            if not _connections[self.user.pk]:
+                del _connections[self.user.pk]
+            for task in list(self.tasks):
+                task.cancel()
+            writer.cancel()
+
+    async def writer(self):
+        """The only coroutine that calls send(), so frames never interleave"""
+        while True:
+            frame = await self.queue.get()
+            await self.send({'type': 'websocket.send', 'text': frame})
+            if self.needs_resync and self.queue.empty():
+                self.needs_resync = False
+                await self.send({'type': 'websocket.send', 'text': json.dumps({'type': 'resync'})})
+
+    async def reply(self, data):
+        """Queue a frame for this client, waiting while its queue is full"""
+        await self.queue.put(json.dumps(data, ensure_ascii=False))
+
+    def push(self, data):
+        """Queue a frame without waiting; a full queue turns pending pushes into one resync"""
+        try:
+            self.queue.put_nowait(json.dumps(data, ensure_ascii=False))
+        except asyncio.QueueFull:
+            self.needs_resync = True
+
+    async def broadcast(self, data):
+        """Push to the user's other sockets; this one already has the reply frame"""
+        deliver(self.user.pk, data, exclude=self)
+        if self.relay is None:
+            return
+        try:
+            await self.relay.publish(self.user.pk, data)
+        except Exception:
+            # The operation itself succeeded; other workers' tabs catch up on reload
+            logger.exception("Could not relay a WebSocket push")
+
+    async def dispatch(self, text):
+        try:
+            data = json.loads(text)
+            request_id = data.get('id')
+            handler = getattr(self, f"op_{data.get('type')}", None)
+        except (ValueError, AttributeError):
+            await self.reply({'type': 'error', 'status': 400, 'error': 'Invalid JSON'})
+            return
+        if handler is None:
+            await self.reply({'id': request_id, 'type': 'error', 'status': 400, 'error': 'Unknown operation'})
+            return
+        if len(self.tasks) >= self.config['MAX_IN_FLIGHT']:
+            await self.reply({'id': request_id, 'type': 'error', 'status': 429, 'error': 'Too many operations in flight'})
+            return
+
+        task = asyncio.ensure_future(self.run_operation(handler, request_id, data))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run_operation(self, handler, request_id, data):
+        try:
+            await handler(request_id, data)
+        except OperationError as e:
+            await self.reply({'id': request_id, 'type': 'error', 'status': e.status, 'error': str(e)})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("WebSocket operation failed")
+            await self.reply({'id': request_id, 'type': 'error', 'status': 500, 'error': str(e)})
+
+    async def require_session(self, data):
+        session = await get_session(self.user, data.get('session_id'))
+        if session is None:
+            raise OperationError('No ChatSession matches the given query.', status=404)
+        return session
+
+    async def op_send(self, request_id, data):
+        message_content = (data.get('message') or '').strip()
+        if not message_content:
+            raise OperationError('Message cannot be empty')
+        client_ip = (self.scope.get('client') or ('unknown',))[0]
+        retry_after = await sync_to_async(ratelimit.check)(self.config['RATE_LIMIT_RULES'], self.user, client_ip)
+        if retry_after:
+            await self.reply({'id': request_id, 'type': 'error', 'status': 429, 'error': 'Too many requests', 'retry_after': retry_after})
+            return
+
+        user_language = getattr(self.user, 'language', 'fa')
+        is_new = not data.get('session_id')
+        if is_new:
+            session = ChatSession(user=self.user, title="چت جدید")
+            context = ConversationContext()
+        else:
+            session = await self.require_session(data)
+            context = await database_sync_to_async(build_context)(session, message_content, user_language)
+
+        await self.reply({'id': request_id, 'type': 'start', 'session_id': str(session.id)})
+
+        cached_reply = None if context else await aget_cached_reply(message_content, user_language)
+        if cached_reply is not None:
+            parts = [cached_reply]
+            await self.reply({'id': request_id, 'type': 'delta', 'delta': cached_reply})
+        else:
+            parts = []
+            async for chunk in astream_gemini_api(message_content, user_language, context):
+                parts.append(chunk)
+                # Waits while the client is behind, which also pauses the upstream read
+                await self.reply({'id': request_id, 'type': 'delta', 'delta': chunk})
+
+        user_message, ai_message = await database_sync_to_async(save_exchange)(
+            session, message_content, ''.join(parts), is_new, is_first=not context
+        )
+        session_data = serialize_session(await get_session(self.user, session.id))
+        await self.reply({
+            'id': request_id,
+            'type': 'done',
+            'success': True,
+            'session_id': str(session.id),
+            'cached': cached_reply is not None,
+            'user_message': {
+                'id': user_message.id,
+                'content': user_message.content,
+                'timestamp': user_message.timestamp.strftime('%Y-%m-%d %H:%M')
+            },
+            'ai_message': {
+                'id': ai_message.id,
+                'content': ai_message.content,
+                'timestamp': ai_message.timestamp.strftime('%Y-%m-%d %H:%M')
+            },
+            'session': session_data
+        })
+        await self.broadcast({'type': 'session_updated', 'session': session_data})
+
+    async def op_rename(self, request_id, data):
+        new_title = (data.get('title') or '').strip()
+        if not new_title:
+            raise OperationError('Title cannot be empty')
+        if len(new_title) > 100:
+            raise OperationError('Title too long')
+
+        session = await self.require_session(data)
+        session.title = new_title
+        await database_sync_to_async(session.save)(update_fields=['title', 'updated_at'])
+
+        await self.reply({'id': request_id, 'type': 'result', 'success': True, 'title': session.title})
+        await self.broadcast({'type': 'session_updated', 'session': serialize_session(session)})
+
+    async def op_delete(self, request_id, data):
+        session = await self.require_session(data)
+        session_id = str(session.id)
+        await database_sync_to_async(delete_session)(session)
+
+        await self.reply({'id': request_id, 'type': 'result', 'success': True})
+        await self.broadcast({'type': 'session_deleted', 'session_id': session_id})
+
+    async def op_clear(self, request_id, data):
+        session = await self.require_session(data)
+        welcome_text = await database_sync_to_async(clear_session)(session, getattr(self.user, 'language', 'fa'))
+
+        await self.reply({'id': request_id, 'type': 'result', 'success': True, 'welcome_message': welcome_text})
+        await self.broadcast({'type': 'session_cleared', 'session_id': str(session.id), 'welcome_message': welcome_text})
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI application for the chat socket"""
+    await ChatConnection(scope, receive, send, get_config()).run()
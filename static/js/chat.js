@@ -247,6 +247,67 @@ window.convertToJalali = function(gregorianDate) {
     return `${hours}:${minutes} ${formattedYear}-${formattedMonth}-${formattedDay}`;
 };
 
+// One WebSocket for send/rename/delete/clear plus pushes from other tabs; callers use fetch while it is not open
+class ChatSocket {
+    constructor(onPush) {
+        this.onPush = onPush;
+        this.socket = null;
+        this.nextId = 1;
+        this.pending = new Map();
+        this.retryDelay = 1000;
+        this.connect();
+    }
+
+    get isOpen() {
+        return this.socket !== null && this.socket.readyState === WebSocket.OPEN;
+    }
+
+    connect() {
+        if (!window.WebSocket) return;
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        this.socket = new WebSocket(`${protocol}//${window.location.host}/ws/chat/`);
+        this.socket.addEventListener('open', () => {
+            this.retryDelay = 1000;
+        });
+        this.socket.addEventListener('message', (event) => {
+            this.handleFrame(JSON.parse(event.data));
+        });
+        this.socket.addEventListener('close', (event) => {
+            this.pending.forEach(({ reject }) => reject(new Error('WebSocket closed')));
+            this.pending.clear();
+            // Not logged in or wrong origin: retrying will not help
+            if (event.code === 4401 || event.code === 4403) return;
+            setTimeout(() => this.connect(), this.retryDelay);
+            this.retryDelay = Math.min(this.retryDelay * 2, 30000);
+        });
+    }
+
+    handleFrame(frame) {
+        const request = this.pending.get(frame.id);
+        if (!request) {
+            this.onPush(frame);
+            return;
+        }
+        if (frame.type === 'error') {
+            this.pending.delete(frame.id);
+            request.resolve({ success: false, error: frame.error, status: frame.status });
+        } else if (frame.type === 'result' || frame.type === 'done') {
+            this.pending.delete(frame.id);
+            request.resolve(frame);
+        } else if (request.onFrame) {
+            request.onFrame(frame);
+        }
+    }
+
+    request(type, payload, onFrame = null) {
+        return new Promise((resolve, reject) => {
+            const id = this.nextId++;
+            this.pending.set(id, { resolve, reject, onFrame });
+            this.socket.send(JSON.stringify(Object.assign({ id, type }, payload)));
+        });
+    }
+}
+
 class PIMXCHAT {
     constructor() {
         this.currentSessionId = null;
@@ -260,6 +321,12 @@ class PIMXCHAT {
             italic: false
         };
         this.emojis = this.initializeEmojis();
+        // Cursors for infinite scroll (older sessions / older messages)
+        this.historyCursor = null;
+        this.messagesCursor = null;
+        this.messagesCursorSessionId = null;
+        this.isLoadingHistory = false;
+        this.isLoadingMessages = false;
         this.init();
     }
 
@@ -269,6 +336,8 @@ class PIMXCHAT {
         this.initParticleSystem();
         this.initKeyboardEffects();
         this.loadChatHistory();
+        this.socket = new ChatSocket((frame) => this.handlePush(frame));
+        this.setupInfiniteScroll();
         this.setupAutoResize();
         this.initEmojiPicker();
         this.playWelcomeSound();
@@ -981,23 +1050,31 @@ class PIMXCHAT {
 
         try {
             console.log('Sending message to API...');
-            const response = await this.sendMessageToAPI(message);
+            const response = this.socket && this.socket.isOpen
+                ? await this.sendMessageSocket(message)
+                : await this.sendMessageStream(message);
             console.log('API response:', response);
             
             if (response.success) {
                 // Hide typing indicator
                 this.hideTypingIndicator();
                 
-                // Add AI response to UI
-                console.log('Adding AI response to UI:', response.ai_message.content);
-                this.addMessageToUI(response.ai_message.content, 'ai');
+                // Streamed replies are already on screen, only fall back to a full render
+                if (!response.streamed) {
+                    console.log('Adding AI response to UI:', response.ai_message.content);
+                    this.addMessageToUI(response.ai_message.content, 'ai');
+                }
                 this.playSound('notification');
                 
                 // Update current session
                 this.currentSessionId = response.session_id;
                 
-                // Update chat history
-                this.loadChatHistory();
+                // Update chat history (the socket reply already carries the sidebar entry)
+                if (response.session) {
+                    this.upsertHistoryItem(response.session);
+                } else {
+                    this.loadChatHistory();
+                }
             } else {
                 console.error('API returned error:', response.error);
                 throw new Error(response.error || 'Failed to send message');
@@ -1010,6 +1087,129 @@ class PIMXCHAT {
         }
     }
 
+    // Stream the AI reply over Server-Sent Events, rendering tokens as they arrive
+    async sendMessageStream(message) {
+        const response = await fetch('/api/chat/send/stream/', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': this.getCSRFToken()
+            },
+            body: JSON.stringify({
+                session_id: this.currentSessionId,
+                message: message
+            })
+        });
+
+        // Older browsers or proxies without streaming support use the regular endpoint
+        if (!response.ok || !response.body || !window.TextDecoder) {
+            return this.sendMessageToAPI(message);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const renderer = this.createStreamRenderer();
+        let buffer = '';
+        let result = { success: false, error: 'Stream ended unexpectedly' };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // SSE frames are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let data = '';
+                frame.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                if (!data) continue;
+                const payload = JSON.parse(data);
+
+                if (event === 'start') {
+                    this.currentSessionId = payload.session_id;
+                } else if (event === 'done') {
+                    result = Object.assign(payload, { streamed: renderer.streamed });
+                } else if (payload.delta) {
+                    renderer.append(payload.delta);
+                }
+            }
+        }
+
+        return result;
+    }
+
+    // Same stream as sendMessageStream, over the already authenticated WebSocket
+    async sendMessageSocket(message) {
+        const renderer = this.createStreamRenderer();
+        const result = await this.socket.request('send', {
+            session_id: this.currentSessionId,
+            message: message
+        }, (frame) => {
+            if (frame.type === 'start') {
+                this.currentSessionId = frame.session_id;
+            } else if (frame.type === 'delta') {
+                renderer.append(frame.delta);
+            }
+        });
+        return Object.assign(result, { streamed: renderer.streamed });
+    }
+
+    // Renders streamed tokens into one AI bubble, created on the first token
+    createStreamRenderer() {
+        const renderer = { content: '', bubble: null, streamed: false };
+        renderer.append = (delta) => {
+            if (!renderer.streamed) {
+                renderer.streamed = true;
+                this.hideTypingIndicator();
+                const messageDiv = this.addMessageToUI('', 'ai');
+                renderer.bubble = messageDiv ? messageDiv.querySelector('.message-bubble p') : null;
+            }
+            renderer.content += delta;
+            if (renderer.bubble) {
+                renderer.bubble.innerHTML = this.parseMarkdown(this.escapeHtml(renderer.content));
+                this.scrollToBottom();
+            }
+        };
+        return renderer;
+    }
+
+    // Pushed by the server when another tab changes one of this user's sessions
+    handlePush(frame) {
+        if (frame.type === 'session_updated') {
+            this.upsertHistoryItem(frame.session);
+        } else if (frame.type === 'session_deleted') {
+            const item = document.querySelector(`.chat-history-item[data-session-id="${frame.session_id}"]`);
+            if (item) item.remove();
+        } else if (frame.type === 'session_cleared') {
+            if (frame.session_id === this.currentSessionId) {
+                this.clearMessages();
+                this.addMessageToUI(frame.welcome_message, 'ai');
+            }
+        } else if (frame.type === 'resync') {
+            this.loadChatHistory();
+        }
+    }
+
+    // Move a session to the top of the sidebar, replacing its old entry
+    upsertHistoryItem(session) {
+        const chatHistory = document.getElementById('chatHistory');
+        if (!chatHistory) return;
+
+        const existing = chatHistory.querySelector(`.chat-history-item[data-session-id="${session.id}"]`);
+        if (existing) existing.remove();
+        chatHistory.insertBefore(this.createHistoryItem(session), chatHistory.firstChild);
+        if (session.id === this.currentSessionId) {
+            this.updateActiveSession(session.id);
+        }
+    }
+
     async sendMessageToAPI(message) {
         console.log('Making API call to /api/chat/send/');
         console.log('CSRF Token:', this.getCSRFToken());
@@ -1198,6 +1398,27 @@ class PIMXCHAT {
         }
     }
 
+    // Infinite scroll: older sessions at the bottom of the sidebar, older messages at the top of the chat
+    setupInfiniteScroll() {
+        const chatHistory = document.getElementById('chatHistory');
+        if (chatHistory) {
+            chatHistory.addEventListener('scroll', () => {
+                if (chatHistory.scrollTop + chatHistory.clientHeight >= chatHistory.scrollHeight - 100) {
+                    this.loadMoreChatHistory();
+                }
+            });
+        }
+
+        const messagesContainer = document.getElementById('chatMessages');
+        if (messagesContainer) {
+            messagesContainer.addEventListener('scroll', () => {
+                if (messagesContainer.scrollTop < 100) {
+                    this.loadOlderMessages();
+                }
+            });
+        }
+    }
+
     // Chat History
     async loadChatHistory() {
         console.log('Loading chat history...');
@@ -1207,17 +1428,36 @@ class PIMXCHAT {
             const data = await response.json();
             console.log('Chat history data:', data);
             
+            this.historyCursor = data.has_more ? data.before : null;
             this.renderChatHistory(data.sessions);
         } catch (error) {
             console.error('Error loading chat history:', error);
         }
     }
 
-    renderChatHistory(sessions) {
+    async loadMoreChatHistory() {
+        if (!this.historyCursor || this.isLoadingHistory) return;
+        this.isLoadingHistory = true;
+        try {
+            const response = await fetch(`/api/chat/sessions/?before=${encodeURIComponent(this.historyCursor)}`);
+            const data = await response.json();
+            
+            this.historyCursor = data.has_more ? data.before : null;
+            this.renderChatHistory(data.sessions, true);
+        } catch (error) {
+            console.error('Error loading more chat history:', error);
+        } finally {
+            this.isLoadingHistory = false;
+        }
+    }
+
+    renderChatHistory(sessions, append = false) {
         const chatHistory = document.getElementById('chatHistory');
         if (!chatHistory) return;
 
-        chatHistory.innerHTML = '';
+        if (!append) {
+            chatHistory.innerHTML = '';
+        }
 
         sessions.forEach(session => {
             const historyItem = this.createHistoryItem(session);
@@ -1276,6 +1516,8 @@ class PIMXCHAT {
             const data = await response.json();
             
             this.currentSessionId = sessionId;
+            this.messagesCursor = data.has_more ? data.before : null;
+            this.messagesCursorSessionId = sessionId;
             this.renderMessages(data.messages);
             
             // Update active state in sidebar
@@ -1296,6 +1538,44 @@ class PIMXCHAT {
         });
     }
 
+    async loadOlderMessages() {
+        // The cursor belongs to the session it was loaded for; a new or switched chat has none
+        if (!this.messagesCursor || this.messagesCursorSessionId !== this.currentSessionId || this.isLoadingMessages) return;
+        this.isLoadingMessages = true;
+        const sessionId = this.currentSessionId;
+        try {
+            const response = await fetch(`/api/chat/sessions/${sessionId}/messages/?before=${encodeURIComponent(this.messagesCursor)}`);
+            const data = await response.json();
+            if (sessionId !== this.currentSessionId) return;
+            
+            this.messagesCursor = data.has_more ? data.before : null;
+            this.prependMessages(data.messages);
+        } catch (error) {
+            console.error('Error loading older messages:', error);
+        } finally {
+            this.isLoadingMessages = false;
+        }
+    }
+
+    prependMessages(messages) {
+        const messagesContainer = document.getElementById('chatMessages');
+        if (!messagesContainer || !messages.length) return;
+
+        // Keep the visible message in place while older ones are inserted above it
+        const previousHeight = messagesContainer.scrollHeight;
+        const previousTop = messagesContainer.scrollTop;
+        const firstExisting = messagesContainer.firstChild;
+
+        messages.forEach(message => {
+            const element = this.addMessageToUI(message.content, message.message_type);
+            if (element) {
+                messagesContainer.insertBefore(element, firstExisting);
+            }
+        });
+
+        messagesContainer.scrollTop = messagesContainer.scrollHeight - previousHeight + previousTop;
+    }
+
     updateActiveSession(sessionId) {
         const historyItems = document.querySelectorAll('.chat-history-item');
         historyItems.forEach(item => {
@@ -1347,17 +1627,22 @@ class PIMXCHAT {
         }
         
         try {
-            const response = await fetch(`/api/chat/sessions/${sessionId}/delete/`, {
-                method: 'DELETE',
-                headers: {
-                    'X-CSRFToken': this.getCSRFToken()
-                }
-            });
-            
-            const data = await response.json();
+            let data;
+            if (this.socket && this.socket.isOpen) {
+                data = await this.socket.request('delete', { session_id: sessionId });
+            } else {
+                const response = await fetch(`/api/chat/sessions/${sessionId}/delete/`, {
+                    method: 'DELETE',
+                    headers: {
+                        'X-CSRFToken': this.getCSRFToken()
+                    }
+                });
+                data = await response.json();
+            }
             
             if (data.success) {
-                this.loadChatHistory();
+                const item = document.querySelector(`.chat-history-item[data-session-id="${sessionId}"]`);
+                if (item) item.remove();
                 this.playSound('notification');
                 if (window.showToast) {
                     window.showToast('Chat deleted successfully', 'success');
@@ -1456,6 +1741,9 @@ class PIMXCHAT {
     }
 
     async renameSession(sessionId, newTitle) {
+        if (this.socket && this.socket.isOpen) {
+            return this.socket.request('rename', { session_id: sessionId, title: newTitle });
+        }
         const response = await fetch(`/api/chat/sessions/${sessionId}/rename/`, {
             method: 'POST',
             headers: {
@@ -1493,14 +1781,18 @@ class PIMXCHAT {
         }
         
         try {
-            const response = await fetch(`/api/chat/sessions/${this.currentSessionId}/clear/`, {
-                method: 'POST',
-                headers: {
-                    'X-CSRFToken': this.getCSRFToken()
-                }
-            });
-            
-            const data = await response.json();
+            let data;
+            if (this.socket && this.socket.isOpen) {
+                data = await this.socket.request('clear', { session_id: this.currentSessionId });
+            } else {
+                const response = await fetch(`/api/chat/sessions/${this.currentSessionId}/clear/`, {
+                    method: 'POST',
+                    headers: {
+                        'X-CSRFToken': this.getCSRFToken()
+                    }
+                });
+                data = await response.json();
+            }
             
             if (data.success) {
                 this.clearMessages();
@@ -95,12 +95,16 @@ function updateUI() {
 function exportAllChats() {
     showNotification('در حال آماده‌سازی خروجی چت‌ها...', 'info');
     
-    // Simulate export process
-    setTimeout(() => {
-        const chatData = generateMockChatData();
-        downloadFile(chatData, 'pimxchat-chats.json', 'application/json');
-        showNotification('خروجی چت‌ها با موفقیت دانلود شد', 'success');
-    }, 2000);
+    // Streamed by the server (pimxchat/export.py); the browser saves it as it arrives
+    downloadFromServer('/api/chat/export/?format=ndjson&gzip=1');
+}
+
+function downloadFromServer(url) {
+    const a = document.createElement('a');
+    a.href = url;
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
 }
 
 function exportSettings() {
@@ -143,18 +147,7 @@ function exportStats() {
 function exportFullBackup() {
     showNotification('در حال ایجاد پشتیبان کامل...', 'info');
     
-    setTimeout(() => {
-        const backup = {
-            version: '1.0.0',
-            timestamp: new Date().toISOString(),
-            chats: generateMockChatData(),
-            settings: JSON.parse(localStorage.getItem('userSettings') || '{}'),
-            stats: generateMockStats()
-        };
-        
-        downloadFile(JSON.stringify(backup, null, 2), 'pimxchat-backup.json', 'application/json');
-        showNotification('پشتیبان کامل با موفقیت دانلود شد', 'success');
-    }, 3000);
+    downloadFromServer('/api/chat/export/?format=json');
 }
 
 function customExport() {
@@ -271,6 +264,12 @@ function handleDrop(event) {
 function processFile(file) {
     if (exportState.isUploading) return;
     
+    // History backups from /api/chat/export/ are imported by the server
+    if (/\.ndjson(\.gz)?$/i.test(file.name)) {
+        uploadHistoryBackup(file);
+        return;
+    }
+    
     exportState.isUploading = true;
     exportState.uploadProgress = 0;
     
@@ -319,6 +318,54 @@ function processFile(file) {
     reader.readAsText(file);
 }
 
+function uploadHistoryBackup(file) {
+    exportState.isUploading = true;
+    showNotification('در حال ارسال فایل...', 'info');
+    
+    const formData = new FormData();
+    formData.append('file', file);
+    fetch('/api/chat/import/', {
+        method: 'POST',
+        body: formData,
+        headers: { 'X-CSRFToken': getCookie('csrftoken') }
+    })
+        .then(response => response.json().then(data => ({ ok: response.ok, data })))
+        .then(({ ok, data }) => {
+            if (!ok) throw new Error(data.error || 'upload failed');
+            pollImportJob(data.status_url, file.name);
+        })
+        .catch(() => {
+            showNotification('خطا در ارسال فایل', 'error');
+            addToImportHistory(file.name, 'error');
+            exportState.isUploading = false;
+        });
+}
+
+function pollImportJob(statusUrl, filename) {
+    fetch(statusUrl)
+        .then(response => response.json())
+        .then(job => {
+            exportState.uploadProgress = job.progress;
+            if (job.status === 'done') {
+                showNotification(`${job.messages_created} پیام وارد شد (${job.duplicates_skipped} تکراری)`, 'success');
+                addToImportHistory(filename, 'success');
+                exportState.isUploading = false;
+            } else if (job.status === 'failed') {
+                showNotification('خطا در ورود تاریخچه', 'error');
+                addToImportHistory(filename, 'error');
+                exportState.isUploading = false;
+            } else {
+                setTimeout(() => pollImportJob(statusUrl, filename), 1000);
+            }
+        })
+        .catch(() => setTimeout(() => pollImportJob(statusUrl, filename), 3000));
+}
+
+function getCookie(name) {
+    const match = document.cookie.split(';').map(c => c.trim()).find(c => c.startsWith(name + '='));
+    return match ? decodeURIComponent(match.substring(name.length + 1)) : '';
+}
+
 function getFileType(filename) {
     const extension = filename.split('.').pop().toLowerCase();
     return extension;